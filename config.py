@@ -14,11 +14,18 @@ def str2bool(v):
         raise argparse.ArgumentTypeError('Boolean value expected.')
 
 
-def get_classify_config():
+def get_classify_config(args=None):
+    """
+    Args:
+        args: list, 要解析的命令行参数，为None时解析sys.argv，train_folds.py使用其解析转发给各个fold的参数
+    """
     parser = argparse.ArgumentParser()
 
     # -----------------------------------------超参数设置-----------------------------------------
     parser.add_argument('--batch_size', type=int, default=48, help='batch size')
+    parser.add_argument('--accumulation_steps', type=int, default=1,
+                        help='accumulate gradients over this many batches before each optimizer step, '
+                             'the effective batch size is batch_size * accumulation_steps.')
     parser.add_argument('--epoch', type=int, default=100, help='epoch')
     parser.add_argument('--lr', type=float, default=1e-3, help='init lr')
     parser.add_argument('--weight_decay', type=float, default=0, help='weight_decay in optimizer')
@@ -34,9 +41,49 @@ def get_classify_config():
                         default=[[224, 224], [256, 256], [288, 288], [320, 320]],
                         help='multi scale choice. For example --multi_scale_size [[224,224],[444,444]]')
     parser.add_argument('--multi_scale_interval', type=int, default=10, help='make a scale choice every [] iterations.')
+    parser.add_argument('--multi_scale_backend', type=str, choices=['main', 'pil', 'tensor'], default='pil',
+                        help='main: resize in the training loop; pil: resize each image in DataLoader workers; '
+                             'tensor: interpolate the whole batch in DataLoader workers.')
+    parser.add_argument('--uint8_transport', type=str2bool, nargs='?', const=True, default=False,
+                        help='DataLoader workers emit uint8 tensors and the whole batch is normalized on the training device.')
+    # 图片缓存设置
+    parser.add_argument('--image_cache', type=str, default='',
+                        help='directory of the pre-resized uint8 image cache, built on first use. Empty to disable.')
+    parser.add_argument('--image_cache_mode', type=str, choices=['largest', 'each'], default='largest',
+                        help='largest: cache only the largest scale and resize from it; each: cache every scale.')
+    parser.add_argument('--memory_cache_gb', type=float, default=0,
+                        help='RAM budget (GB) of the decoded image cache shared by all workers and folds. 0 to disable.')
+    parser.add_argument('--memory_cache_resize', type=str2bool, nargs='?', const=True, default=False,
+                        help='resize images to the largest training scale before putting them into the memory cache. '
+                             'Otherwise images keep their aspect ratio, scaled to cover the largest scale, and each slot holds '
+                             'the pixels of the most extreme --bucket_ratios.')
+    parser.add_argument('--val_cache', type=str, choices=['none', 'ram', 'mmap'], default='none',
+                        help='decode and resize the validation fold once and keep it as a uint8 array, '
+                             'ram: in memory; mmap: in a memory-mapped file keyed by the split file, fold and image size.')
+    parser.add_argument('--val_cache_root', type=str, default='data/val_cache',
+                        help='directory of the memory-mapped validation caches.')
+    # 长宽比分桶设置
+    parser.add_argument('--aspect_ratio_bucket', type=str2bool, nargs='?', const=True, default=False,
+                        help='group samples into aspect ratio buckets and resize each batch close to its native ratio.')
+    parser.add_argument('--bucket_ratios', type=json.loads, default=[0.5, 0.75, 1.0, 1.333, 2.0],
+                        help='width / height of each aspect ratio bucket. For example --bucket_ratios [0.75,1.0,1.333]')
+    # 采样设置
+    parser.add_argument('--sampler', type=str, choices=['random', 'imbalanced', 'class_aware'], default='random',
+                        help='random: shuffle the training set; imbalanced: sample each class with equal probability '
+                             'instead of oversampling images with expand_images/combine_dataset_dynamic.py; '
+                             'class_aware: every batch holds classes_per_batch classes with samples_per_class images each.')
+    parser.add_argument('--classes_per_batch', type=int, default=16, help='P of the class_aware sampler.')
+    parser.add_argument('--samples_per_class', type=int, default=3,
+                        help='K of the class_aware sampler, the batch size is P * K instead of batch_size. With torchrun '
+                             'P * K is the global batch size and each process takes P / world_size of the classes.')
+    parser.add_argument('--sampler_batches', type=int, default=0,
+                        help='batches per epoch of the class_aware sampler, 0 to cover about the whole training set.')
     # 数据增强设置
     parser.add_argument('--augmentation_flag', type=str2bool, nargs='?', const=True, default=True,
                         help='if true, use augmentation method in train set')
+    parser.add_argument('--augmentation_backend', type=str, choices=['albumentations', 'batch'], default='albumentations',
+                        help='albumentations: augment each image in DataLoader workers; batch: augment the whole batch '
+                             'tensor on the training device.')
     parser.add_argument('--erase_prob', type=float, default=0.0,
                         help='probability of random erase when augmentation_flag is True')
     parser.add_argument('--gray_prob', type=float, default=0.3,
@@ -58,6 +105,20 @@ def get_classify_config():
     parser.add_argument('--dataset_from_folder', type=str2bool, nargs='?', const=True, default=False,
                         help='If True, then load datasets distinguished by train and valid')
 
+    # DataLoader设置
+    parser.add_argument('--num_workers', type=int, default=8, help='number of DataLoader workers.')
+    parser.add_argument('--prefetch_factor', type=int, default=2, help='number of batches prefetched by each worker.')
+    parser.add_argument('--persistent_workers', type=str2bool, nargs='?', const=True, default=False,
+                        help='keep DataLoader workers alive between epochs.')
+    parser.add_argument('--cpu_affinity', type=str2bool, nargs='?', const=True, default=False,
+                        help='pin each DataLoader worker to one CPU core.')
+    parser.add_argument('--loader_autotune', type=str2bool, nargs='?', const=True, default=False,
+                        help='benchmark DataLoader settings on the training set and use the fastest one.')
+    parser.add_argument('--loader_autotune_batches', type=int, default=50,
+                        help='number of batches read for each DataLoader setting when autotuning.')
+    parser.add_argument('--loader_params', type=str, default='',
+                        help='path of a loader_params.json (or its log dir) saved by a previous run, overrides the settings above.')
+
     # -----------------------------------------模型设置-----------------------------------------
     parser.add_argument('--model_type', type=str, default='se_resnext101_32x4d',
                         help='densenet201/efficientnet-b5/se_resnext101_32x4d')
@@ -68,7 +129,37 @@ def get_classify_config():
                         help='Load the weight file before training.'
                              'if it is equal to `last`, load the `model_best.pth` in the last modification folder. '
                              'Otherwise, load the `model_best.pth` under the `restore` path.')
+    parser.add_argument('--resume', type=str, default='',
+                        help='Resume the full training state (model, optimizer, lr scheduler, epoch, batch, rng). '
+                             '`last` for the last modification folder, otherwise a log folder name, a folder path or '
+                             'the path of `<model_type>_fold<k>_state.pth`.')
+    parser.add_argument('--log_interval', type=int, default=10,
+                        help='read back the training accuracy and losses from the device and log them every this many batches, '
+                             '1 logs every batch.')
+    parser.add_argument('--checkpoint_queue_size', type=int, default=0,
+                        help='0 (default) saves checkpoints synchronously. A positive value writes them in a background '
+                             'thread with at most this many pending; training states wait for earlier checkpoints, '
+                             'and a crash can still lose the checkpoints that are pending.')
+    parser.add_argument('--checkpoint_store', type=str2bool, nargs='?', const=True, default=False,
+                        help='save checkpoints as small json manifests whose tensors are stored once by content hash '
+                             'under <train_url>/blobs (online: under the log dir).')
+    parser.add_argument('--archive_dtype', type=str, choices=['none', 'fp16', 'bf16'], default='fp16',
+                        help='dtype of floating point tensors in archived epoch snapshots when using --checkpoint_store.')
+    parser.add_argument('--dist_backend', type=str, choices=['', 'nccl', 'gloo'], default='',
+                        help='process group backend when launched by torchrun, empty means nccl with GPUs and gloo on CPU. '
+                             'batch_size is the global batch size and is split across the processes.')
+    parser.add_argument('--snapshot_interval', type=float, default=10,
+                        help='minutes between two mid-epoch training state snapshots, 0 means only at the end of each epoch.')
     parser.add_argument('--num_classes', type=int, default=54)
+    parser.add_argument('--device', type=str, choices=['auto', 'cuda', 'cpu'], default='auto',
+                        help='auto uses cuda when available. cpu: split the cores between compute threads and DataLoader '
+                             'workers, channels_last model and inputs, oneDNN fusion where supported.')
+    parser.add_argument('--cpu_threads', type=int, default=0,
+                        help='(--device cpu) compute threads, 0 keeps at most a quarter of the cores for DataLoader workers '
+                             'and uses the rest for compute. num_workers is capped by the remaining cores.')
+    parser.add_argument('--amp', type=str, choices=['none', 'fp16', 'bf16'], default='none',
+                        help='mixed precision training. fp16: float16 autocast with gradient scaling (GPU); '
+                             'bf16: bfloat16 autocast, also supported on CPU.')
 
     # -----------------------------------------学习率衰减策略与优化器设置-----------------------------------------
     # 学习率衰减策略
@@ -90,10 +181,21 @@ def get_classify_config():
     parser.add_argument('--train_url', type=str, default='./checkpoints',
                         help='the path to save training outputs. For example: s3://ai-competition-zdaiot/logs/')
     parser.add_argument('--data_url', type=str, default='data/huawei_data/combine')
+    parser.add_argument('--data_format', type=str, choices=['folder', 'shard'], default='folder',
+                        help='folder: one jpg and one txt file per sample in data_url; '
+                             'shard: data_url is a shard directory created by datasets/shard_dataset.py')
+    parser.add_argument('--data_staging', type=str2bool, nargs='?', const=True, default=False,
+                        help='(train_classifier_online) start training once the annotation files are local and copy '
+                             'the images from data_url in the background or on demand. data_url can be an OBS path '
+                             '(s3://, obs://) or a mounted directory.')
+    parser.add_argument('--staging_threads', type=int, default=16, help='number of background copy threads for data staging.')
+    parser.add_argument('--log_name', type=str, default='',
+                        help='name of the log folder under <train_url>/<model_type>, empty means log-<time>. '
+                             'train_folds.py sets it to <run>/fold<k>.')
     parser.add_argument('--model_snapshots_name', type=str, default='model_snapshots')
     parser.add_argument('--init_method', type=str)
 
-    config = parser.parse_args()
+    config = parser.parse_args(args)
     config.bucket_name = '/'.join(config.train_url.split('/')[:-2])
 
     pprint.pprint(config)
@@ -0,0 +1,166 @@
+'''
+该文件的功能：按照长宽比将样本分桶，同一个batch中的样本来自同一个桶，并被缩放到与该桶长宽比一致的尺寸
+
+与先填充为正方形（ResizeEqualRatio）再缩放相比，长边相同时不再有填充区域，每个batch的像素数更少；
+与直接缩放为正方形相比，图片不再被拉伸。CustomModel使用自适应池化，可以直接接受不同尺寸的输入。
+数据集正在从远端暂存时（DataStager）不为了读取长宽比而等待所有图片拷贝完成：尚未拷贝的样本暂时分到1:1的桶中，
+每个epoch开始时读取新拷贝到本地的图片头并重新分桶
+'''
+import os
+import math
+import random
+import tqdm
+import numpy as np
+from PIL import Image
+from torch.utils.data import Sampler
+from utils.distributed import is_main_process, broadcast_object
+
+DEFAULT_BUCKET_RATIOS = (0.5, 0.75, 1.0, 4 / 3, 2.0)
+
+
+def read_aspect_ratio(image_path):
+    """ 只读取图片头得到长宽比(width / height)
+    """
+    with Image.open(image_path) as image:
+        width, height = image.size
+    return width / height
+
+
+def get_aspect_ratios(data_root, sample_list, shard_reader=None):
+    """ 只读取图片头得到每一个样本的长宽比(width / height)
+
+    Args:
+        data_root: str, 数据集根目录
+        sample_list: list, 样本名
+        shard_reader: ShardReader, 不为None时从分片文件中读取
+    Returns:
+        aspect_ratios: np.ndarray, float32, [样本数]
+    """
+    aspect_ratios = np.empty(shape=(len(sample_list),), dtype=np.float32)
+    for index, sample_name in enumerate(tqdm.tqdm(sample_list, desc='Reading aspect ratios')):
+        if shard_reader is not None:
+            width, height = shard_reader.open_image(sample_name).size
+            aspect_ratios[index] = width / height
+        else:
+            aspect_ratios[index] = read_aspect_ratio(os.path.join(data_root, sample_name))
+    return aspect_ratios
+
+
+class StagedAspectRatios(object):
+    def __init__(self, sample_list, stager):
+        """ 数据集正在暂存时的长宽比，只读取已经拷贝到本地的图片，尚未拷贝的样本为nan
+
+        Args:
+            sample_list: list, 样本名
+            stager: DataStager
+        """
+        self.sample_list = sample_list
+        self.stager = stager
+        self.values = np.full(shape=(len(sample_list),), fill_value=np.nan, dtype=np.float32)
+        self.update()
+
+    @property
+    def complete(self):
+        return not np.isnan(self.values).any()
+
+    def update(self):
+        """ 读取新拷贝到本地的图片头；分布式训练时各个进程的拷贝进度不同，以rank 0读取的结果为准，使各个进程的分桶相同
+
+        Returns:
+            updated: bool, 是否有新读取的长宽比
+        """
+        if self.complete:
+            return False
+        values = self.values
+        if is_main_process():
+            values = values.copy()
+            for index in np.nonzero(np.isnan(values))[0]:
+                local_path = self.stager.local_path(self.sample_list[index])
+                # ensure先写入临时文件再重命名，存在的文件都是完整的
+                if os.path.exists(local_path):
+                    values[index] = read_aspect_ratio(local_path)
+        values = broadcast_object(values)
+        updated = int(np.isnan(values).sum()) != int(np.isnan(self.values).sum())
+        self.values = values
+        return updated
+
+
+def get_bucket_size(image_size, bucket_ratio, stride=32):
+    """ 得到某一个桶的目标尺寸：长边与image_size的长边相同，短边按照桶的长宽比计算，并对齐到stride
+
+    Args:
+        image_size: [height, width], 基准尺寸
+        bucket_ratio: float, 桶的长宽比(width / height)
+        stride: int, 尺寸对齐的步长
+    Returns:
+        bucket_size: [height, width]
+    """
+    long_side = max(image_size)
+    if bucket_ratio >= 1:
+        height, width = long_side / bucket_ratio, long_side
+    else:
+        height, width = long_side, long_side * bucket_ratio
+    return [max(stride, int(round(height / stride)) * stride), max(stride, int(round(width / stride)) * stride)]
+
+
+class AspectRatioBucketBatchSampler(Sampler):
+    def __init__(self, aspect_ratios, batch_size, image_size, bucket_ratios=None, shuffle=True,
+                 drop_last=False, multi_scale_size=None, multi_scale_interval=10):
+        """
+        Args:
+            aspect_ratios: np.ndarray, 每一个样本的长宽比(width / height)，与数据集中的样本一一对应；
+                也可以为StagedAspectRatios，每个epoch开始时更新，长宽比未知的样本分到最接近1:1的桶中
+            batch_size: int, 批量大小
+            image_size: [height, width], 基准尺寸，决定各个桶的长边
+            bucket_ratios: list, 各个桶的长宽比，为None时使用DEFAULT_BUCKET_RATIOS
+            shuffle: bool, 是否打乱桶内样本以及batch的顺序
+            drop_last: bool, 是否丢弃每个桶中不足batch_size的batch
+            multi_scale_size: list, [[height, width], ...], 不为None时每隔multi_scale_interval个batch随机选择一次基准尺寸
+            multi_scale_interval: int, 每隔多少个batch重新选择一次基准尺寸
+        """
+        self.batch_size = batch_size
+        self.image_size = image_size
+        self.bucket_ratios = list(bucket_ratios) if bucket_ratios else list(DEFAULT_BUCKET_RATIOS)
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.multi_scale_size = multi_scale_size
+        self.multi_scale_interval = multi_scale_interval
+        self.aspect_ratios = aspect_ratios
+        self._assign_buckets()
+
+    def _assign_buckets(self):
+        aspect_ratios = getattr(self.aspect_ratios, 'values', self.aspect_ratios)
+        aspect_ratios = np.nan_to_num(np.asarray(aspect_ratios, dtype=np.float32), nan=1.0)
+        # 在对数空间中寻找最接近的桶，使得1:2与2:1到1:1的距离相同
+        log_distance = np.abs(np.log(aspect_ratios)[:, None] -
+                              np.log(np.asarray(self.bucket_ratios, dtype=np.float32))[None, :])
+        bucket_ids = np.argmin(log_distance, axis=1)
+        self.buckets = [np.nonzero(bucket_ids == bucket_id)[0] for bucket_id in range(len(self.bucket_ratios))]
+
+    def __iter__(self):
+        # 暂存过程中分桶随着拷贝进度变化，恢复训练时被跳过的batch与中断前不完全相同
+        if isinstance(self.aspect_ratios, StagedAspectRatios) and self.aspect_ratios.update():
+            self._assign_buckets()
+        batches = []
+        for bucket_id, bucket in enumerate(self.buckets):
+            if self.shuffle:
+                bucket = np.random.permutation(bucket)
+            for start in range(0, len(bucket), self.batch_size):
+                batch = bucket[start:start + self.batch_size].tolist()
+                if len(batch) < self.batch_size and self.drop_last:
+                    continue
+                batches.append((bucket_id, batch))
+        if self.shuffle:
+            random.shuffle(batches)
+
+        image_size = self.image_size
+        for i, (bucket_id, batch) in enumerate(batches):
+            if self.multi_scale_size and i % self.multi_scale_interval == 0:
+                image_size = random.choice(self.multi_scale_size)
+            bucket_size = get_bucket_size(image_size, self.bucket_ratios[bucket_id])
+            yield [(index, bucket_size) for index in batch]
+
+    def __len__(self):
+        if self.drop_last:
+            return sum(len(bucket) // self.batch_size for bucket in self.buckets)
+        return sum(int(math.ceil(len(bucket) / self.batch_size)) for bucket in self.buckets)
@@ -0,0 +1,163 @@
+'''
+该文件的功能：对整个batch的图片张量进行数据增强，每张图片使用各自的随机参数
+
+与DataAugmentation中的增强方式一一对应：
+    RandomErasing: 随机擦除矩形区域，填充值为区域均值且R通道置零
+    RGB2GRAY: 随机转为灰度图
+    HorizontalFlip(p=0.5), VerticalFlip(p=0.25): 随机翻转
+    ShiftScaleRotate(shift_limit=0.07, rotate_limit=10, p=0.4): 通过仿射网格(affine_grid/grid_sample)实现，边界反射填充
+所有运算都在输入张量所在的设备上完成，可以在主进程的CPU上或者模型所在的GPU上执行，不再需要在DataLoader的worker中逐张增强
+'''
+import math
+import torch
+import torch.nn.functional as F
+
+
+class BatchAugmentation(object):
+    def __init__(self, erase_prob=0.0, full_aug=True, gray_prob=0.0, mean=None, std=None,
+                 shift_limit=0.07, scale_limit=0.1, rotate_limit=10, ssr_prob=0.4, hflip_prob=0.5, vflip_prob=0.25,
+                 erase_area=(0.02, 0.15), erase_ratio=0.3):
+        """
+        Args:
+            erase_prob: float, 随机擦除的概率
+            full_aug: bool, 是否进行随机翻转与平移缩放旋转
+            gray_prob: float, 随机灰度变换的概率
+            mean: tuple, 通道均值；不为None时输入为经过T.Normalize归一化后的张量，增强前后会进行反归一化与归一化
+            std: tuple, 通道方差
+            shift_limit: float, 平移量占图片宽高的最大比例
+            scale_limit: float, 缩放比例的范围为[1 - scale_limit, 1 + scale_limit]
+            rotate_limit: float, 最大旋转角度
+            ssr_prob: float, 平移缩放旋转的概率
+            hflip_prob: float, 水平翻转的概率
+            vflip_prob: float, 竖直翻转的概率
+            erase_area: tuple, 擦除区域占图片面积的比例范围
+            erase_ratio: float, 擦除区域长宽比的范围为[erase_ratio, 1 / erase_ratio]
+        """
+        self.erase_prob = erase_prob
+        self.full_aug = full_aug
+        self.gray_prob = gray_prob
+        self.mean = mean
+        self.std = std
+        self.shift_limit = shift_limit
+        self.scale_limit = scale_limit
+        self.rotate_limit = rotate_limit
+        self.ssr_prob = ssr_prob
+        self.hflip_prob = hflip_prob
+        self.vflip_prob = vflip_prob
+        self.erase_area = erase_area
+        self.erase_ratio = erase_ratio
+
+    def __call__(self, images):
+        """
+        Args:
+            images: [batch_size, 3, height, width] tensor, uint8（取值0~255）或者float
+        Returns:
+            images: 增强后的图片，数据类型、取值范围与所在设备均与输入相同
+        """
+        input_dtype = images.dtype
+        images = images.float()
+        if self.mean is not None:
+            mean = images.new_tensor(self.mean).view(1, -1, 1, 1) * 255
+            std = images.new_tensor(self.std).view(1, -1, 1, 1) * 255
+            images = images * std + mean
+
+        if self.erase_prob > 0:
+            images = self.random_erase(images)
+        if self.gray_prob > 0:
+            images = self.rgb2gray(images)
+        if self.full_aug:
+            images = self.random_flip(images, -1, self.hflip_prob)
+            images = self.random_flip(images, -2, self.vflip_prob)
+            images = self.shift_scale_rotate(images)
+
+        if self.mean is not None:
+            images = (images - mean) / std
+        if input_dtype == torch.uint8:
+            images = images.round_().clamp_(0, 255).to(torch.uint8)
+        return images
+
+    def _random_mask(self, images, probability):
+        return torch.rand(images.size(0), device=images.device) < probability
+
+    def random_flip(self, images, dim, probability):
+        mask = self._random_mask(images, probability)
+        if not mask.any():
+            return images
+        return torch.where(mask.view(-1, 1, 1, 1), images.flip(dim), images)
+
+    def rgb2gray(self, images):
+        mask = self._random_mask(images, self.gray_prob)
+        if not mask.any():
+            return images
+        # 与cv2.COLOR_RGB2GRAY的系数相同
+        weights = images.new_tensor([0.299, 0.587, 0.114]).view(1, 3, 1, 1)
+        gray = (images * weights).sum(dim=1, keepdim=True).expand_as(images)
+        return torch.where(mask.view(-1, 1, 1, 1), gray, images)
+
+    def shift_scale_rotate(self, images):
+        mask = self._random_mask(images, self.ssr_prob)
+        if not mask.any():
+            return images
+        selected = mask.nonzero().view(-1)
+        number, device = selected.numel(), images.device
+        height, width = images.shape[-2:]
+
+        def uniform(low, high):
+            return torch.rand(number, device=device) * (high - low) + low
+
+        angle = uniform(-self.rotate_limit, self.rotate_limit) * math.pi / 180
+        scale = uniform(1 - self.scale_limit, 1 + self.scale_limit)
+        shift_x = uniform(-self.shift_limit, self.shift_limit)
+        shift_y = uniform(-self.shift_limit, self.shift_limit)
+
+        # affine_grid的theta将输出图片的归一化坐标映射到输入图片的归一化坐标，即正向变换的逆变换；
+        # 旋转在像素坐标下进行，宽高不同时需要在归一化坐标与像素坐标之间换算
+        cos, sin = torch.cos(angle) / scale, torch.sin(angle) / scale
+        aspect = width / height
+        theta = torch.zeros(number, 2, 3, device=device)
+        theta[:, 0, 0] = cos
+        theta[:, 0, 1] = sin / aspect
+        theta[:, 1, 0] = -sin * aspect
+        theta[:, 1, 1] = cos
+        # 平移量为宽高的shift倍，对应归一化坐标下的2 * shift
+        theta[:, 0, 2] = -(theta[:, 0, 0] * shift_x + theta[:, 0, 1] * shift_y) * 2
+        theta[:, 1, 2] = -(theta[:, 1, 0] * shift_x + theta[:, 1, 1] * shift_y) * 2
+
+        grid = F.affine_grid(theta, [number, images.size(1), height, width], align_corners=False)
+        transformed = F.grid_sample(images[selected], grid, mode='bilinear', padding_mode='reflection', align_corners=False)
+        images = images.clone()
+        images[selected] = transformed
+        return images
+
+    def random_erase(self, images, attempts=10):
+        mask = self._random_mask(images, self.erase_prob)
+        if not mask.any():
+            return images
+        number, device = images.size(0), images.device
+        height, width = images.shape[-2:]
+
+        # 每张图片采样attempts次，取第一个能放入图片中的矩形
+        area = torch.empty(number, attempts, device=device).uniform_(*self.erase_area) * height * width
+        log_ratio = torch.empty(number, attempts, device=device).uniform_(math.log(self.erase_ratio),
+                                                                          -math.log(self.erase_ratio))
+        erase_h = torch.sqrt(area * torch.exp(log_ratio)).round().long()
+        erase_w = torch.sqrt(area / torch.exp(log_ratio)).round().long()
+        valid = (erase_h < height) & (erase_w < width)
+        first = valid.float().argmax(dim=1, keepdim=True)
+        erase_h = erase_h.gather(1, first).view(-1)
+        erase_w = erase_w.gather(1, first).view(-1)
+        mask = mask & valid.any(dim=1)
+
+        top = (torch.rand(number, device=device) * (height - erase_h + 1).float()).long()
+        left = (torch.rand(number, device=device) * (width - erase_w + 1).float()).long()
+        rows = torch.arange(height, device=device).view(1, -1)
+        cols = torch.arange(width, device=device).view(1, -1)
+        rows = (rows >= top.view(-1, 1)) & (rows < (top + erase_h).view(-1, 1))
+        cols = (cols >= left.view(-1, 1)) & (cols < (left + erase_w).view(-1, 1))
+        region = (rows.unsqueeze(2) & cols.unsqueeze(1) & mask.view(-1, 1, 1)).unsqueeze(1)
+
+        # 填充值为区域内的通道均值，R通道置零
+        region_float = region.float()
+        region_mean = (images * region_float).sum(dim=(2, 3)) / region_float.sum(dim=(2, 3)).clamp(min=1)
+        region_mean[:, 0] = 0
+        return torch.where(region, region_mean.view(number, -1, 1, 1).expand_as(images), images)
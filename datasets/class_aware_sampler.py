@@ -0,0 +1,86 @@
+'''
+该文件的功能：类别均衡的P×K批采样器，每个batch包含P个类别，每个类别K个样本
+
+各类别的索引数组在初始化时预先计算并打乱，生成一个batch只需要从类别队列中取出P个类别、再从每个类别的索引数组中取出K个索引，
+耗时与batch大小成正比，与数据集大小无关。
+DistributedDataParallel训练时P×K为所有进程的总批量大小，与batch_size的含义相同：各个进程生成相同的全局batch，
+由SplitBatchSampler均分，每个进程取其中P / world_size个类别
+'''
+import numpy as np
+from torch.utils.data import Sampler
+
+
+def get_sampler_params(config):
+    """ 根据配置得到ClassAwareBatchSampler的参数
+
+    Args:
+        config: 配置参数
+    Returns:
+        sampler_params: dict
+    """
+    return {
+        'classes_per_batch': config.classes_per_batch,
+        'samples_per_class': config.samples_per_class,
+        'num_batches': config.sampler_batches or None
+    }
+
+
+class ClassAwareBatchSampler(Sampler):
+    def __init__(self, labels, classes_per_batch, samples_per_class, num_batches=None, num_replicas=1):
+        """
+        Args:
+            labels: list/np.ndarray, 数据集中每一个样本的类标，与数据集的索引一一对应
+            classes_per_batch: int, P, 每个batch包含的类别数，大于类别总数时取类别总数
+            samples_per_class: int, K, 每个类别在一个batch中的样本数；某个类别的样本数不足K时有放回地采样
+            num_batches: int, 每个epoch的batch数，为None时使每个epoch的样本数与数据集大小大致相同
+            num_replicas: int, 分布式训练的进程数，P向下取整为其倍数，使每个进程分到相同数量的类别
+        """
+        labels = np.asarray(labels)
+        self.class_indices = [np.nonzero(labels == label)[0] for label in np.unique(labels)]
+        self.classes_per_batch = min(classes_per_batch, len(self.class_indices))
+        if self.classes_per_batch % num_replicas:
+            if self.classes_per_batch < num_replicas:
+                raise ValueError('classes_per_batch (%d) must be at least the number of processes (%d).'
+                                 % (self.classes_per_batch, num_replicas))
+            rounded = self.classes_per_batch // num_replicas * num_replicas
+            print('classes_per_batch %d is not divisible by %d processes, using %d.'
+                  % (self.classes_per_batch, num_replicas, rounded))
+            self.classes_per_batch = rounded
+        self.samples_per_class = samples_per_class
+        self.batch_size = self.classes_per_batch * self.samples_per_class
+        self.num_batches = num_batches if num_batches else max(1, len(labels) // self.batch_size)
+
+    def _reset(self):
+        # 每个epoch开始时重新打乱，使得每个epoch的顺序只取决于当时的随机数状态，便于ResumableBatchSampler复现
+        self._class_order = np.random.permutation(len(self.class_indices))
+        self._class_pointer = 0
+        self._sample_orders = [np.random.permutation(indices) for indices in self.class_indices]
+        self._sample_pointers = [0] * len(self.class_indices)
+
+    def _next_classes(self):
+        if self._class_pointer + self.classes_per_batch > len(self._class_order):
+            # 剩余的类别不足P个时重新打乱，保证同一个batch中的类别互不相同
+            self._class_order = np.random.permutation(len(self.class_indices))
+            self._class_pointer = 0
+        classes = self._class_order[self._class_pointer:self._class_pointer + self.classes_per_batch]
+        self._class_pointer += self.classes_per_batch
+        return classes
+
+    def _next_samples(self, class_id):
+        indices = self.class_indices[class_id]
+        if len(indices) < self.samples_per_class:
+            return np.random.choice(indices, self.samples_per_class, replace=True)
+        pointer = self._sample_pointers[class_id]
+        if pointer + self.samples_per_class > len(indices):
+            self._sample_orders[class_id] = np.random.permutation(indices)
+            pointer = 0
+        self._sample_pointers[class_id] = pointer + self.samples_per_class
+        return self._sample_orders[class_id][pointer:pointer + self.samples_per_class]
+
+    def __iter__(self):
+        self._reset()
+        for _ in range(self.num_batches):
+            yield np.concatenate([self._next_samples(class_id) for class_id in self._next_classes()]).tolist()
+
+    def __len__(self):
+        return self.num_batches
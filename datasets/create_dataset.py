@@ -7,87 +7,136 @@ import matplotlib.pylab as plt
 plt.switch_backend('agg')
 from matplotlib.font_manager import FontProperties
 from sklearn.model_selection import train_test_split, StratifiedKFold
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, BatchSampler, RandomSampler, SequentialSampler
+from torch.utils.data.distributed import DistributedSampler
 import torchvision.transforms as T
 import collections
+from datasets.shard_dataset import ShardReader
+from datasets.image_decode import decode_image
+from datasets.manifest import load_manifest
+from datasets.image_cache import build_resized_cache
+from datasets.multi_scale import MultiScaleBatchSampler, MultiScaleCollate
+from datasets.aspect_ratio_sampler import AspectRatioBucketBatchSampler, StagedAspectRatios, get_aspect_ratios
+from datasets.loader_tuning import build_loader_kwargs
+from datasets.memory_cache import SharedImageCache, get_max_aspect_ratio
+from datasets.staging import StagingBatchSampler
+from datasets.imbalanced_sampler import ImbalancedDatasetSampler
+from datasets.class_aware_sampler import ClassAwareBatchSampler
+from datasets.preprocessing import PreprocessPipeline
+from datasets.resumable_sampler import ResumableBatchSampler
+from datasets.sample_registry import SampleRegistry
+from datasets.val_cache import CachedValLoader, get_val_cache_path
+from datasets.distributed_sampler import ShardedBatchSampler, ShardedSequentialSampler, SplitBatchSampler
+from utils.distributed import get_rank, get_world_size
+
+
+def read_image(data_root, image_name, shard_reader=None, image_cache=None, size=None, memory_cache=None, stager=None):
+    """ 读取一张图片，兼容逐文件存放与分片存放两种数据集格式
+
+    Args:
+        data_root: str, 数据集根目录
+        image_name: str, 图片名称
+        shard_reader: ShardReader, 不为None时从分片文件中读取
+        image_cache: ResizedImageCache, 不为None且命中时直接返回缓存中已经缩放过的图片，跳过JPEG解码
+        size: [height, width], 之后要缩放到的目标大小，用于选择缓存的尺度以及JPEG的DCT缩放解码
+        memory_cache: SharedImageCache, 不为None时优先从共享内存缓存中读取，未命中时按照缓存的decode_size解码并存入缓存
+        stager: DataStager, 不为None时数据集正在从远端暂存到data_root，图片尚未拷贝时立即拷贝
+    Returns:
+        image: PIL.Image, RGB格式的图片
+    """
+    if image_cache is not None:
+        image = image_cache.get(image_name, size)
+        if image is not None:
+            return Image.fromarray(image)
+    if memory_cache is not None:
+        image = memory_cache.get(image_name)
+        if image is None:
+            image = memory_cache.put(
+                image_name, read_image(data_root, image_name, shard_reader, size=memory_cache.decode_size, stager=stager)
+            )
+        return Image.fromarray(image)
+    if shard_reader is not None:
+        return decode_image(shard_reader.read_bytes(image_name), size)
+    if stager is not None:
+        return decode_image(stager.ensure(image_name), size)
+    return decode_image(os.path.join(data_root, image_name), size)
 
 
 class TrainDataset(Dataset):
-    def __init__(self, data_root, sample_list, label_list, size, mean, std, transforms=None, choose_dataset='combine', multi_scale=False):
+    def __init__(self, data_root, sample_list, label_list, size, mean, std, transforms=None, choose_dataset='combine', multi_scale=False,
+                 shard_reader=None, image_cache=None, scale_backend='pil', memory_cache=None, stager=None,
+                 uint8_transport=False):
         """
         Args:
             data_root: str, 数据集根目录
-            sample_list: list, 样本名
-            label_list: list, 类标, 与sample_list中的样本按照顺序对应
+            sample_list: list, 样本名，按照choose_dataset筛选后保存为SampleRegistry
+            label_list: list, 类标, 与sample_list中的样本按照顺序对应，保存为int16数组
             size: [height, width], 图片的目标大小
             mean: tuple, 通道均值
             std: tuple, 通道方差
             transforms: callable, 数据集转换方式
             choose_dataset: str，选择什么数据集
             multi_scale: bool, 是否使用多尺度训练
+            shard_reader: ShardReader, 不为None时从分片文件中读取图片
+            image_cache: ResizedImageCache, 不为None时优先从缩放后的图片缓存中读取
+            scale_backend: str, 索引为MultiScaleBatchSampler产生的(index, size)时的缩放方式，
+                pil: 在此处直接缩放到size; tensor: 按照self.size输出，由MultiScaleCollate对整个batch插值
+            memory_cache: SharedImageCache, 不为None时使用各个worker与各折共享的内存缓存
+            stager: DataStager, 不为None时图片尚未暂存到本地时按需拷贝
+            uint8_transport: bool, 为True时输出未归一化的uint8 tensor（多尺度训练时同样如此），由Solver.forward归一化
         """
         super(TrainDataset, self).__init__()
         self.data_root = data_root
-        self.sample_list = sample_list
-        self.label_list = label_list
+        self.shard_reader = shard_reader
+        self.image_cache = image_cache
+        self.memory_cache = memory_cache
+        self.stager = stager
         self.choose_dataset = choose_dataset
-
-        if self.choose_dataset == 'combine':
-            pass
-        else:
-            sample_list = []
-            label_list = []
-            for sample, label in zip(self.sample_list, self.label_list):
-                if self.choose_dataset == 'only_self':
-                    if 'img' in sample:
-                        sample_list.append(sample)
-                        label_list.append(label)
-                elif self.choose_dataset == 'only_official':
-                    if 'img' not in sample:
-                        sample_list.append(sample)
-                        label_list.append(label)
-            self.sample_list = sample_list
-            self.label_list = label_list        
+        # 样本名与类标保存在numpy数组中，避免worker访问时复制共享的内存页
+        self.sample_list = SampleRegistry(sample_list, label_list, choose_dataset)
+        self.label_list = self.sample_list.labels
         
         self.size = size
         self.mean = mean
         self.std = std
         self.transforms = transforms
         self.multi_scale = multi_scale
+        self.scale_backend = scale_backend
+        self.uint8_transport = uint8_transport
+        self.preprocess = PreprocessPipeline(mean, std, transforms, uint8_output=uint8_transport)
     
     def __getitem__(self, index):
         """
         Args:
-            index: int, 当前的索引下标
+            index: int, 当前的索引下标；或者为(index, size)，size为MultiScaleBatchSampler为该batch选择的尺度
 
         Returns:
             image_name: str；图片名称
             image: [channel, height, width] tensor, 当前索引下标对应的图像数据
             label: [1] tensor, 当前索引下标对应的图像数据对应的类标
+            size: [height, width], 仅当index为(index, size)时返回，供MultiScaleCollate使用
         """
+        size, size_given = self.size, isinstance(index, (tuple, list))
+        if size_given:
+            index, size = index
+        resize_size = size if self.scale_backend == 'pil' else self.size
+
         image_name = self.sample_list[index]
-        sample_path = os.path.join(self.data_root, image_name)
-        image = Image.open(sample_path).convert('RGB')
-        label = self.label_list[index]
-        if self.transforms:
-            image = np.asarray(image)
-            image = self.transforms(image)
-            image = Image.fromarray(image)
-        
-        # 如果不进行多尺度训练，则将图片转换为指定的图片大小，并转换为tensor
-        if self.multi_scale:
-            image = T.Resize(self.size, interpolation=3)(image)
-            image = np.asarray(image)
+        image = read_image(self.data_root, image_name, self.shard_reader, self.image_cache, resize_size, self.memory_cache,
+                           self.stager)
+        label = int(self.label_list[index])
+
+        # 缩放到指定的图片大小后进行数据增强；如果不进行多尺度训练或者使用uint8传输，则转换为tensor
+        if self.multi_scale and not self.uint8_transport:
+            image = self.preprocess(image, self.size, to_tensor=False)
+        elif self.multi_scale:
+            image = self.preprocess(image, self.size)
         else:
-            transform_train_list = [
-                        T.Resize(self.size, interpolation=3),
-                        T.ToTensor(),
-                        T.Normalize(self.mean, self.std)
-                    ]          
-            transform_compose = T.Compose(transform_train_list)
-            image = transform_compose(image)
+            image = self.preprocess(image, resize_size)
         label = torch.tensor(label).long()
 
+        if size_given:
+            return image_name, image, label, size
         return image_name, image, label
 
     def __len__(self):
@@ -97,75 +146,84 @@ class TrainDataset(Dataset):
     
 
 class ValDataset(Dataset):
-    def __init__(self, data_root, sample_list, label_list, size, mean, std, choose_dataset='combine', multi_scale=False):
+    def __init__(self, data_root, sample_list, label_list, size, mean, std, choose_dataset='combine', multi_scale=False,
+                 shard_reader=None, image_cache=None, memory_cache=None, stager=None, uint8_transport=False):
         """
         Args:
             data_root: str, 数据集根目录
-            sample_list: list, 样本名
-            label_list: list, 类标, 与sample_list中的样本按照顺序对应
+            sample_list: list, 样本名，按照choose_dataset筛选后保存为SampleRegistry
+            label_list: list, 类标, 与sample_list中的样本按照顺序对应，保存为int16数组
             size: [height, width], 图片的目标大小
             mean: tuple, 通道均值
             std: tuple, 通道方差
             choose_dataset: str，选择什么数据集
             multi_scale: bool, 是否使用多尺度训练
+            shard_reader: ShardReader, 不为None时从分片文件中读取图片
+            image_cache: ResizedImageCache, 不为None时优先从缩放后的图片缓存中读取
+            memory_cache: SharedImageCache, 不为None时使用各个worker与各折共享的内存缓存
+            stager: DataStager, 不为None时图片尚未暂存到本地时按需拷贝
+            uint8_transport: bool, 为True时输出未归一化的uint8 tensor，由Solver.forward归一化
         """
         super(ValDataset, self).__init__()
         self.data_root = data_root
-        self.sample_list = sample_list
-        self.label_list = label_list
+        self.shard_reader = shard_reader
+        self.image_cache = image_cache
+        self.memory_cache = memory_cache
+        self.stager = stager
         self.choose_dataset = choose_dataset
-
-        if self.choose_dataset == 'combine':
-            pass
-        else:
-            sample_list = []
-            label_list = []
-            for sample, label in zip(self.sample_list, self.label_list):
-                if self.choose_dataset == 'only_self':
-                    if 'img' in sample:
-                        sample_list.append(sample)
-                        label_list.append(label)
-                elif self.choose_dataset == 'only_official':
-                    if 'img' not in sample:
-                        sample_list.append(sample)
-                        label_list.append(label)
-            self.sample_list = sample_list
-            self.label_list = label_list        
+        # 样本名与类标保存在numpy数组中，避免worker访问时复制共享的内存页
+        self.sample_list = SampleRegistry(sample_list, label_list, choose_dataset)
+        self.label_list = self.sample_list.labels
 
         self.size = size
         self.mean = mean
         self.std = std
         self.multi_scale = multi_scale
+        self.uint8_transport = uint8_transport
+        self.preprocess = PreprocessPipeline(mean, std, uint8_output=uint8_transport)
     
     def __getitem__(self, index):
         """
         Args:
-            index: int, 当前的索引下标
+            index: int, 当前的索引下标；或者为(index, size)，size为AspectRatioBucketBatchSampler为该batch选择的尺寸
 
         Returns:
             image_name: str；图片名称
             image: [channel, height, width] tensor, 当前索引下标对应的图像数据
             label: [1] tensor, 当前索引下标对应的图像数据对应的类标
+            size: [height, width], 仅当index为(index, size)时返回，供MultiScaleCollate使用
         """
+        size, size_given = self.size, isinstance(index, (tuple, list))
+        if size_given:
+            index, size = index
+
         image_name = self.sample_list[index]
-        sample_path = os.path.join(self.data_root, image_name)
-        image = Image.open(sample_path).convert('RGB')
-        label = self.label_list[index]
+        image = self.read(index, size)
+        label = int(self.label_list[index])
         
         if self.multi_scale:
-            image = T.Resize(self.size, interpolation=3)(image)
+            image = T.Resize(size, interpolation=3)(image)
         else:
-            transform_val_list = [ 
-                        T.Resize(self.size, interpolation=3),
-                        T.ToTensor(),
-                        T.Normalize(self.mean, self.std)
-                    ]          
-            transform_compose = T.Compose(transform_val_list)
-            image = transform_compose(image)
+            image = self.preprocess(image, size)
         label = torch.tensor(label).long()
 
+        if size_given:
+            return image_name, image, label, size
         return image_name, image, label
 
+    def read(self, index, size=None):
+        """ 读取一个样本的图片，不进行缩放之外的任何处理
+
+        Args:
+            index: int, 样本的索引
+            size: [height, width], 解码时的目标大小，为None时使用self.size
+        Returns:
+            image: PIL.Image
+        """
+        size = size or self.size
+        return read_image(self.data_root, self.sample_list[index], self.shard_reader, self.image_cache, size,
+                          self.memory_cache, self.stager)
+
     def __len__(self):
         """ 得到训练数据集总共有多少个样本
         """
@@ -180,7 +238,9 @@ class GetDataloader(object):
         test_size=None, 
         label_names_path='data/huawei_data/label_id_name.json', 
         choose_dataset='combine',
-        load_split_from_file=None
+        load_split_from_file=None,
+        data_format='folder',
+        stager=None
         ):
         """
         Args:
@@ -190,9 +250,13 @@ class GetDataloader(object):
             label_names_path: str, label_id_name.json的路径
             choose_dataset: str，选择什么数据集
             load_split_from_file: str, 存放数据集划分的文件的路径，如果存在则从文件加载，否则在线生成
+            data_format: str, folder: 每个样本为单独的jpg与txt文件; shard: data_root为pack_dataset生成的分片目录
+            stager: DataStager, 不为None时data_root中只保证标注文件已经就绪，图片由stager在后台或按需拷贝
         """
         self.data_root = data_root
+        self.stager = stager
         self.folds_split = folds_split
+        self.shard_reader = ShardReader(data_root) if data_format == 'shard' else None
         self.samples, self.labels = self.get_samples_labels()
         self.test_size = test_size
         self.choose_dataset = choose_dataset
@@ -205,7 +269,11 @@ class GetDataloader(object):
             if not test_size:
                 raise ValueError('You must specified test_size when folds_split equal to 1.')
     
-    def get_dataloader(self, batch_size, image_size, mean, std, transforms=None, multi_scale=False, draw_distribution=True):
+    def get_dataloader(self, batch_size, image_size, mean, std, transforms=None, multi_scale=False, draw_distribution=True,
+                       image_cache=None, multi_scale_size=None, multi_scale_interval=10, multi_scale_backend='main',
+                       aspect_ratio_bucket=False, bucket_ratios=None, loader_params=None, memory_cache=None, sampler='random',
+                       sampler_params=None, uint8_transport=False, val_cache='none', val_cache_root='data/val_cache',
+                       distributed=False):
         """得到数据加载器
         Args:
             batch_size: int, 批量大小
@@ -215,6 +283,21 @@ class GetDataloader(object):
             transforms: callable, 数据增强方式
             multi_scale: bool, 是否使用多尺度训练
             draw_distribution: bool, 是否画出分布图
+            image_cache: ResizedImageCache, 缩放后的图片缓存，为None时每次都解码原图
+            multi_scale_size: list, [[height, width], ...], 多尺度训练时尺度的可选范围
+            multi_scale_interval: int, 每隔多少个batch重新选择一次尺度
+            multi_scale_backend: str, main: 在训练循环中调用multi_scale_transforms缩放;
+                pil/tensor: 由MultiScaleBatchSampler选择尺度，在DataLoader的worker中逐张/整个batch缩放
+            aspect_ratio_bucket: bool, 是否按照长宽比分桶，将每个batch缩放到接近其原始长宽比的尺寸
+            bucket_ratios: list, 各个桶的长宽比(width / height)
+            loader_params: dict, DataLoader的参数（worker数、预取深度等），见datasets/loader_tuning.py
+            memory_cache: SharedImageCache, 由build_memory_cache构建，所有折共享
+            sampler: str, 训练集的采样方式，random/imbalanced/class_aware
+            sampler_params: dict, class_aware采样的参数，见create_train_dataloader
+            uint8_transport: bool, 数据集是否输出未归一化的uint8 tensor
+            val_cache: str, none/ram/mmap, 验证集的缓存方式，见create_val_dataloader
+            val_cache_root: str, mmap模式下验证集缓存文件的目录
+            distributed: bool, 是否将训练集与验证集划分到DistributedDataParallel的各个进程，batch_size为每个进程的批量大小
         Return:
             train_dataloader_folds: list, [train_dataloader_0, train_dataloader_1,...]
             valid_dataloader_folds: list, [val_dataloader_0, val_dataloader_1, ...]
@@ -223,9 +306,16 @@ class GetDataloader(object):
         """
         train_lists, val_lists = self.get_split()
         train_dataloader_folds, valid_dataloader_folds = list(), list()
+        if aspect_ratio_bucket and image_cache is not None:
+            # 缓存中的图片已被缩放为固定尺寸，丢失了原始长宽比
+            print('Image cache is disabled when using aspect ratio buckets.')
+            image_cache = None
+        if aspect_ratio_bucket and memory_cache is not None and memory_cache.resize:
+            print('Memory cache is disabled when using aspect ratio buckets with resize.')
+            memory_cache = None
         train_labels_number_folds, val_labels_number_folds = self.draw_train_val_distribution(train_lists, val_lists, draw_distribution)
 
-        for train_list, val_list in zip(train_lists, val_lists):
+        for fold_index, (train_list, val_list) in enumerate(zip(train_lists, val_lists)):
             train_dataset = TrainDataset(
                 self.data_root, 
                 train_list[0], 
@@ -235,7 +325,13 @@ class GetDataloader(object):
                 mean=mean, 
                 std=std, 
                 choose_dataset=self.choose_dataset, 
-                multi_scale=multi_scale
+                multi_scale=multi_scale and multi_scale_backend == 'main',
+                shard_reader=self.shard_reader,
+                image_cache=image_cache,
+                scale_backend=multi_scale_backend,
+                memory_cache=memory_cache,
+                stager=self.stager,
+                uint8_transport=uint8_transport
                 )
             # 默认不在验证集上进行多尺度
             val_dataset = ValDataset(
@@ -246,27 +342,62 @@ class GetDataloader(object):
                 mean=mean, 
                 std=std, 
                 choose_dataset=self.choose_dataset, 
-                multi_scale=False
+                multi_scale=False,
+                shard_reader=self.shard_reader,
+                image_cache=image_cache,
+                memory_cache=memory_cache,
+                stager=self.stager,
+                uint8_transport=uint8_transport
                 )
 
-            train_dataloader = DataLoader(
+            train_dataloader = create_train_dataloader(
                 train_dataset,
-                batch_size=batch_size,
-                num_workers=8,
-                pin_memory=True,
-                shuffle=True
+                batch_size,
+                multi_scale_size=multi_scale_size if multi_scale else None,
+                multi_scale_interval=multi_scale_interval,
+                multi_scale_backend=multi_scale_backend,
+                aspect_ratio_bucket=aspect_ratio_bucket,
+                bucket_ratios=bucket_ratios,
+                loader_params=loader_params,
+                sampler=sampler,
+                sampler_params=sampler_params,
+                distributed=distributed
             )
-            val_dataloader = DataLoader(
-                val_dataset,
-                batch_size=batch_size,
-                num_workers=8,
-                pin_memory=True,
-                shuffle=False
+            val_cache_path = get_val_cache_path(
+                val_cache_root, self.load_split_from_file, fold_index, val_dataset.sample_list, image_size
+            )
+            val_dataloader = create_val_dataloader(
+                val_dataset, batch_size, aspect_ratio_bucket, bucket_ratios, loader_params, val_cache, val_cache_path, distributed
             )
             train_dataloader_folds.append(train_dataloader)
             valid_dataloader_folds.append(val_dataloader)
         return train_dataloader_folds, valid_dataloader_folds, train_labels_number_folds, val_labels_number_folds
 
+    def build_image_cache(self, cache_root, sizes, mode='largest'):
+        """ 为数据集中的所有样本构建（或增量更新）缩放后的uint8图片缓存
+
+        Args:
+            cache_root: str, 缓存目录
+            sizes: list, [[height, width], ...], 训练与验证时用到的所有尺度
+            mode: str, largest: 只缓存面积最大的尺度; each: 缓存每一个尺度
+        Returns:
+            image_cache: ResizedImageCache, 传给get_dataloader的image_cache参数
+        """
+        return build_resized_cache(self.data_root, self.samples.tolist(), cache_root, sizes, mode, self.shard_reader)
+
+    def build_memory_cache(self, budget_bytes, decode_size, resize=False, bucket_ratios=None):
+        """ 为数据集中的所有样本构建共享内存缓存，需要在创建DataLoader之前调用，各折共享同一个缓存
+
+        Args:
+            budget_bytes: int, 缓存可以使用的内存字节数
+            decode_size: [height, width], 解码时的目标大小，一般为训练时用到的最大尺度
+            resize: bool, 是否在存入缓存前缩放到decode_size
+            bucket_ratios: list, 长宽比分桶的各个长宽比，决定resize为False时槽的大小，为None时使用默认值
+        Returns:
+            memory_cache: SharedImageCache, 传给get_dataloader的memory_cache参数
+        """
+        return SharedImageCache(self.samples.tolist(), budget_bytes, decode_size, resize, get_max_aspect_ratio(bucket_ratios))
+
     def draw_train_val_distribution(self, train_lists, val_lists, draw_distribution):
         """ 画出各个折的训练集与验证集的数据分布
 
@@ -354,10 +485,10 @@ class GetDataloader(object):
         """
         samples_index = [i for i in range(len(self.samples))]
         train_index, val_index = train_test_split(samples_index, test_size=self.test_size, random_state=69)
-        train_samples = [self.samples[i] for i in train_index]
-        train_labels = [self.labels[i] for i in train_index]
-        val_samples = [self.samples[i] for i in val_index]
-        val_labels = [self.labels[i] for i in val_index]
+        train_samples = self.samples[train_index].tolist()
+        train_labels = self.labels[train_index].tolist()
+        val_samples = self.samples[val_index].tolist()
+        val_labels = self.labels[val_index].tolist()
         return [[train_samples, train_labels]], [[val_samples, val_labels]]
     
     def get_data_split_folds(self):
@@ -370,39 +501,25 @@ class GetDataloader(object):
         train_folds = []
         val_folds = []
         for train_index, val_index in skf.split(self.samples, self.labels):
-            train_samples = ([self.samples[i] for i in train_index])
-            train_labels = ([self.labels[i] for i in train_index])
-            val_samples = ([self.samples[i] for i in val_index])
-            val_labels = ([self.labels[i] for i in val_index])
+            train_samples = self.samples[train_index].tolist()
+            train_labels = self.labels[train_index].tolist()
+            val_samples = self.samples[val_index].tolist()
+            val_labels = self.labels[val_index].tolist()
             train_folds.append([train_samples, train_labels])
             val_folds.append([val_samples, val_labels])
         return train_folds, val_folds
 
     def get_samples_labels(self):
-        """ 得到所有的图片名称以及对应的类标
+        """ 得到所有的图片名称以及对应的类标，逐文件存放的数据集通过持久化的标注清单读取
         Returns:
-            samples: list, 所有的图片名称
-            labels: list, 所有的图片对应的类标, 和samples一一对应
+            samples: np.ndarray, 所有的图片名称
+            labels: np.ndarray, 所有的图片对应的类标, 和samples一一对应
         """
-        files_list = sorted(os.listdir(self.data_root))
-        # 过滤得到标注文件
-        annotations_files_list = [f for f in files_list if f.split('.')[1] == 'txt']
-
-        samples = []
-        labels = []
-        for annotation_file in annotations_files_list:
-            annotation_file_path = os.path.join(self.data_root, annotation_file)
-            with open(annotation_file_path, encoding='utf-8-sig') as f:
-                for sample_label in f:
-                    try:
-                        sample_name = sample_label.split(', ')[0]
-                        label = int(sample_label.split(', ')[1])
-                    except:
-                        sample_name = sample_label.split(',')[0]
-                        label = int(sample_label.split(',')[1])
-                    samples.append(sample_name)
-                    labels.append(label)
-        return samples, labels
+        if self.shard_reader is not None:
+            samples, labels = self.shard_reader.get_samples_labels()
+            return np.asarray(samples), np.asarray(labels, dtype=np.int64)
+
+        return load_manifest(self.data_root)
 
 
 def multi_scale_transforms(image_size, images, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)):
@@ -432,6 +549,172 @@ def multi_scale_transforms(image_size, images, mean=(0.485, 0.456, 0.406), std=(
     return images_resize
 
 
+def create_aspect_ratios(dataset):
+    """ 数据集中每一个样本的长宽比，数据集正在暂存时只读取已经在本地的图片，其余图片在之后的epoch中读取
+
+    Args:
+        dataset: TrainDataset/ValDataset
+    Returns:
+        aspect_ratios: np.ndarray或StagedAspectRatios
+    """
+    if dataset.stager is not None and dataset.shard_reader is None:
+        return StagedAspectRatios(dataset.sample_list, dataset.stager)
+    return get_aspect_ratios(dataset.data_root, dataset.sample_list, dataset.shard_reader)
+
+
+def get_staging_window(loader_kwargs):
+    """ StagingBatchSampler的预取窗口，需要覆盖DataLoader的worker已经取走但尚未读取的batch
+
+    Args:
+        loader_kwargs: dict, build_loader_kwargs的结果
+    Returns:
+        prefetch_batches: int
+    """
+    return 64 + loader_kwargs['num_workers'] * loader_kwargs.get('prefetch_factor', 2)
+
+
+def create_train_dataloader(train_dataset, batch_size, multi_scale_size=None, multi_scale_interval=10, multi_scale_backend='main',
+                            aspect_ratio_bucket=False, bucket_ratios=None, loader_params=None, sampler='random',
+                            sampler_params=None, distributed=False):
+    """ 创建训练集的DataLoader
+
+    Args:
+        train_dataset: TrainDataset, 训练数据集
+        batch_size: int, 批量大小
+        multi_scale_size: list, [[height, width], ...], 不为None且multi_scale_backend不为main时，在worker中进行多尺度缩放
+        multi_scale_interval: int, 每隔多少个batch重新选择一次尺度
+        multi_scale_backend: str, main/pil/tensor
+        aspect_ratio_bucket: bool, 是否按照长宽比分桶
+        bucket_ratios: list, 各个桶的长宽比(width / height)，为None时使用默认值
+        loader_params: dict, DataLoader的参数，为None时使用默认值
+        sampler: str, random: 随机打乱; imbalanced: 按照类别频率的倒数有放回地采样，使各类别被采样的概率相同;
+            class_aware: 每个batch包含P个类别，每个类别K个样本，此时batch大小为P×K；分布式训练时P×K为所有进程的总批量大小，
+                每个进程分到其中P / world_size个类别
+        sampler_params: dict, class_aware采样的参数，{'classes_per_batch': P, 'samples_per_class': K, 'num_batches': 每个epoch的batch数}
+        distributed: bool, 是否划分到DistributedDataParallel的各个进程；随机采样时使用DistributedSampler，其余采样方式按照batch划分
+    Returns:
+        train_dataloader: DataLoader, 其batch_sampler为ResumableBatchSampler（使用stager时由StagingBatchSampler包装并转发set_epoch），
+            训练时通过set_epoch控制顺序与起始batch
+    """
+    collate_fn = None
+    if aspect_ratio_bucket and sampler != 'random':
+        print('%s sampler is not supported with aspect ratio buckets, using random sampler.' % sampler)
+        sampler = 'random'
+    if sampler == 'class_aware':
+        base_batch_sampler = ClassAwareBatchSampler(
+            train_dataset.label_list, num_replicas=get_world_size() if distributed else 1, **(sampler_params or {})
+        )
+    elif sampler == 'imbalanced':
+        base_batch_sampler = BatchSampler(ImbalancedDatasetSampler(train_dataset), batch_size, drop_last=False)
+    elif distributed:
+        base_batch_sampler = BatchSampler(
+            DistributedSampler(train_dataset, num_replicas=get_world_size(), rank=get_rank(), shuffle=True),
+            batch_size,
+            drop_last=False
+        )
+    else:
+        base_batch_sampler = BatchSampler(RandomSampler(train_dataset), batch_size, drop_last=False)
+
+    if aspect_ratio_bucket:
+        aspect_ratios = create_aspect_ratios(train_dataset)
+        batch_sampler = AspectRatioBucketBatchSampler(
+            aspect_ratios,
+            batch_size,
+            train_dataset.size,
+            bucket_ratios=bucket_ratios,
+            shuffle=True,
+            multi_scale_size=multi_scale_size,
+            multi_scale_interval=multi_scale_interval
+        )
+        # 每个batch的尺寸由分桶决定，只能逐张缩放
+        train_dataset.multi_scale = False
+        train_dataset.scale_backend = 'pil'
+        collate_fn = MultiScaleCollate('pil')
+    elif multi_scale_size and multi_scale_backend != 'main':
+        batch_sampler = MultiScaleBatchSampler(
+            base_batch_sampler,
+            multi_scale_size,
+            multi_scale_interval
+        )
+        collate_fn = MultiScaleCollate(multi_scale_backend)
+    else:
+        batch_sampler = base_batch_sampler
+
+    if distributed and sampler == 'class_aware':
+        batch_sampler = SplitBatchSampler(batch_sampler, get_rank(), get_world_size())
+    elif distributed and (sampler != 'random' or aspect_ratio_bucket):
+        batch_sampler = ShardedBatchSampler(batch_sampler, get_rank(), get_world_size())
+    batch_sampler = ResumableBatchSampler(batch_sampler)
+    loader_kwargs = build_loader_kwargs(loader_params)
+    if train_dataset.stager is not None:
+        # ResumableBatchSampler一次生成整个epoch的索引，在其外层按照窗口逐步推入优先队列
+        batch_sampler = StagingBatchSampler(
+            batch_sampler, train_dataset.sample_list, train_dataset.stager, get_staging_window(loader_kwargs)
+        )
+    return DataLoader(
+        train_dataset,
+        batch_sampler=batch_sampler,
+        collate_fn=collate_fn,
+        **loader_kwargs
+    )
+
+
+def create_val_dataloader(val_dataset, batch_size, aspect_ratio_bucket=False, bucket_ratios=None, loader_params=None,
+                          val_cache='none', val_cache_path=None, distributed=False):
+    """ 创建验证集的DataLoader
+
+    Args:
+        val_dataset: ValDataset, 验证数据集
+        batch_size: int, 批量大小
+        aspect_ratio_bucket: bool, 是否按照长宽比分桶
+        bucket_ratios: list, 各个桶的长宽比(width / height)，为None时使用默认值
+        loader_params: dict, DataLoader的参数，为None时使用默认值
+        val_cache: str, none: 每个epoch重新解码; ram/mmap: 将整个验证集以uint8缓存在内存/内存映射文件中
+        val_cache_path: str, mmap模式下缓存文件的路径
+        distributed: bool, 是否将验证集按顺序划分到各个进程，各个进程的结果需要由调用者汇总
+    Returns:
+        val_dataloader: DataLoader，或者CachedValLoader
+    """
+    if val_cache != 'none':
+        if not aspect_ratio_bucket:
+            rank, world_size = (get_rank(), get_world_size()) if distributed else (0, 1)
+            return CachedValLoader(val_dataset, batch_size, val_cache, val_cache_path, rank=rank, world_size=world_size,
+                                   pin_memory=build_loader_kwargs(loader_params)['pin_memory'])
+        # 分桶后各个batch的尺寸不同，无法缓存为一个数组
+        print('Validation cache is disabled when using aspect ratio buckets.')
+    collate_fn = None
+    if aspect_ratio_bucket:
+        aspect_ratios = create_aspect_ratios(val_dataset)
+        batch_sampler = AspectRatioBucketBatchSampler(
+            aspect_ratios,
+            batch_size,
+            val_dataset.size,
+            bucket_ratios=bucket_ratios,
+            shuffle=False
+        )
+        if distributed:
+            batch_sampler = ShardedBatchSampler(batch_sampler, get_rank(), get_world_size(), drop_last=False)
+        collate_fn = MultiScaleCollate('pil')
+    elif distributed:
+        batch_sampler = BatchSampler(
+            ShardedSequentialSampler(val_dataset, get_rank(), get_world_size()), batch_size, drop_last=False
+        )
+    else:
+        batch_sampler = BatchSampler(SequentialSampler(val_dataset), batch_size, drop_last=False)
+
+    loader_kwargs = build_loader_kwargs(loader_params)
+    if val_dataset.stager is not None:
+        batch_sampler = StagingBatchSampler(
+            batch_sampler, val_dataset.sample_list, val_dataset.stager, get_staging_window(loader_kwargs)
+        )
+    return DataLoader(
+        val_dataset,
+        batch_sampler=batch_sampler,
+        collate_fn=collate_fn,
+        **loader_kwargs
+    )
+
+
 def get_dataloader_from_folder(
     data_root, 
     image_size, 
@@ -440,23 +723,52 @@ def get_dataloader_from_folder(
     std,
     batch_size, 
     multi_scale=False, 
+    data_format='folder',
+    image_cache=None,
+    multi_scale_size=None,
+    multi_scale_interval=10,
+    multi_scale_backend='main',
+    aspect_ratio_bucket=False,
+    bucket_ratios=None,
+    loader_params=None,
+    memory_cache_bytes=0,
+    memory_cache_size=None,
+    memory_cache_resize=False,
+    stager=None,
+    sampler='random',
+    sampler_params=None,
+    uint8_transport=False,
+    val_cache='none',
+    val_cache_root='data/val_cache',
+    distributed=False
     ):
-    samples_files = [f for f in os.listdir(data_root) if f.endswith('.jpg')]
+    if data_format == 'shard':
+        shard_reader = ShardReader(data_root)
+        samples_labels = zip(*shard_reader.get_samples_labels())
+    else:
+        shard_reader = None
+        samples, labels = load_manifest(data_root)
+        samples_labels = zip(samples.tolist(), labels.tolist())
+    if aspect_ratio_bucket:
+        # 缓存中的图片已被缩放为固定尺寸，丢失了原始长宽比
+        image_cache = None
     train_samples_list = []
     train_labels_list = []
     val_samples_list = []
     val_labels_list = []
-    for sample_file in samples_files:
-        label_file = sample_file.replace('.jpg', '.txt')
-        with open(os.path.join(data_root, label_file), 'r') as label_f:
-            for line in label_f.readlines():
-                label = int(line.split(' ')[1])
+    for sample_file, label in samples_labels:
         if 'train' in sample_file:
             train_samples_list.append(sample_file)
             train_labels_list.append(label)
         else:
             val_samples_list.append(sample_file)
             val_labels_list.append(label)
+    memory_cache = None
+    if memory_cache_bytes > 0 and not (aspect_ratio_bucket and memory_cache_resize):
+        memory_cache = SharedImageCache(
+            train_samples_list + val_samples_list, memory_cache_bytes, memory_cache_size or image_size, memory_cache_resize,
+            get_max_aspect_ratio(bucket_ratios)
+        )
     
     train_dataset = TrainDataset(
         data_root, 
@@ -466,7 +778,13 @@ def get_dataloader_from_folder(
         transforms=transforms, 
         mean=mean, 
         std=std, 
-        multi_scale=multi_scale,
+        multi_scale=multi_scale and multi_scale_backend == 'main',
+        shard_reader=shard_reader,
+        image_cache=image_cache,
+        scale_backend=multi_scale_backend,
+        memory_cache=memory_cache,
+        stager=stager,
+        uint8_transport=uint8_transport
         )
     # 默认不在验证集上进行多尺度
     val_dataset = ValDataset(
@@ -476,22 +794,32 @@ def get_dataloader_from_folder(
         image_size, 
         mean=mean, 
         std=std, 
-        multi_scale=False
+        multi_scale=False,
+        shard_reader=shard_reader,
+        image_cache=image_cache,
+        memory_cache=memory_cache,
+        stager=stager,
+        uint8_transport=uint8_transport
         )
 
-    train_dataloader = DataLoader(
+    train_dataloader = create_train_dataloader(
         train_dataset,
-        batch_size=batch_size,
-        num_workers=8,
-        pin_memory=True,
-        shuffle=True
+        batch_size,
+        multi_scale_size=multi_scale_size if multi_scale else None,
+        multi_scale_interval=multi_scale_interval,
+        multi_scale_backend=multi_scale_backend,
+        aspect_ratio_bucket=aspect_ratio_bucket,
+        bucket_ratios=bucket_ratios,
+        loader_params=loader_params,
+        sampler=sampler,
+        sampler_params=sampler_params,
+        distributed=distributed
     )
-    val_dataloader = DataLoader(
-        val_dataset,
-        batch_size=batch_size,
-        num_workers=8,
-        pin_memory=True,
-        shuffle=False
+    val_cache_path = get_val_cache_path(
+        val_cache_root, os.path.basename(os.path.normpath(data_root)), 0, val_dataset.sample_list, image_size
+    )
+    val_dataloader = create_val_dataloader(
+        val_dataset, batch_size, aspect_ratio_bucket, bucket_ratios, loader_params, val_cache, val_cache_path, distributed
     )
     return train_dataloader, val_dataloader, [1 for x in range(54)], [1 for x in range(54)]
 
@@ -14,7 +14,6 @@ from PIL import Image
 import cv2
 import os
 import matplotlib.pyplot as plt
-import copy
 import time
 
 
@@ -38,7 +37,6 @@ class RandomErasing(object):
         self.r1 = r1
 
     def __call__(self, img):
-        img = copy.deepcopy(img)
         if random.uniform(0, 1) > self.probability:
             return img
 
@@ -53,6 +51,8 @@ class RandomErasing(object):
             w = int(round(math.sqrt(target_area / aspect_ratio)))
 
             if w < img.shape[1] and h < img.shape[0]:
+                # 只有真正擦除时才拷贝，输入可能是PIL图片的只读视图
+                img = img.copy()
                 x1 = random.randint(0, img.shape[0] - h)
                 y1 = random.randint(0, img.shape[1] - w)
                 image_roi = img[x1:x1 + h, y1:y1 + w, :]
@@ -121,6 +121,12 @@ class DataAugmentation(object):
         self.resize_equal_ratio = ResizeEqualRatio((int(256 * (256 / 224)), int(256 * (256 / 224))))
         self.random_erase = RandomErasing(probability=erase_prob)
         self.rgb2gray = RGB2GRAY(p=gray_prob)
+        self.augmentations = Compose([
+            # CenterCrop(256, 256),
+            HorizontalFlip(p=0.5),
+            VerticalFlip(p=0.25),
+            ShiftScaleRotate(shift_limit=0.07, rotate_limit=10, p=0.4),
+        ])
 
     def __call__(self, image):
         """
@@ -131,16 +137,27 @@ class DataAugmentation(object):
         """
         # image = self.resize_equal_ratio(image)
         # image = np.asarray(image)
+        for _, transform in self.stages():
+            image = transform(image)
+
+        return image
+
+    def stages(self):
+        """ 按照执行顺序得到实际启用的各个增强，供PreprocessPipeline分别统计耗时
+
+        Returns:
+            stages: list, [(name, callable), ...]
+        """
+        stages = []
         # 随机擦除
         if self.erase_prob > 0:
-            image = self.random_erase(image)
+            stages.append(('random_erase', self.random_erase))
         # 转为灰度
         if self.gray_prob > 0:
-            image = self.rgb2gray(image)
+            stages.append(('rgb2gray', self.rgb2gray))
         if self.full_aug:
-            image = self.data_augmentation(image)
-
-        return image
+            stages.append(('albumentations', self.data_augmentation))
+        return stages
 
     def data_augmentation(self, original_image):
         """ 进行样本和掩膜的随机增强
@@ -149,14 +166,7 @@ class DataAugmentation(object):
         Return:
             image_aug: 增强后的图片
         """
-        augmentations = Compose([
-            # CenterCrop(256, 256),
-            HorizontalFlip(p=0.5),
-            VerticalFlip(p=0.25),
-            ShiftScaleRotate(shift_limit=0.07, rotate_limit=10, p=0.4),
-        ])
-
-        augmented = augmentations(image=original_image)
+        augmented = self.augmentations(image=original_image)
         image_aug = augmented['image']
 
         return image_aug
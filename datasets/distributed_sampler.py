@@ -0,0 +1,80 @@
+'''
+该文件的功能：DistributedDataParallel训练时，将batch或者验证集的样本划分到各个进程
+
+随机采样时使用torch自带的DistributedSampler在样本层面划分；不平衡采样与长宽比分桶按照batch划分：各个进程的随机种子相同
+（见ResumableBatchSampler），生成的全局batch序列相同，第rank个进程取其中第rank, rank + world_size, ...个batch；
+类别均衡的P×K采样在batch内部划分（SplitBatchSampler），全局batch的组成与单进程训练相同
+'''
+from torch.utils.data import Sampler
+
+
+class ShardedBatchSampler(Sampler):
+    def __init__(self, batch_sampler, rank, world_size, drop_last=True):
+        """
+        Args:
+            batch_sampler: 被包装的batch sampler，各个进程上产生相同的batch序列
+            rank: int, 当前进程的序号
+            world_size: int, 进程总数
+            drop_last: bool, 是否丢弃末尾不足world_size个的batch；训练时各个进程的batch数必须相同，
+                否则DDP在反向传播时会互相等待；验证时为False，使每个样本都被验证
+        """
+        self.batch_sampler = batch_sampler
+        self.rank = rank
+        self.world_size = world_size
+        self.drop_last = drop_last
+
+    def __iter__(self):
+        total = len(self.batch_sampler) // self.world_size * self.world_size if self.drop_last else len(self.batch_sampler)
+        for index, batch in enumerate(self.batch_sampler):
+            if index >= total:
+                break
+            if index % self.world_size == self.rank:
+                yield batch
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.batch_sampler) // self.world_size
+        return len(range(self.rank, len(self.batch_sampler), self.world_size))
+
+
+class SplitBatchSampler(Sampler):
+    def __init__(self, batch_sampler, rank, world_size):
+        """ 将每一个全局batch按顺序均分为world_size份，第rank个进程取其中第rank份
+
+        Args:
+            batch_sampler: 被包装的batch sampler，各个进程上产生相同的batch序列，batch大小为world_size的倍数；
+                对于ClassAwareBatchSampler，同一个类别的K个样本相邻，每个进程分到P / world_size个完整的类别
+            rank: int, 当前进程的序号
+            world_size: int, 进程总数
+        """
+        self.batch_sampler = batch_sampler
+        self.rank = rank
+        self.world_size = world_size
+
+    def __iter__(self):
+        for batch in self.batch_sampler:
+            size = len(batch) // self.world_size
+            yield batch[self.rank * size:(self.rank + 1) * size]
+
+    def __len__(self):
+        return len(self.batch_sampler)
+
+
+class ShardedSequentialSampler(Sampler):
+    def __init__(self, data_source, rank, world_size):
+        """ 验证集的划分，第rank个进程按顺序取第rank, rank + world_size, ...个样本，不补齐，每个样本只被验证一次
+
+        Args:
+            data_source: Dataset
+            rank: int, 当前进程的序号
+            world_size: int, 进程总数
+        """
+        self.data_source = data_source
+        self.rank = rank
+        self.world_size = world_size
+
+    def __iter__(self):
+        return iter(range(self.rank, len(self.data_source), self.world_size))
+
+    def __len__(self):
+        return len(range(self.rank, len(self.data_source), self.world_size))
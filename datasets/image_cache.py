@@ -0,0 +1,203 @@
+'''
+该文件的功能：将数据集中的图片解码一次并缩放到训练所用的尺度，以uint8数组的形式存放在内存映射文件中，后续epoch直接读取，跳过JPEG解码
+
+缓存目录结构：
+    index.json: {"version": 1, "sizes": [[height, width], ...], "samples": [[样本名, 源文件签名], ...]}
+    image_<height>x<width>.npy: uint8, [样本数, height, width, 3]，第i行对应index.json中的第i个样本
+当尺度列表发生变化时整个缓存失效；源文件的签名（大小、修改时间）发生变化时只重新解码对应的样本
+'''
+import os
+import json
+import time
+import tqdm
+import numpy as np
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+
+CACHE_VERSION = 1
+CACHE_INDEX_NAME = 'index.json'
+
+
+def get_cache_sizes(sizes, mode='largest'):
+    """ 得到需要缓存的尺度
+
+    Args:
+        sizes: list, [[height, width], ...], 训练与验证时用到的所有尺度
+        mode: str, largest: 只缓存面积最大的尺度，其余尺度由该尺度缩放得到; each: 缓存每一个尺度
+    Returns:
+        cache_sizes: list, [[height, width], ...]
+    """
+    sizes = sorted(set(tuple(size) for size in sizes), key=lambda size: size[0] * size[1])
+    if mode == 'largest':
+        sizes = sizes[-1:]
+    return [list(size) for size in sizes]
+
+
+def get_source_signature(data_root, sample_name, shard_reader=None):
+    """ 得到样本源文件的签名，签名变化时缓存失效
+
+    Args:
+        data_root: str, 数据集根目录
+        sample_name: str, 样本名
+        shard_reader: ShardReader, 不为None时使用样本在分片中的位置作为签名
+    Returns:
+        signature: list
+    """
+    if shard_reader is not None:
+        return list(shard_reader.locations[sample_name])
+    stat = os.stat(os.path.join(data_root, sample_name))
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def build_resized_cache(data_root, sample_list, cache_root, sizes, mode='largest', shard_reader=None, num_threads=8):
+    """ 构建或增量更新缩放后的图片缓存
+
+    Args:
+        data_root: str, 数据集根目录
+        sample_list: list, 需要缓存的样本名
+        cache_root: str, 缓存目录
+        sizes: list, [[height, width], ...], 训练与验证时用到的所有尺度
+        mode: str, largest/each, 见get_cache_sizes
+        shard_reader: ShardReader, 不为None时从分片文件中读取图片
+        num_threads: int, 解码线程数，PIL解码与缩放时会释放GIL
+    Returns:
+        image_cache: ResizedImageCache
+    """
+    # 避免与create_dataset循环导入
+    from datasets.create_dataset import read_image
+
+    cache_sizes = get_cache_sizes(sizes, mode)
+    if not os.path.exists(cache_root):
+        print('Making %s' % cache_root)
+        os.makedirs(cache_root)
+
+    old_rows = {}
+    old_arrays = {}
+    index_path = os.path.join(cache_root, CACHE_INDEX_NAME)
+    if os.path.exists(index_path):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            old_index = json.load(f)
+        if old_index.get('version') == CACHE_VERSION and old_index['sizes'] == cache_sizes:
+            old_rows = {sample[0]: (row, sample[1]) for row, sample in enumerate(old_index['samples'])}
+            old_arrays = {tuple(size): np.load(os.path.join(cache_root, _array_name(size)), mmap_mode='r')
+                          for size in cache_sizes}
+        else:
+            print('Image cache at %s was built for other sizes, rebuilding' % cache_root)
+
+    signatures = [get_source_signature(data_root, sample_name, shard_reader) for sample_name in sample_list]
+    reuse_rows = [old_rows[sample_name][0]
+                  if sample_name in old_rows and old_rows[sample_name][1] == signature else None
+                  for sample_name, signature in zip(sample_list, signatures)]
+    decode_number = sum(row is None for row in reuse_rows)
+    if old_rows and decode_number == 0 and len(old_rows) == len(sample_list):
+        print('Image cache at %s is up to date' % cache_root)
+        del old_arrays
+        return ResizedImageCache(cache_root)
+
+    # 先写入临时文件，全部完成后再替换，中断时旧的缓存仍然可用
+    new_arrays = {}
+    for size in cache_sizes:
+        new_arrays[tuple(size)] = np.lib.format.open_memmap(
+            os.path.join(cache_root, _array_name(size) + '.tmp'),
+            mode='w+', dtype=np.uint8, shape=(len(sample_list), size[0], size[1], 3)
+        )
+
+    def fill_row(row):
+        if reuse_rows[row] is not None:
+            for size, array in new_arrays.items():
+                array[row] = old_arrays[size][reuse_rows[row]]
+            return
+        # 以最大的缓存尺度进行DCT缩放解码
+        image = read_image(data_root, sample_list[row], shard_reader, size=cache_sizes[-1])
+        for size, array in new_arrays.items():
+            # 与T.Resize(size, interpolation=3)一致，使用bicubic插值
+            array[row] = np.asarray(image.resize((size[1], size[0]), Image.BICUBIC))
+
+    print('Building image cache at %s: %d samples, %d to decode, sizes: %s' %
+          (cache_root, len(sample_list), decode_number, cache_sizes))
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        list(tqdm.tqdm(executor.map(fill_row, range(len(sample_list))), total=len(sample_list)))
+
+    for array in new_arrays.values():
+        array.flush()
+    del new_arrays, old_arrays
+    for size in cache_sizes:
+        os.replace(os.path.join(cache_root, _array_name(size) + '.tmp'), os.path.join(cache_root, _array_name(size)))
+    with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': CACHE_VERSION,
+            'sizes': cache_sizes,
+            'samples': [[sample_name, signature] for sample_name, signature in zip(sample_list, signatures)]
+        }, f, ensure_ascii=False)
+    os.replace(index_path + '.tmp', index_path)
+
+    return ResizedImageCache(cache_root)
+
+
+def _array_name(size):
+    return 'image_%dx%d.npy' % (size[0], size[1])
+
+
+class ResizedImageCache(object):
+    def __init__(self, cache_root):
+        """ 读取build_resized_cache生成的缓存
+
+        Args:
+            cache_root: str, 缓存目录
+        """
+        self.cache_root = cache_root
+        with open(os.path.join(cache_root, CACHE_INDEX_NAME), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        self.sizes = [tuple(size) for size in index['sizes']]
+        self.rows = {sample[0]: row for row, sample in enumerate(index['samples'])}
+
+        # 内存映射在各个进程中懒加载，不随pickle传递给DataLoader的worker
+        self._arrays = {}
+        self._pid = None
+
+    def get(self, sample_name, size=None):
+        """ 读取缓存中的图片
+
+        Args:
+            sample_name: str, 样本名
+            size: [height, width], 目标大小；缓存中存在该尺度时直接返回，否则返回面积最大的尺度
+        Returns:
+            image: np.ndarray, uint8, [height, width, 3]; 样本不在缓存中时返回None
+        """
+        row = self.rows.get(sample_name)
+        if row is None:
+            return None
+        if size is None or tuple(size) not in self.sizes:
+            size = self.sizes[-1]
+        return self._get_array(tuple(size))[row]
+
+    def _get_array(self, size):
+        if self._pid != os.getpid():
+            self._arrays = {}
+            self._pid = os.getpid()
+        if size not in self._arrays:
+            self._arrays[size] = np.load(os.path.join(self.cache_root, _array_name(size)), mmap_mode='r')
+        return self._arrays[size]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_arrays'] = {}
+        state['_pid'] = None
+        return state
+
+
+if __name__ == "__main__":
+    from datasets.manifest import load_manifest
+
+    data_root = 'data/huawei_data/combine'
+    cache_root = 'data/huawei_data/combine_cache'
+    sizes = [[224, 224], [256, 256], [288, 288], [320, 320]]
+    samples, _ = load_manifest(data_root)
+    start_time = time.time()
+    image_cache = build_resized_cache(data_root, samples.tolist(), cache_root, sizes, mode='largest')
+    print('Built in %.1fs' % (time.time() - start_time))
+
+    start_time = time.time()
+    for sample_name in samples.tolist()[:1000]:
+        image = Image.fromarray(image_cache.get(sample_name))
+    print('Read from cache: %.3fms per image' % ((time.time() - start_time) / min(len(samples), 1000) * 1000))
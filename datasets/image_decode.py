@@ -0,0 +1,65 @@
+'''
+该文件的功能：统一的图片解码函数
+
+对于JPEG图片，利用DCT缩放（PIL的draft模式）直接解码为1/2、1/4或1/8大小，得到仍不小于目标尺寸的最小图片，
+随后的Resize只需处理更少的像素；对于其它格式的图片，退化为完整解码
+注意：online-service/model/image_decode.py 为该文件的拷贝，修改时需要同步
+'''
+import os
+import io
+import time
+import numpy as np
+from PIL import Image
+
+
+def decode_image(source, target_size=None):
+    """ 解码一张图片并转换为RGB格式
+
+    Args:
+        source: str/bytes/file-like, 图片路径、图片的原始字节或者文件对象
+        target_size: [height, width], 之后要缩放到的目标大小；为None时完整解码
+    Returns:
+        image: PIL.Image, RGB格式的图片，JPEG图片的宽高均不小于target_size
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    image = Image.open(source)
+    if target_size is not None and image.format == 'JPEG':
+        # draft只修改解码器的缩放系数，需要在图片真正被读取之前调用；draft的尺寸为(width, height)
+        image.draft('RGB', (int(target_size[1]), int(target_size[0])))
+    return image.convert('RGB')
+
+
+def benchmark_decode(image_paths, target_size, resize=True):
+    """ 比较完整解码与DCT缩放解码的耗时
+
+    Args:
+        image_paths: list, 图片路径
+        target_size: [height, width], 目标大小
+        resize: bool, 是否计入缩放到target_size的耗时
+    Returns:
+        results: dict, {'full': 每张图片的平均耗时(ms), 'draft': 每张图片的平均耗时(ms)}
+    """
+    results = {}
+    for mode in ['full', 'draft']:
+        start_time = time.time()
+        for image_path in image_paths:
+            image = decode_image(image_path, target_size if mode == 'draft' else None)
+            if resize:
+                image = image.resize((target_size[1], target_size[0]), Image.BICUBIC)
+        results[mode] = (time.time() - start_time) / max(len(image_paths), 1) * 1000
+    return results
+
+
+if __name__ == "__main__":
+    data_root = 'data/huawei_data/combine'
+    target_size = [320, 320]
+    image_number = 500
+
+    image_paths = sorted(os.path.join(data_root, f) for f in os.listdir(data_root) if f.endswith('.jpg'))[:image_number]
+    pixels = np.asarray([Image.open(image_path).size for image_path in image_paths]).prod(axis=1)
+    print('%d images, average %.2f megapixels' % (len(image_paths), pixels.mean() / 1e6))
+    for resize in [False, True]:
+        results = benchmark_decode(image_paths, target_size, resize)
+        print('[Resize: %s] full decode: %.2fms/image, draft decode: %.2fms/image, speedup: %.2fx' %
+              (resize, results['full'], results['draft'], results['full'] / results['draft']))
@@ -1,3 +1,4 @@
+import numpy as np
 import torch
 import torch.utils.data
 import torchvision
@@ -22,26 +23,21 @@ class ImbalancedDatasetSampler(torch.utils.data.sampler.Sampler):
         self.num_samples = len(self.indices) \
             if num_samples is None else num_samples
             
-        # distribution of classes in the dataset 
-        label_to_count = {}
-        for idx in self.indices:
-            label = self._get_label(dataset, idx)
-            if label in label_to_count:
-                label_to_count[label] += 1
-            else:
-                label_to_count[label] = 1
-                
-        # weight for each sample
-        weights = [1.0 / label_to_count[self._get_label(dataset, idx)]
-                   for idx in self.indices]
-        self.weights = torch.DoubleTensor(weights)
+        # distribution of classes in the dataset, the weight of each sample is 1 / count of its class
+        labels = self._get_labels(dataset)[np.asarray(self.indices, dtype=np.int64)]
+        _, label_ids = np.unique(labels, return_inverse=True)
+        label_to_count = np.bincount(label_ids)
+        self.weights = torch.from_numpy(1.0 / label_to_count[label_ids]).double()
 
-    def _get_label(self, dataset, idx):
+    def _get_labels(self, dataset):
+        if hasattr(dataset, 'label_list'):
+            # TrainDataset / ValDataset
+            return np.asarray(dataset.label_list)
         dataset_type = type(dataset)
         if dataset_type is torchvision.datasets.MNIST:
-            return dataset.train_labels[idx].item()
+            return np.asarray(dataset.train_labels)
         elif dataset_type is torchvision.datasets.ImageFolder:
-            return dataset.imgs[idx][1]
+            return np.asarray([label for _, label in dataset.imgs])
         else:
             raise NotImplementedError
                 
@@ -50,4 +46,4 @@ class ImbalancedDatasetSampler(torch.utils.data.sampler.Sampler):
             self.weights, self.num_samples, replacement=True))
 
     def __len__(self):
-        return self.num_samples
\ No newline at end of file
+        return self.num_samples
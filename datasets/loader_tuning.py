@@ -0,0 +1,210 @@
+'''
+该文件的功能：DataLoader的参数设置、吞吐量测试与自动调优
+
+loader_params为一个dict：
+    {
+        "num_workers": worker进程数,
+        "prefetch_factor": 每个worker预取的batch数,
+        "persistent_workers": 是否在epoch之间保留worker进程,
+        "pin_memory": 是否使用锁页内存,
+        "cpu_affinity": 是否将每个worker绑定到固定的CPU核上
+    }
+'''
+import os
+import json
+import time
+import inspect
+from torch.utils.data import DataLoader
+
+DEFAULT_LOADER_PARAMS = {
+    'num_workers': 8,
+    'prefetch_factor': 2,
+    'persistent_workers': False,
+    'pin_memory': True,
+    'cpu_affinity': False
+}
+LOADER_PARAMS_NAME = 'loader_params.json'
+
+# 较老版本的pytorch不支持prefetch_factor与persistent_workers
+_DATALOADER_ARGS = inspect.signature(DataLoader.__init__).parameters
+
+
+class WorkerAffinity(object):
+    def __init__(self, cpus=None):
+        """ 作为DataLoader的worker_init_fn，将第i个worker绑定到第i个CPU核上（循环分配）
+
+        Args:
+            cpus: list, 可用的CPU核编号，为None时使用当前进程允许使用的所有核
+        """
+        self.cpus = sorted(cpus if cpus is not None else os.sched_getaffinity(0))
+
+    def __call__(self, worker_id):
+        os.sched_setaffinity(0, {self.cpus[worker_id % len(self.cpus)]})
+
+
+def get_loader_params(config):
+    """ 根据配置得到DataLoader的参数；若指定了loader_params文件，则使用之前调优得到的参数
+
+    Args:
+        config: 配置参数
+    Returns:
+        loader_params: dict
+    """
+    if config.loader_params:
+        loader_params = load_loader_params(config.loader_params)
+        print('Loading DataLoader params from %s: %s' % (config.loader_params, loader_params))
+        return loader_params
+    return {
+        'num_workers': config.num_workers,
+        'prefetch_factor': config.prefetch_factor,
+        'persistent_workers': config.persistent_workers,
+        'pin_memory': True,
+        'cpu_affinity': config.cpu_affinity
+    }
+
+
+def build_loader_kwargs(loader_params=None):
+    """ 将loader_params转换为DataLoader的关键字参数
+
+    Args:
+        loader_params: dict, 为None时使用DEFAULT_LOADER_PARAMS
+    Returns:
+        loader_kwargs: dict
+    """
+    params = dict(DEFAULT_LOADER_PARAMS)
+    if loader_params:
+        params.update(loader_params)
+    loader_kwargs = {'num_workers': params['num_workers'], 'pin_memory': params['pin_memory']}
+    if params['num_workers'] > 0:
+        if 'prefetch_factor' in _DATALOADER_ARGS:
+            loader_kwargs['prefetch_factor'] = params['prefetch_factor']
+        if 'persistent_workers' in _DATALOADER_ARGS:
+            loader_kwargs['persistent_workers'] = params['persistent_workers']
+        if params['cpu_affinity'] and hasattr(os, 'sched_setaffinity'):
+            loader_kwargs['worker_init_fn'] = WorkerAffinity()
+    return loader_kwargs
+
+
+def rebuild_dataloader(dataloader, loader_params):
+    """ 使用新的loader_params重新创建DataLoader，数据集、batch_sampler与collate_fn保持不变
+
+    Args:
+        dataloader: DataLoader
+        loader_params: dict
+    Returns:
+        dataloader: DataLoader
+    """
+    if not isinstance(dataloader, DataLoader):
+        # 例如CachedValLoader，不使用DataLoader的worker
+        return dataloader
+    return DataLoader(
+        dataloader.dataset,
+        batch_sampler=dataloader.batch_sampler,
+        collate_fn=dataloader.collate_fn,
+        **build_loader_kwargs(loader_params)
+    )
+
+
+def benchmark_loader(dataloader, num_batches=50, num_epochs=2):
+    """ 测试DataLoader的吞吐量
+
+    Args:
+        dataloader: DataLoader
+        num_batches: int, 每个epoch最多读取多少个batch
+        num_epochs: int, 读取几次，用于体现persistent_workers节省的worker启动时间
+    Returns:
+        result: dict, images_per_second: 每秒读取的图片数; wait_per_batch: 主进程等待每个batch的平均时间(ms);
+            first_batch: 每个epoch等待第一个batch的平均时间(ms)，包含worker的启动时间
+    """
+    images_number, wait_time, first_batch_time, batches_number = 0, 0, 0, 0
+    start_time = time.time()
+    for _ in range(num_epochs):
+        iterator = iter(dataloader)
+        for i in range(num_batches):
+            wait_start = time.time()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                break
+            wait = time.time() - wait_start
+            if i == 0:
+                first_batch_time += wait
+            else:
+                wait_time += wait
+                batches_number += 1
+            images_number += batch[1].size(0)
+        del iterator
+    total_time = time.time() - start_time
+    return {
+        'images_per_second': images_number / total_time,
+        'wait_per_batch': wait_time / max(batches_number, 1) * 1000,
+        'first_batch': first_batch_time / num_epochs * 1000
+    }
+
+
+def autotune_loader(make_dataloader, num_batches=50, workers_candidates=None, prefetch_candidates=(2, 4, 8)):
+    """ 在真实数据集上依次对worker数、预取深度、persistent_workers以及CPU绑定进行调优（逐个参数贪心搜索）
+
+    Args:
+        make_dataloader: callable, 输入loader_params，返回用于测试的DataLoader
+        num_batches: int, 每次测试读取多少个batch
+        workers_candidates: list, worker数的候选值，为None时根据CPU核数生成
+        prefetch_candidates: tuple, 预取深度的候选值
+    Returns:
+        best_params: dict, 吞吐量最高的loader_params
+    """
+    cpu_number = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    if workers_candidates is None:
+        workers_candidates = sorted(set([0] + [n for n in [2, 4, 8, 12, 16, 24, 32] if n <= cpu_number] + [cpu_number]))
+
+    def run(params):
+        result = benchmark_loader(make_dataloader(params), num_batches)
+        print('[Loader Autotune] %s -> %.1f images/s, wait %.2fms/batch, first batch %.1fms' %
+              (params, result['images_per_second'], result['wait_per_batch'], result['first_batch']))
+        return result['images_per_second']
+
+    best_params = dict(DEFAULT_LOADER_PARAMS)
+    best_speed = None
+    search_space = [
+        ('num_workers', workers_candidates),
+        ('prefetch_factor', prefetch_candidates),
+        ('persistent_workers', [False, True]),
+        ('cpu_affinity', [False, True] if hasattr(os, 'sched_setaffinity') else [False])
+    ]
+    for key, candidates in search_space:
+        if key != 'num_workers' and best_params['num_workers'] == 0:
+            break
+        for candidate in candidates:
+            params = dict(best_params, **{key: candidate})
+            if best_speed is not None and params == best_params:
+                continue
+            speed = run(params)
+            if best_speed is None or speed > best_speed:
+                best_speed, best_params = speed, params
+    print('[Loader Autotune] best: %s, %.1f images/s' % (best_params, best_speed))
+    return best_params
+
+
+def save_loader_params(save_dir, loader_params):
+    """ 将loader_params保存到save_dir/loader_params.json，之后的训练可以通过--loader_params复用
+
+    Args:
+        save_dir: str, 保存目录，一般为本次训练param.json所在的目录
+        loader_params: dict
+    """
+    with open(os.path.join(save_dir, LOADER_PARAMS_NAME), 'w') as f:
+        json.dump(loader_params, f, indent=4)
+
+
+def load_loader_params(load_path):
+    """ 读取save_loader_params保存的参数
+
+    Args:
+        load_path: str, loader_params.json的路径，或者其所在的目录
+    Returns:
+        loader_params: dict
+    """
+    if os.path.isdir(load_path):
+        load_path = os.path.join(load_path, LOADER_PARAMS_NAME)
+    with open(load_path, 'r') as f:
+        return json.load(f)
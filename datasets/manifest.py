@@ -0,0 +1,124 @@
+'''
+该文件的功能：为逐文件存放的数据集维护一个持久化的标注清单，避免每次启动时重新打开并解析所有的txt标注文件
+
+清单默认存放在数据集目录的同级目录下（<data_root>.manifest.json），内容为：
+    {
+        "version": 1,
+        "dir_mtime": 数据集目录的修改时间(ns),
+        "entries": {标注文件名: [文件大小, 修改时间(ns), [[样本名, 类标], ...]], ...}
+    }
+数据集目录的修改时间未变化时直接使用清单；否则只重新读取新增或大小、修改时间发生变化的标注文件
+'''
+import os
+import json
+import time
+import numpy as np
+
+MANIFEST_VERSION = 1
+
+
+def get_manifest_path(data_root):
+    """ 得到数据集对应的默认清单路径，放在数据集目录之外，写清单时不会改变数据集目录的修改时间
+
+    Args:
+        data_root: str, 数据集根目录
+    Returns:
+        manifest_path: str, 清单文件路径
+    """
+    return os.path.normpath(data_root) + '.manifest.json'
+
+
+def read_annotation_file(annotation_file_path):
+    """ 解析一个标注文件，兼容 `img_1.jpg, 0`、`img_1.jpg,0` 以及 `img_1.jpg 0` 三种格式
+
+    Args:
+        annotation_file_path: str, 标注文件路径
+    Returns:
+        samples_labels: list, [[样本名, 类标], ...]
+    """
+    samples_labels = []
+    with open(annotation_file_path, encoding='utf-8-sig') as f:
+        for sample_label in f:
+            sample_label = sample_label.strip()
+            if not sample_label:
+                continue
+            if ',' in sample_label:
+                sample_name, label = sample_label.rsplit(',', 1)
+            else:
+                sample_name, label = sample_label.rsplit(None, 1)
+            samples_labels.append([sample_name.strip(), int(label)])
+    return samples_labels
+
+
+def update_manifest(data_root, manifest_path=None, verify=False):
+    """ 增量更新清单，只重新读取新增或发生变化的标注文件
+
+    Args:
+        data_root: str, 数据集根目录
+        manifest_path: str, 清单文件路径，为None时使用get_manifest_path(data_root)
+        verify: bool, 为True时即使数据集目录未变化也逐个检查标注文件的大小与修改时间（用于原地修改过标注文件的情况）
+    Returns:
+        manifest: dict, 清单内容
+    """
+    if manifest_path is None:
+        manifest_path = get_manifest_path(data_root)
+    manifest = {'version': MANIFEST_VERSION, 'dir_mtime': None, 'entries': {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest_old = json.load(f)
+        if manifest_old.get('version') == MANIFEST_VERSION:
+            manifest = manifest_old
+
+    dir_mtime = os.stat(data_root).st_mtime_ns
+    if dir_mtime == manifest['dir_mtime'] and not verify:
+        return manifest
+
+    entries_old = manifest['entries']
+    entries = {}
+    reread_number = 0
+    for annotation_file in sorted(f for f in os.listdir(data_root) if f.endswith('.txt')):
+        stat = os.stat(os.path.join(data_root, annotation_file))
+        entry = entries_old.get(annotation_file)
+        if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            entries[annotation_file] = entry
+        else:
+            samples_labels = read_annotation_file(os.path.join(data_root, annotation_file))
+            entries[annotation_file] = [stat.st_size, stat.st_mtime_ns, samples_labels]
+            reread_number += 1
+
+    changed = reread_number > 0 or len(entries) != len(entries_old) or dir_mtime != manifest['dir_mtime']
+    manifest = {'version': MANIFEST_VERSION, 'dir_mtime': dir_mtime, 'entries': entries}
+    if changed:
+        print('Updating manifest %s: %d annotation files, %d re-read' % (manifest_path, len(entries), reread_number))
+        # 先写入临时文件再重命名，避免中断时留下不完整的清单
+        with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest
+
+
+def load_manifest(data_root, manifest_path=None, verify=False):
+    """ 得到所有的图片名称以及对应的类标，顺序与按文件名排序的标注文件一致
+
+    Args:
+        data_root: str, 数据集根目录
+        manifest_path: str, 清单文件路径，为None时使用get_manifest_path(data_root)
+        verify: bool, 是否逐个检查标注文件的大小与修改时间
+    Returns:
+        samples: np.ndarray, 所有的图片名称
+        labels: np.ndarray, int64, 所有的图片对应的类标, 和samples一一对应
+    """
+    manifest = update_manifest(data_root, manifest_path, verify)
+    entries = manifest['entries']
+    samples_labels = [sample_label for annotation_file in sorted(entries) for sample_label in entries[annotation_file][2]]
+    if not samples_labels:
+        return np.empty(shape=(0,), dtype=np.str_), np.empty(shape=(0,), dtype=np.int64)
+    samples, labels = zip(*samples_labels)
+    return np.asarray(samples), np.asarray(labels, dtype=np.int64)
+
+
+if __name__ == "__main__":
+    data_root = 'data/huawei_data/combine'
+    start_time = time.time()
+    samples, labels = load_manifest(data_root)
+    print('Loaded %d samples from manifest in %.3fs' % (len(samples), time.time() - start_time))
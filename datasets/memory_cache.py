@@ -0,0 +1,182 @@
+'''
+该文件的功能：基于共享内存的解码图片缓存，带有字节预算与LRU淘汰
+
+缓存位于匿名共享内存（mmap）中，在创建DataLoader之前构造，fork出的所有worker以及同一进程中的所有折共享同一份缓存，
+第一个epoch解码过的图片在之后的epoch与其它折中直接读取，跳过JPEG解码。
+内存被划分为大小相同的槽，每个槽存放一张uint8图片；槽的元数据（所属样本、图片尺寸、最近使用时间）同样位于共享内存中，
+由一把进程间锁保护。只支持fork方式启动的worker（Linux下DataLoader的默认方式）
+
+槽的大小：resize为True时图片被缩放到decode_size，槽恰好为decode_size；resize为False时图片保持原始长宽比，
+被缩放到覆盖decode_size的最小尺寸（不放大），长宽比不超过max_aspect_ratio的图片其像素数不超过decode_size的max_aspect_ratio倍，
+槽按此分配；长宽比更极端的图片再整体缩小到放入槽中，这些图片在长宽比分桶时同样被归入最极端的桶
+'''
+import math
+import mmap
+import multiprocessing
+import numpy as np
+from PIL import Image
+from datasets.aspect_ratio_sampler import DEFAULT_BUCKET_RATIOS
+
+# 统计量在stats数组中的位置
+_HITS, _MISSES, _EVICTIONS, _OVERSIZE, _TICK = range(5)
+
+
+def get_max_aspect_ratio(bucket_ratios=None):
+    """ 长宽比分桶中最极端的长宽比（长边 / 短边），作为SharedImageCache的max_aspect_ratio
+
+    Args:
+        bucket_ratios: list, 各个桶的长宽比(width / height)，为None时使用DEFAULT_BUCKET_RATIOS
+    Returns:
+        max_aspect_ratio: float, 不小于1
+    """
+    return max(max(ratio, 1 / ratio) for ratio in (bucket_ratios or DEFAULT_BUCKET_RATIOS))
+
+
+class SharedImageCache(object):
+    def __init__(self, sample_list, budget_bytes, decode_size, resize=False, max_aspect_ratio=2.0):
+        """
+        Args:
+            sample_list: list, 可能被缓存的所有样本名，各折的训练集与验证集均为其子集
+            budget_bytes: int, 图片数据可以使用的内存字节数
+            decode_size: [height, width], 解码时的目标大小，一般为训练时用到的最大尺度；
+                JPEG图片以DCT缩放解码到不小于该大小的最小尺寸
+            resize: bool, 是否在存入缓存前缩放到decode_size；为False时存放覆盖decode_size的原始长宽比的图片
+            max_aspect_ratio: float, resize为False时槽能够完整存放的最大长宽比（长边 / 短边），见get_max_aspect_ratio
+        """
+        self.decode_size = [int(decode_size[0]), int(decode_size[1])]
+        self.resize = resize
+        self.sample_ids = {sample_name: sample_id for sample_id, sample_name in enumerate(sample_list)}
+
+        # 见文件开头的说明，DCT缩放解码只保证宽高均不小于目标大小，非正方形图片的长边可能远大于目标大小，存入前需要再缩放
+        scale = 1 if resize else max(1.0, max_aspect_ratio)
+        self.slot_bytes = int(self.decode_size[0] * self.decode_size[1] * 3 * scale)
+        self.slot_number = max(1, int(budget_bytes // self.slot_bytes))
+
+        self._data_buffer = mmap.mmap(-1, self.slot_number * self.slot_bytes)
+        self._data = np.frombuffer(self._data_buffer, dtype=np.uint8).reshape(self.slot_number, self.slot_bytes)
+
+        meta_bytes = self.slot_number * (4 + 8 + 8) + len(sample_list) * 4 + 5 * 8
+        self._meta_buffer = mmap.mmap(-1, meta_bytes)
+        offset = 0
+        self._slot_owner, offset = self._meta_array(np.int32, self.slot_number, offset)
+        self._slot_tick, offset = self._meta_array(np.int64, self.slot_number, offset)
+        self._slot_shape, offset = self._meta_array(np.int32, self.slot_number * 2, offset)
+        self._slot_shape = self._slot_shape.reshape(self.slot_number, 2)
+        self._sample_slot, offset = self._meta_array(np.int32, len(sample_list), offset)
+        self._stats, offset = self._meta_array(np.int64, 5, offset)
+        self._slot_owner[:] = -1
+        # 空槽的时间为-1，LRU淘汰时优先选择空槽
+        self._slot_tick[:] = -1
+        self._sample_slot[:] = -1
+
+        self._lock = multiprocessing.Lock()
+
+    def _meta_array(self, dtype, length, offset):
+        array = np.frombuffer(self._meta_buffer, dtype=dtype, count=length, offset=offset)
+        return array, offset + array.nbytes
+
+    def get(self, sample_name):
+        """ 读取缓存中的图片
+
+        Args:
+            sample_name: str, 样本名
+        Returns:
+            image: np.ndarray, uint8, [height, width, 3]；未命中时返回None
+        """
+        sample_id = self.sample_ids.get(sample_name)
+        if sample_id is None:
+            return None
+        with self._lock:
+            slot = self._sample_slot[sample_id]
+            if slot < 0:
+                self._stats[_MISSES] += 1
+                return None
+            self._stats[_HITS] += 1
+            self._stats[_TICK] += 1
+            self._slot_tick[slot] = self._stats[_TICK]
+            height, width = self._slot_shape[slot]
+            # 在锁内拷贝，避免读取过程中该槽被其它worker淘汰
+            return self._data[slot, :height * width * 3].reshape(height, width, 3).copy()
+
+    def put(self, sample_name, image):
+        """ 将解码后的图片存入缓存，缓存已满时淘汰最久未使用的图片
+
+        Args:
+            sample_name: str, 样本名
+            image: PIL.Image, RGB格式的图片
+        Returns:
+            image: np.ndarray, uint8, [height, width, 3], 实际存入缓存的图片（resize为True时已缩放）
+        """
+        if self.resize:
+            image = image.resize((self.decode_size[1], self.decode_size[0]), Image.BICUBIC)
+        else:
+            image = self.fit_slot(image)
+        image = np.asarray(image, dtype=np.uint8)
+        sample_id = self.sample_ids.get(sample_name)
+        if sample_id is None:
+            return image
+        if image.nbytes > self.slot_bytes:
+            with self._lock:
+                self._stats[_OVERSIZE] += 1
+            return image
+
+        with self._lock:
+            if self._sample_slot[sample_id] >= 0:
+                return image
+            slot = int(np.argmin(self._slot_tick))
+            owner = self._slot_owner[slot]
+            if owner >= 0:
+                self._sample_slot[owner] = -1
+                self._stats[_EVICTIONS] += 1
+            self._data[slot, :image.nbytes] = image.reshape(-1)
+            self._slot_shape[slot] = image.shape[:2]
+            self._slot_owner[slot] = sample_id
+            self._sample_slot[sample_id] = slot
+            self._stats[_TICK] += 1
+            self._slot_tick[slot] = self._stats[_TICK]
+        return image
+
+    def fit_slot(self, image):
+        """ 保持长宽比，将图片缩小到覆盖decode_size的最小尺寸；长宽比超过max_aspect_ratio时再缩小到放入槽中
+
+        Args:
+            image: PIL.Image, RGB格式的图片
+        Returns:
+            image: PIL.Image, 像素数不超过槽的大小
+        """
+        width, height = image.size
+        scale = min(1.0, max(self.decode_size[0] / height, self.decode_size[1] / width))
+        scale = min(scale, math.sqrt(self.slot_bytes / (height * width * 3)))
+        new_width, new_height = max(1, round(width * scale)), max(1, round(height * scale))
+        if new_width * new_height * 3 > self.slot_bytes:
+            new_width, new_height = max(1, int(width * scale)), max(1, int(height * scale))
+        if (new_width, new_height) == (width, height):
+            return image
+        return image.resize((new_width, new_height), Image.BICUBIC)
+
+    def get_stats(self):
+        """ 得到缓存的统计信息
+
+        Returns:
+            stats: dict, hits: 命中次数; misses: 未命中次数; hit_rate: 命中率; evictions: 淘汰次数;
+                oversize: 超过槽大小而未被缓存的图片数; cached: 当前缓存的图片数; slots: 槽的总数
+        """
+        with self._lock:
+            hits, misses, evictions, oversize = [int(x) for x in self._stats[:_TICK]]
+            cached = int((self._slot_owner >= 0).sum())
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / max(hits + misses, 1),
+            'evictions': evictions,
+            'oversize': oversize,
+            'cached': cached,
+            'slots': self.slot_number
+        }
+
+    def format_stats(self):
+        stats = self.get_stats()
+        return '[Memory Cache][Hit rate: {:.4f}][Hits: {}][Misses: {}][Evictions: {}][Oversize: {}][Cached: {}/{}]'.format(
+            stats['hit_rate'], stats['hits'], stats['misses'], stats['evictions'], stats['oversize'],
+            stats['cached'], stats['slots']
+        )
@@ -0,0 +1,72 @@
+'''
+该文件的功能：在DataLoader的worker中完成多尺度训练的缩放
+
+MultiScaleBatchSampler每隔multi_scale_interval个batch随机选择一次尺度，并将尺度附加到batch内的每一个索引上，
+数据集收到(index, size)形式的索引后，按照scale_backend的设置在worker中完成缩放：
+    pil: 每张图片在数据集的__getitem__中直接缩放到目标尺度
+    tensor: 数据集按照原始的image_size输出，由MultiScaleCollate对整个batch进行一次插值
+'''
+import random
+import torch
+import torch.nn.functional as F
+from torch.utils.data import Sampler
+from torch.utils.data.dataloader import default_collate
+
+
+def resize_batch(images, image_size):
+    """ 对整个batch进行bicubic插值，uint8的输入在插值后取整并截断，输出仍为uint8
+
+    Args:
+        images: [batch_size, channel, height, width] tensor, uint8或者float
+        image_size: [height, width], 目标大小
+    Returns:
+        images: [batch_size, channel, image_size[0], image_size[1]] tensor, 数据类型与输入相同
+    """
+    if list(images.shape[-2:]) == list(image_size):
+        return images
+    input_dtype = images.dtype
+    images = F.interpolate(images.float(), size=tuple(image_size), mode='bicubic', align_corners=False)
+    if input_dtype == torch.uint8:
+        images = images.round_().clamp_(0, 255).to(torch.uint8)
+    return images
+
+
+class MultiScaleBatchSampler(Sampler):
+    def __init__(self, batch_sampler, multi_scale_size, multi_scale_interval):
+        """
+        Args:
+            batch_sampler: 产生索引列表的batch sampler，如BatchSampler(RandomSampler(dataset), batch_size, False)
+            multi_scale_size: list, [[height, width], ...], 尺度的可选范围
+            multi_scale_interval: int, 每隔多少个batch重新选择一次尺度
+        """
+        self.batch_sampler = batch_sampler
+        self.multi_scale_size = multi_scale_size
+        self.multi_scale_interval = multi_scale_interval
+
+    def __iter__(self):
+        image_size = None
+        for i, batch in enumerate(self.batch_sampler):
+            # 与原先在训练循环中的选择方式保持一致
+            if i % self.multi_scale_interval == 0:
+                image_size = random.choice(self.multi_scale_size)
+            yield [(index, image_size) for index in batch]
+
+    def __len__(self):
+        return len(self.batch_sampler)
+
+
+class MultiScaleCollate(object):
+    def __init__(self, scale_backend='pil'):
+        """ 将数据集返回的(image_name, image, label, size)整理为batch
+
+        Args:
+            scale_backend: str, pil: 图片已在数据集中缩放完成; tensor: 在此处对整个batch进行bicubic插值
+        """
+        self.scale_backend = scale_backend
+
+    def __call__(self, batch):
+        image_size = batch[0][3]
+        image_names, images, labels = default_collate([sample[:3] for sample in batch])
+        if self.scale_backend == 'tensor':
+            images = resize_batch(images, image_size)
+        return image_names, images, labels
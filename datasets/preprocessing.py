@@ -0,0 +1,118 @@
+'''
+该文件的功能：数据集中单个样本的预处理流水线，在数据集初始化时构建一次，之后每个样本复用
+
+原先的流程为 PIL -> np.asarray -> 数据增强 -> Image.fromarray -> T.Resize -> T.ToTensor -> T.Normalize，
+且每次调用都会重新构建T.Compose；现在的流程为：
+    1. 在PIL中缩放到目标大小（与T.Resize(size, interpolation=3)相同），尺寸已经一致时跳过；
+    2. 转为numpy数组（唯一的一次PIL -> numpy转换），在较小的图片上进行数据增强，各个增强只在实际生效时才拷贝；
+    3. 一次完成numpy -> tensor的转换与归一化
+'''
+import time
+import collections
+import numpy as np
+import torch
+from PIL import Image
+
+
+class PreprocessPipeline(object):
+    def __init__(self, mean, std, transforms=None, profile=False, uint8_output=False):
+        """
+        Args:
+            mean: tuple, 通道均值
+            std: tuple, 通道方差
+            transforms: callable, 作用于numpy数组的数据增强；若提供stages()方法，则分别统计其中每一个增强的耗时
+            profile: bool, 是否统计各个阶段的耗时
+            uint8_output: bool, 为True时输出未归一化的uint8 tensor，归一化推迟到Solver.forward中对整个batch进行
+        """
+        self.transforms = transforms
+        self.profile = profile
+        self.uint8_output = uint8_output
+        # 将ToTensor的/255与Normalize合并为一次运算
+        self.mean = torch.tensor(mean, dtype=torch.float32).view(-1, 1, 1) * 255
+        self.std = torch.tensor(std, dtype=torch.float32).view(-1, 1, 1) * 255
+        if transforms is not None and hasattr(transforms, 'stages'):
+            self.augment_stages = transforms.stages()
+        elif transforms is not None:
+            self.augment_stages = [('transforms', transforms)]
+        else:
+            self.augment_stages = []
+        self.timings = collections.OrderedDict()
+        self.counts = collections.OrderedDict()
+
+    def __call__(self, image, size, to_tensor=True):
+        """
+        Args:
+            image: PIL.Image, RGB格式的图片
+            size: [height, width], 目标大小
+            to_tensor: bool, 为False时返回uint8的numpy数组，供训练循环中的multi_scale_transforms使用
+        Returns:
+            image: [channel, height, width] tensor，已经归一化（uint8_output为True时为uint8）；
+                或者[height, width, channel]的uint8数组
+        """
+        start = time.time() if self.profile else None
+        if image.size != (size[1], size[0]):
+            image = image.resize((size[1], size[0]), Image.BICUBIC)
+        start = self._record('resize', start)
+
+        image = np.asarray(image)
+        start = self._record('to_array', start)
+
+        for name, transform in self.augment_stages:
+            image = transform(image)
+            start = self._record(name, start)
+
+        if not to_tensor:
+            return image
+        image = torch.from_numpy(np.ascontiguousarray(image)).permute(2, 0, 1)
+        if self.uint8_output:
+            image = image.contiguous()
+        else:
+            image = image.float().sub_(self.mean).div_(self.std)
+        self._record('to_tensor', start)
+        return image
+
+    def _record(self, name, start):
+        if not self.profile:
+            return None
+        now = time.time()
+        self.timings[name] = self.timings.get(name, 0) + now - start
+        self.counts[name] = self.counts.get(name, 0) + 1
+        return now
+
+    def format_profile(self):
+        """ 得到各个阶段平均耗时的描述
+
+        Returns:
+            descript: str, 例如 'resize: 1.20ms, to_array: 0.10ms, ...'
+        """
+        return ', '.join('%s: %.2fms' % (name, self.timings[name] / max(self.counts[name], 1) * 1000)
+                         for name in self.timings)
+
+
+if __name__ == "__main__":
+    import os
+    import torchvision.transforms as T
+    from datasets.data_augmentation import DataAugmentation
+    from datasets.image_decode import decode_image
+
+    data_root = 'data/huawei_data/combine'
+    size = [320, 320]
+    mean = (0.485, 0.456, 0.406)
+    std = (0.229, 0.224, 0.225)
+    image_paths = sorted(os.path.join(data_root, f) for f in os.listdir(data_root) if f.endswith('.jpg'))[:200]
+    images = [decode_image(image_path, size) for image_path in image_paths]
+    augmentation = DataAugmentation(erase_prob=0.3, full_aug=True, gray_prob=0.3)
+
+    # 原先的流程
+    start_time = time.time()
+    for image in images:
+        image = Image.fromarray(augmentation(np.asarray(image)))
+        image = T.Compose([T.Resize(size, interpolation=3), T.ToTensor(), T.Normalize(mean, std)])(image)
+    print('Previous pipeline: %.2fms/image' % ((time.time() - start_time) / len(images) * 1000))
+
+    pipeline = PreprocessPipeline(mean, std, augmentation, profile=True)
+    start_time = time.time()
+    for image in images:
+        image = pipeline(image, size)
+    print('Compiled pipeline: %.2fms/image' % ((time.time() - start_time) / len(images) * 1000))
+    print(pipeline.format_profile())
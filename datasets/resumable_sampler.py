@@ -0,0 +1,61 @@
+'''
+该文件的功能：可复现、可从epoch中间恢复的batch采样器
+
+每个epoch开始时以(seed, epoch)为随机种子生成该epoch全部batch的顺序，与被包装的采样器使用哪一种随机数生成器无关；
+恢复训练时，以相同的seed与epoch重新生成顺序并跳过已经训练过的start_batch个batch，从下一个未见过的batch继续。
+生成顺序前后会保存并恢复全局随机数状态，不影响训练循环中其它依赖随机数的部分（如cut_mix）
+'''
+import random
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+
+class ResumableBatchSampler(Sampler):
+    def __init__(self, batch_sampler, seed=0):
+        """
+        Args:
+            batch_sampler: 被包装的batch sampler，可以是BatchSampler、MultiScaleBatchSampler、ClassAwareBatchSampler等
+            seed: int, 随机种子，一般为本次训练保存在seed.pkl中的种子
+        """
+        self.batch_sampler = batch_sampler
+        self.seed = seed
+        self.epoch = 0
+        self.start_batch = 0
+
+    def set_epoch(self, epoch, start_batch=0):
+        """ 设置下一次迭代的epoch以及起始batch
+
+        Args:
+            epoch: int, 当前的epoch
+            start_batch: int, 从该epoch的第几个batch开始，恢复训练时为已经训练过的batch数
+        """
+        self.epoch = epoch
+        self.start_batch = start_batch
+        # DistributedSampler使用自己的生成器，以(seed + epoch)打乱顺序，需要同步设置
+        sampler = self.batch_sampler
+        while sampler is not None:
+            if hasattr(sampler, 'set_epoch'):
+                sampler.seed = self.seed
+                sampler.set_epoch(epoch)
+            sampler = getattr(sampler, 'batch_sampler', None) or getattr(sampler, 'sampler', None)
+
+    def __iter__(self):
+        python_state, numpy_state, torch_state = random.getstate(), np.random.get_state(), torch.get_rng_state()
+        epoch_seed = (self.seed * 1000003 + self.epoch) % (2 ** 32)
+        random.seed(epoch_seed)
+        np.random.seed(epoch_seed)
+        torch.manual_seed(epoch_seed)
+        try:
+            batches = list(self.batch_sampler)
+        finally:
+            random.setstate(python_state)
+            np.random.set_state(numpy_state)
+            torch.set_rng_state(torch_state)
+
+        start_batch, self.start_batch = self.start_batch, 0
+        for batch in batches[start_batch:]:
+            yield batch
+
+    def __len__(self):
+        return len(self.batch_sampler)
@@ -0,0 +1,126 @@
+'''
+该文件的功能：紧凑的样本注册表，以numpy数组保存样本名与类标
+
+原先TrainDataset与ValDataset以Python的list保存样本名（str）与类标（int），fork出的worker每次访问都会修改这些对象的引用计数，
+使得原本与主进程共享的内存页被逐页复制，每个worker的内存占用在一个epoch中不断增长。
+SampleRegistry将所有样本名以utf-8编码拼接为一个uint8数组并记录各自的偏移，类标保存为int16数组，
+访问时只读取数组中的数据，不会触碰任何共享的Python对象；choose_dataset的筛选同样以向量化的方式完成
+'''
+import os
+import numpy as np
+
+
+def get_memory_usage():
+    """ 得到当前进程的内存占用
+
+    Returns:
+        memory_usage: dict, {'rss': 常驻内存, 'private': 进程私有的内存（被复制的共享页计入其中）}，单位为MB；
+            不支持/proc的系统上private为None
+    """
+    usage = {'rss': None, 'private': None}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        kb = lambda key: int(fields.get(key, '0 kB').split()[0])
+        usage['rss'] = kb('Rss') / 1024
+        usage['private'] = (kb('Private_Clean') + kb('Private_Dirty')) / 1024
+    except (IOError, OSError, ValueError):
+        import resource
+        usage['rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return usage
+
+
+class SampleRegistry(object):
+    def __init__(self, sample_list, label_list, choose_dataset='combine'):
+        """
+        Args:
+            sample_list: list, 样本名
+            label_list: list, 类标, 与sample_list中的样本按照顺序对应
+            choose_dataset: str，选择什么数据集，combine: 全部样本; only_self: 样本名中含有img的样本; only_official: 其余样本
+        """
+        labels = np.asarray(label_list)
+        if len(labels) and (labels.min() < np.iinfo(np.int16).min or labels.max() > np.iinfo(np.int16).max):
+            raise ValueError('Labels out of the int16 range.')
+        mask = self.choose_mask(sample_list, choose_dataset)
+        if mask is not None:
+            sample_list = [sample for sample, keep in zip(sample_list, mask) if keep]
+            labels = labels[mask]
+
+        encoded = [sample.encode('utf-8') for sample in sample_list]
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=self.offsets[1:])
+        self.names = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        self.labels = labels.astype(np.int16)
+
+    @staticmethod
+    def choose_mask(sample_list, choose_dataset):
+        """ 得到choose_dataset对应的样本掩码
+
+        Args:
+            sample_list: list, 样本名
+            choose_dataset: str，选择什么数据集
+        Returns:
+            mask: np.ndarray, bool类型，combine时为None
+        """
+        if choose_dataset == 'combine':
+            return None
+        is_self = np.char.find(np.asarray(sample_list, dtype=np.str_), 'img') >= 0
+        if choose_dataset == 'only_self':
+            return is_self
+        elif choose_dataset == 'only_official':
+            return ~is_self
+        raise ValueError('Unknown choose_dataset: %s' % choose_dataset)
+
+    def __getitem__(self, index):
+        """
+        Args:
+            index: int, 样本的索引
+        Returns:
+            sample_name: str, 样本名
+        """
+        return self.names[self.offsets[index]:self.offsets[index + 1]].tobytes().decode('utf-8')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def nbytes(self):
+        """ 注册表占用的字节数
+        """
+        return self.names.nbytes + self.offsets.nbytes + self.labels.nbytes
+
+
+if __name__ == "__main__":
+    import multiprocessing
+
+    sample_number, worker_number = 500000, 4
+    sample_list = ['img_%d.jpg' % index if index % 3 else '%d.jpg' % index for index in range(sample_number)]
+    label_list = [index % 54 for index in range(sample_number)]
+    registry = SampleRegistry(sample_list, label_list)
+    print('Registry: %.2fMB for %d samples' % (registry.nbytes() / 1024 ** 2, len(registry)))
+
+    def touch(names, labels, queue):
+        before = get_memory_usage()
+        for epoch in range(2):
+            for index in np.random.permutation(len(names)):
+                name, label = names[index], int(labels[index])
+        after = get_memory_usage()
+        queue.put((os.getpid(), before, after))
+
+    # 与DataLoader的worker相同，以fork方式启动，在worker中按照随机顺序访问每一个样本
+    context = multiprocessing.get_context('fork')
+    for description, names, labels in [('Python list', sample_list, label_list),
+                                       ('SampleRegistry', registry, registry.labels)]:
+        queue = context.Queue()
+        workers = [context.Process(target=touch, args=(names, labels, queue)) for _ in range(worker_number)]
+        for worker in workers:
+            worker.start()
+        for _ in workers:
+            pid, before, after = queue.get()
+            print('[%s][worker %d] RSS: %.1fMB -> %.1fMB, private: %.1fMB -> %.1fMB' % (
+                description, pid, before['rss'], after['rss'], before['private'] or 0, after['private'] or 0))
+        for worker in workers:
+            worker.join()
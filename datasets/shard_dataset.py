@@ -0,0 +1,134 @@
+'''
+该文件的功能：将逐文件存放的数据集（每个样本一个jpg与一个txt）打包为少量大分片文件，并按偏移量随机读取样本
+
+分片目录结构：
+    shard_00000.bin, shard_00001.bin, ...: 依次拼接的原始图片字节
+    index.json: {"shards": [分片文件名, ...], "samples": [[样本名, 类标, 分片编号, 偏移量, 字节数], ...]}
+'''
+import os
+import io
+import json
+import mmap
+import tqdm
+from PIL import Image
+
+SHARD_INDEX_NAME = 'index.json'
+SHARD_NAME_FORMAT = 'shard_%05d.bin'
+
+
+def pack_dataset(data_root, sample_list, label_list, shard_root, shard_size=1024 ** 3):
+    """将逐文件存放的样本打包为分片文件，并生成偏移索引
+
+    Args:
+        data_root: str, 原始数据集根目录
+        sample_list: list, 样本名
+        label_list: list, 类标, 与sample_list中的样本按照顺序对应
+        shard_root: str, 分片文件的存放目录
+        shard_size: int, 单个分片文件的最大字节数，超过后新建分片
+    Returns:
+        index: dict, 写入index.json的索引内容
+    """
+    if not os.path.exists(shard_root):
+        print('Making %s' % shard_root)
+        os.makedirs(shard_root)
+
+    shards, samples = [], []
+    shard_file, shard_offset = None, 0
+    tbar = tqdm.tqdm(list(zip(sample_list, label_list)))
+    for sample_name, label in tbar:
+        with open(os.path.join(data_root, sample_name), 'rb') as f:
+            sample_bytes = f.read()
+        # 当前分片写满后，新建一个分片
+        if shard_file is None or shard_offset + len(sample_bytes) > shard_size:
+            if shard_file is not None:
+                shard_file.close()
+            shards.append(SHARD_NAME_FORMAT % len(shards))
+            shard_file = open(os.path.join(shard_root, shards[-1]), 'wb')
+            shard_offset = 0
+        shard_file.write(sample_bytes)
+        samples.append([sample_name, int(label), len(shards) - 1, shard_offset, len(sample_bytes)])
+        shard_offset += len(sample_bytes)
+        tbar.set_description(desc='Packing into %s' % shards[-1])
+    if shard_file is not None:
+        shard_file.close()
+
+    index = {'shards': shards, 'samples': samples}
+    # 索引最后写入，保证index.json存在时分片已经完整
+    with open(os.path.join(shard_root, SHARD_INDEX_NAME), 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    print('Packed %d samples into %d shards at %s' % (len(samples), len(shards), shard_root))
+    return index
+
+
+class ShardReader(object):
+    def __init__(self, shard_root):
+        """按照index.json中的偏移量从分片文件中读取样本
+
+        Args:
+            shard_root: str, 分片文件的存放目录
+        """
+        self.shard_root = shard_root
+        with open(os.path.join(shard_root, SHARD_INDEX_NAME), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        self.shard_names = index['shards']
+        self.samples = [sample[0] for sample in index['samples']]
+        self.labels = [sample[1] for sample in index['samples']]
+        self.locations = {sample[0]: (sample[2], sample[3], sample[4]) for sample in index['samples']}
+
+        # mmap在各个进程中懒加载，不随pickle传递给DataLoader的worker
+        self._mmaps = {}
+        self._pid = None
+
+    def get_samples_labels(self):
+        """ 得到分片中所有的图片名称以及对应的类标
+        Returns:
+            samples: list, 所有的图片名称
+            labels: list, 所有的图片对应的类标, 和samples一一对应
+        """
+        return list(self.samples), list(self.labels)
+
+    def read_bytes(self, sample_name):
+        """读取某一样本的原始字节
+
+        Args:
+            sample_name: str, 样本名
+        Returns:
+            sample_bytes: bytes, 图片文件的原始字节
+        """
+        shard_id, offset, length = self.locations[sample_name]
+        return self._get_mmap(shard_id)[offset:offset + length]
+
+    def open_image(self, sample_name):
+        """以PIL.Image的形式打开某一样本
+
+        Args:
+            sample_name: str, 样本名
+        Returns:
+            image: PIL.Image, 未经过convert的图片
+        """
+        return Image.open(io.BytesIO(self.read_bytes(sample_name)))
+
+    def _get_mmap(self, shard_id):
+        # 在fork出的子进程中重新建立映射，避免多个进程共享同一个文件句柄的读写位置
+        if self._pid != os.getpid():
+            self._mmaps = {}
+            self._pid = os.getpid()
+        if shard_id not in self._mmaps:
+            with open(os.path.join(self.shard_root, self.shard_names[shard_id]), 'rb') as f:
+                self._mmaps[shard_id] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmaps[shard_id]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_mmaps'] = {}
+        state['_pid'] = None
+        return state
+
+
+if __name__ == "__main__":
+    from datasets.manifest import load_manifest
+
+    data_root = 'data/huawei_data/combine'
+    shard_root = 'data/huawei_data/combine_shards'
+    samples, labels = load_manifest(data_root)
+    pack_dataset(data_root, samples.tolist(), labels.tolist(), shard_root)
@@ -0,0 +1,264 @@
+'''
+该文件的功能：将远端（OBS）上的数据集按需暂存到本地，使训练与数据拷贝重叠
+
+流程：
+    1. 先同步拷贝标注文件（.txt/.json），之后即可生成manifest、划分数据集并创建DataLoader；
+    2. 后台线程按照优先队列拷贝其余文件，StagingBatchSampler在迭代时将接下来prefetch_batches个batch的样本按照读取顺序
+       推入优先队列，即将被读取的样本优先拷贝；
+    3. 读取样本时若文件尚未拷贝，则在当前进程（DataLoader的worker）中立即拷贝该文件；
+    4. 后台拷贝失败的文件重新排队，重试MAX_COPY_ATTEMPTS次后仍然失败则记录下来，wait时若这些文件仍不在本地则抛出异常。
+远端存储由create_store根据路径选择：s3://、obs://开头的路径使用MoxStore，其它路径（挂载的网络盘等）使用LocalDirStore
+'''
+import os
+import time
+import queue
+import shutil
+import itertools
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from torch.utils.data import Sampler
+
+ANNOTATION_SUFFIXES = ('.txt', '.json')
+REMOTE_PREFIXES = ('s3://', 'obs://')
+MAX_COPY_ATTEMPTS = 3
+
+
+class LocalDirStore(object):
+    def __init__(self, root):
+        """ 本地文件系统上的远端存储，例如挂载的网络盘
+
+        Args:
+            root: str, 数据集目录
+        """
+        self.root = root
+
+    def list_files(self):
+        file_names = []
+        for dir_path, _, names in os.walk(self.root):
+            for name in names:
+                file_names.append(os.path.relpath(os.path.join(dir_path, name), self.root))
+        return sorted(file_names)
+
+    def copy_file(self, file_name, local_path):
+        shutil.copyfile(os.path.join(self.root, file_name), local_path)
+
+
+class MoxStore(object):
+    def __init__(self, root):
+        """ OBS上的远端存储，通过moxing访问
+
+        Args:
+            root: str, OBS上的数据集目录，例如s3://bucket/data/combine
+        """
+        self.root = root
+
+    def list_files(self):
+        import moxing as mox
+        return sorted(name for name in mox.file.list_directory(self.root, recursive=True) if not name.endswith('/'))
+
+    def copy_file(self, file_name, local_path):
+        import moxing as mox
+        mox.file.copy(os.path.join(self.root, file_name), local_path)
+
+
+def create_store(root):
+    """ 根据路径选择远端存储
+
+    Args:
+        root: str, 远端数据集目录
+    Returns:
+        store: MoxStore/LocalDirStore
+    """
+    if root.startswith(REMOTE_PREFIXES):
+        return MoxStore(root)
+    return LocalDirStore(root)
+
+
+class DataStager(object):
+    def __init__(self, store, local_root, num_threads=8):
+        """
+        Args:
+            store: LocalDirStore/MoxStore, 远端存储
+            local_root: str, 本地数据集目录
+            num_threads: int, 后台拷贝线程数
+        """
+        self.store = store
+        self.local_root = local_root
+        self.num_threads = num_threads
+
+        # 以下成员只在主进程中使用，fork出的worker只会调用ensure
+        self._queue = queue.PriorityQueue()
+        self._counter = 0
+        self._remaining = None
+        self._attempts = collections.Counter()
+        self._failed = set()
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        self._start_time = None
+
+    def start(self):
+        """ 同步拷贝标注文件，随后启动后台线程拷贝其余文件
+        """
+        self._start_time = time.time()
+        if not os.path.exists(self.local_root):
+            os.makedirs(self.local_root)
+        file_names = self.store.list_files()
+        annotation_names = [name for name in file_names if name.endswith(ANNOTATION_SUFFIXES)]
+        with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            list(executor.map(self.ensure, annotation_names))
+        print('Staged %d annotation files in %.1fs' % (len(annotation_names), time.time() - self._start_time))
+
+        remaining = [name for name in file_names
+                     if not name.endswith(ANNOTATION_SUFFIXES) and not os.path.exists(self.local_path(name))]
+        self._remaining = set(remaining)
+        if not self._remaining:
+            self._finished.set()
+            return
+        for name in remaining:
+            self._push(name, 1)
+        for _ in range(self.num_threads):
+            threading.Thread(target=self._copy_worker, daemon=True).start()
+
+    def prioritize(self, file_names):
+        """ 将即将被读取的文件按照顺序推入优先队列，优先于后台的顺序拷贝；先推入的文件先拷贝
+
+        Args:
+            file_names: list, 按照读取顺序排列的文件名
+        """
+        if self._finished.is_set():
+            return
+        with self._lock:
+            file_names = [name for name in file_names if name in self._remaining]
+        for name in file_names:
+            self._push(name, 0)
+
+    def ensure(self, file_name):
+        """ 确保文件已经在本地，不在本地时立即从远端拷贝
+
+        Args:
+            file_name: str, 相对于数据集根目录的文件名
+        Returns:
+            local_path: str, 文件的本地路径
+        """
+        local_path = self.local_path(file_name)
+        if not os.path.exists(local_path):
+            local_dir = os.path.dirname(local_path)
+            if not os.path.exists(local_dir):
+                os.makedirs(local_dir, exist_ok=True)
+            # 先拷贝到临时文件再重命名，其它进程不会读到不完整的文件
+            tmp_path = '%s.tmp.%d.%d' % (local_path, os.getpid(), threading.get_ident())
+            self.store.copy_file(file_name, tmp_path)
+            os.replace(tmp_path, local_path)
+        return local_path
+
+    def wait(self):
+        """ 阻塞直到所有文件拷贝完成
+
+        Raises:
+            RuntimeError: 后台多次拷贝失败、之后也没有被按需拷贝的文件仍不在本地
+        """
+        self._finished.wait()
+        missing = sorted(name for name in self._failed if not os.path.exists(self.local_path(name)))
+        if missing:
+            raise RuntimeError('Failed to stage %d files from %s, for example: %s'
+                               % (len(missing), self.store.root, ', '.join(missing[:5])))
+
+    @property
+    def finished(self):
+        return self._finished.is_set()
+
+    def local_path(self, file_name):
+        """ 文件的本地路径，不保证文件已经拷贝完成
+        """
+        return os.path.join(self.local_root, file_name)
+
+    def _push(self, file_name, priority):
+        # 优先级相同时按照推入的顺序拷贝
+        with self._lock:
+            self._counter += 1
+            self._queue.put((priority, self._counter, file_name))
+
+    def _copy_worker(self):
+        while not self._finished.is_set():
+            file_name = self._queue.get()[-1]
+            with self._lock:
+                if file_name not in self._remaining:
+                    continue
+            try:
+                self.ensure(file_name)
+            except Exception as e:
+                with self._lock:
+                    self._attempts[file_name] += 1
+                    attempts = self._attempts[file_name]
+                print('Staging %s failed (attempt %d/%d): %s' % (file_name, attempts, MAX_COPY_ATTEMPTS, e))
+                if attempts < MAX_COPY_ATTEMPTS:
+                    # 排到队尾重试，暂时性的网络错误不会导致文件缺失
+                    self._push(file_name, 1)
+                    continue
+                # 读取时仍会按需拷贝，wait时检查该文件是否最终就绪
+                with self._lock:
+                    self._failed.add(file_name)
+            with self._lock:
+                self._remaining.discard(file_name)
+                if not self._remaining and not self._finished.is_set():
+                    print('Staged all files to %s in %.1fs' % (self.local_root, time.time() - self._start_time))
+                    self._finished.set()
+
+    def __getstate__(self):
+        # 只有store与路径需要传递给worker
+        return {'store': self.store, 'local_root': self.local_root, 'num_threads': self.num_threads}
+
+    def __setstate__(self, state):
+        self.__init__(state['store'], state['local_root'], state['num_threads'])
+
+
+class StagingBatchSampler(Sampler):
+    def __init__(self, batch_sampler, sample_list, stager, prefetch_batches=64):
+        """ 迭代时将接下来prefetch_batches个batch的样本按照读取顺序推入stager的优先队列
+
+        Args:
+            batch_sampler: 被包装的batch sampler，产生索引或(index, size)的列表
+            sample_list: list, 数据集中的样本名，与索引一一对应
+            stager: DataStager
+            prefetch_batches: int, 预取窗口的batch数，应大于DataLoader预取的batch数(num_workers * prefetch_factor)
+        """
+        self.batch_sampler = batch_sampler
+        self.sample_list = sample_list
+        self.stager = stager
+        self.prefetch_batches = max(1, prefetch_batches)
+
+    @property
+    def seed(self):
+        return getattr(self.batch_sampler, 'seed', None)
+
+    @seed.setter
+    def seed(self, seed):
+        # 包装ResumableBatchSampler时，训练循环设置的随机种子需要作用于被包装的采样器
+        self.batch_sampler.seed = seed
+
+    def set_epoch(self, epoch, start_batch=0):
+        """ 包装ResumableBatchSampler时转发set_epoch
+        """
+        self.batch_sampler.set_epoch(epoch, start_batch)
+
+    def __iter__(self):
+        iterator = iter(self.batch_sampler)
+        window = collections.deque(itertools.islice(iterator, self.prefetch_batches))
+        for batch in window:
+            self._prioritize(batch)
+        while window:
+            batch = window.popleft()
+            # 每读取一个batch，将窗口向后移动一个batch
+            for next_batch in itertools.islice(iterator, 1):
+                window.append(next_batch)
+                self._prioritize(next_batch)
+            yield batch
+
+    def _prioritize(self, batch):
+        if not self.stager.finished:
+            self.stager.prioritize([self.sample_list[item[0] if isinstance(item, (tuple, list)) else item]
+                                    for item in batch])
+
+    def __len__(self):
+        return len(self.batch_sampler)
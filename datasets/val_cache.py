@@ -0,0 +1,112 @@
+'''
+该文件的功能：将验证集一次性解码并缩放到image_size，以uint8数组的形式保存在内存或内存映射文件中，之后每个epoch的验证直接按batch切片
+
+验证集不进行任何随机的数据增强，每个epoch重新解码、缩放得到的结果完全相同。
+CachedValLoader在第一次迭代时构建缓存，之后的迭代不再经过Dataset与DataLoader的worker，
+输出未归一化的uint8 tensor，由Solver.forward在训练设备上归一化。
+mmap模式下缓存文件以划分文件、折、样本与图片大小为键，之后的训练（各个fold、重新启动的训练）直接复用
+'''
+import os
+import hashlib
+import tqdm
+import numpy as np
+import torch
+from concurrent.futures import ThreadPoolExecutor
+
+
+def get_val_cache_path(cache_root, split_name, fold, sample_list, size):
+    """ 得到验证集缓存文件的路径
+
+    Args:
+        cache_root: str, 缓存目录
+        split_name: str, 数据集划分文件的路径，在线划分时为None
+        fold: int, 当前为第几折
+        sample_list: SampleRegistry, 验证集的样本名，其内容的摘要同样作为键的一部分，划分变化时缓存自动失效
+        size: [height, width], 图片大小
+    Returns:
+        cache_path: str
+    """
+    digest = hashlib.sha1(np.ascontiguousarray(sample_list.names).tobytes())
+    digest.update(np.ascontiguousarray(sample_list.labels).tobytes())
+    split_name = os.path.splitext(os.path.basename(split_name))[0] if split_name else 'online'
+    return os.path.join(cache_root, 'val_%s_fold%d_%dx%d_%s.npy' % (split_name, fold, size[0], size[1], digest.hexdigest()[:12]))
+
+
+class CachedValLoader(object):
+    def __init__(self, val_dataset, batch_size, mode='ram', cache_path=None, num_threads=8, rank=0, world_size=1,
+                 pin_memory=True):
+        """
+        Args:
+            val_dataset: ValDataset, 验证数据集，不使用多尺度与长宽比分桶
+            batch_size: int, 批量大小
+            mode: str, ram: 缓存在内存中; mmap: 缓存在cache_path对应的内存映射文件中
+            cache_path: str, mmap模式下缓存文件的路径，见get_val_cache_path
+            num_threads: int, 构建缓存时解码图片的线程数
+            rank: int, DistributedDataParallel训练时当前进程的序号，只验证第rank, rank + world_size, ...个样本
+            world_size: int, 进程总数
+            pin_memory: bool, 有GPU时是否将batch放入锁页内存，--device cpu时为False
+        """
+        if mode == 'mmap' and not cache_path:
+            raise ValueError('cache_path must be specified when mode is mmap.')
+        self.dataset = val_dataset
+        self.batch_size = batch_size
+        self.mode = mode
+        self.cache_path = cache_path
+        self.num_threads = num_threads
+        self.images = None
+        self.labels = torch.from_numpy(val_dataset.label_list.astype(np.int64))
+        self.indices = np.arange(rank, len(val_dataset), world_size)
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+
+    def build(self):
+        """ 构建或加载缓存
+        """
+        size, number = self.dataset.size, len(self.dataset)
+        shape = (number, size[0], size[1], 3)
+        if self.mode == 'mmap' and os.path.exists(self.cache_path):
+            images = np.load(self.cache_path, mmap_mode='r')
+            if images.shape == shape:
+                print('Loaded validation cache from %s' % self.cache_path)
+                self.images = images
+                return
+            print('Validation cache %s does not match the dataset, rebuilding.' % self.cache_path)
+
+        # DistributedDataParallel训练时各个进程可能同时构建同一个缓存文件，临时文件以进程号区分
+        tmp_path = '%s.%d.tmp' % (self.cache_path, os.getpid())
+        if self.mode == 'mmap':
+            os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+            images = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=shape)
+        else:
+            images = np.empty(shape, dtype=np.uint8)
+
+        def fill_row(row):
+            image = self.dataset.read(row)
+            # 与ValDataset相同的bicubic缩放，不转换为tensor
+            images[row] = self.dataset.preprocess(image, size, to_tensor=False)
+
+        print('Building validation cache: %d samples, size: %s' % (number, size))
+        with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            list(tqdm.tqdm(executor.map(fill_row, range(number)), total=number))
+
+        if self.mode == 'mmap':
+            images.flush()
+            del images
+            os.replace(tmp_path, self.cache_path)
+            images = np.load(self.cache_path, mmap_mode='r')
+        self.images = images
+
+    def __iter__(self):
+        if self.images is None:
+            self.build()
+        for start in range(0, len(self.indices), self.batch_size):
+            indices = self.indices[start:start + self.batch_size]
+            # 单进程时为连续的切片，多进程时为等间隔的切片，均不需要逐个索引
+            rows = slice(indices[0], indices[-1] + 1, self.indices[1] - self.indices[0] if len(self.indices) > 1 else 1)
+            images = torch.from_numpy(np.ascontiguousarray(self.images[rows])).permute(0, 3, 1, 2).contiguous()
+            if self.pin_memory:
+                images = images.pin_memory()
+            image_names = [self.dataset.sample_list[index] for index in indices]
+            yield image_names, images, self.labels[rows]
+
+    def __len__(self):
+        return (len(self.indices) + self.batch_size - 1) // self.batch_size
@@ -11,6 +11,8 @@ from PIL import Image, ImageFont, ImageDraw
 from models.build_model import PrepareModel
 from config import get_classify_config
 from datasets.create_dataset import GetDataloader, get_dataloader_from_folder
+from datasets.image_decode import decode_image
+from utils.checkpoint_store import load_checkpoint_file
 
 
 class DemoResults(object):
@@ -45,14 +47,15 @@ class DemoResults(object):
             save: bool, 是否保存图片
             save_path: str, 保存路径
         """
-        tbar = tqdm.tqdm(valid_loader)
+        # 样本名与类标直接取自数据集，不需要经过DataLoader解码图片，也不需要逐个打开标注文件
+        valid_dataset = valid_loader.dataset
+        tbar = tqdm.tqdm(list(zip(valid_dataset.sample_list, valid_dataset.label_list)))
         with torch.no_grad():
-            for i, (image_names, _, _) in enumerate(tbar):
-                for image_name in image_names:
-                    sample_path = os.path.join(self.data_url, image_name)
-                    self.predict_single_sample(sample_path, rank, show, save, save_path)
+            for image_name, label_index in tbar:
+                sample_path = os.path.join(self.data_url, image_name)
+                self.predict_single_sample(sample_path, rank, show, save, save_path, label_index=int(label_index))
 
-    def predict_single_sample(self, sample_path, rank=1, show=False, save=False, save_path=''):
+    def predict_single_sample(self, sample_path, rank=1, show=False, save=False, save_path='', label_index=None):
         """对单张样本进行预测
 
         Args:
@@ -61,18 +64,20 @@ class DemoResults(object):
             show: bool, 是否显示图片
             save: bool, 是否保存图片
             save_path: str, 保存路径
+            label_index: int, 真实类别索引，为None时从样本对应的标注文件中读取
         Returns:
             indexs: list，预测出的最相似的rank个类别索引
             label_index: int，真实类别索引
             predict_label: str, 预测出top1类标名称，如：大雁塔
             label: str，真实类标名称，如：大雁塔
         """
-        annotation_txt = sample_path.replace('jpg', 'txt')
-        with open(annotation_txt, 'r') as f:
-            for line in f:
-                label_index = int(line.split(', ')[1])
+        if label_index is None:
+            annotation_txt = sample_path.replace('jpg', 'txt')
+            with open(annotation_txt, 'r') as f:
+                for line in f:
+                    label_index = int(line.split(', ')[1])
         label = self.label_dict[str(label_index)]
-        image = Image.open(sample_path).convert('RGB')
+        image = decode_image(sample_path, self.image_size)
         original_image = image.copy()
         transforms = T.Compose([
             T.Resize(self.image_size),
@@ -123,7 +128,7 @@ class DemoResults(object):
         """
         prepare_model = PrepareModel()
         model = prepare_model.create_model(self.model_type, self.classes_num, self.drop_rate, pretrained=False, bn_to_gn=self.bn_to_gn)
-        model.load_state_dict(torch.load(self.weight_path)['state_dict'])
+        model.load_state_dict(load_checkpoint_file(self.weight_path)['state_dict'])
         print('Successfully Loaded from %s' % self.weight_path)
         model = model.cuda()
         model.eval()
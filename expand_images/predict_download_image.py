@@ -10,6 +10,7 @@ import shutil
 from PIL import Image, ImageFont, ImageDraw
 from models.build_model import PrepareModel
 from config import get_classify_config
+from datasets.image_decode import decode_image
 
 
 #############################################
@@ -77,7 +78,7 @@ class PredictDownloadImage(object):
         """
         # 只保留能够正确打开的样本
         try:
-            image = Image.open(sample_path).convert('RGB')
+            image = decode_image(sample_path, self.image_size)
             transforms = T.Compose([
                 T.Resize(self.image_size),
                 T.ToTensor(),
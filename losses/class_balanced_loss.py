@@ -62,7 +62,7 @@ def smooth_CrossEntropy(inputs, targets, num_classes, epsilon=0.1, alpha=None, u
         num_classes: int, 类别总数
         epsilon: float, 系数
         alpha: list, float or list, 类别的权重
-        use_gpu: bool, 是否使用gpu
+        use_gpu: bool, 仅为兼容旧的调用而保留，targets总是放在inputs所在的设备上
     """
 
     if isinstance(alpha, (float, int)):
@@ -82,9 +82,8 @@ def smooth_CrossEntropy(inputs, targets, num_classes, epsilon=0.1, alpha=None, u
     填充方法为：取出targets的第i行中的第一个元素（每行只有一个元素），记该值为j；则前面tensor中的(i,j)元素填充1；
     最终targets的维度为[batch_size, num_classes]，每一行代表一个样本，若该样本类别为j，则只有第j元素为1，其余元素为0
     '''
-    targets = torch.zeros(log_probs.size()).scatter_(1, targets.unsqueeze(1).data.cpu(), 1)
-    if use_gpu:
-        targets = targets.cuda()
+    # 在inputs所在的设备上构造one-hot，--device cpu时同样适用，也不需要拷贝回CPU
+    targets = torch.zeros(log_probs.size(), device=log_probs.device).scatter_(1, targets.unsqueeze(1).to(log_probs.device), 1)
     targets = (1 - epsilon) * targets + epsilon / num_classes
     # mean(0)表示缩减第0维，也就是按列求均值，得到维度为[num_classes]，得到该batch内每一个类别的损失，再求和
     loss = (- targets * log_probs).mean(0).sum()
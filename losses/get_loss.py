@@ -3,10 +3,11 @@ import torch.nn as nn
 from losses.CE_label_smooth import CrossEntropyLabelSmooth
 from losses.focal_loss import MultiFocalLoss
 from losses.class_balanced_loss import CB_Loss
+from utils.distributed import is_distributed
 
 
 class Loss(nn.Module):
-    def __init__(self, model_name, loss_name, num_classes, samples_per_class, beta, gamma):
+    def __init__(self, model_name, loss_name, num_classes, samples_per_class, beta, gamma, use_cuda=None):
         """
 
         :param model_name: 模型的名称；类型为str
@@ -15,6 +16,7 @@ class Loss(nn.Module):
         :param samples_per_class: A python list of size [num_of_classes].
         :param beta: float. Hyperparameter for Class balanced loss.
         :param gamma: float. Hyperparameter for Focal loss.
+        :param use_cuda: 是否在GPU上计算损失，为None时有GPU即使用；类型为bool
         """
         super(Loss, self).__init__()
         self.model_name = model_name
@@ -47,10 +49,17 @@ class Loss(nn.Module):
         self.loss_module = nn.ModuleList([l['function'] for l in self.loss_struct if l['function'] is not None])
 
         # self.log的维度为[1, len(self.loss)]，前面几个分别存放某次迭代各个损失函数的损失值，最后一个存放某次迭代损失值之和
+        # self.log_running存放自上一次record_loss_iteration以来的损失之和，self.log_sum存放该epoch的损失之和
+        # 三者均保留在损失所在的设备上，只有在record_loss_iteration与record_loss_epoch中才读取到CPU，避免每次迭代都同步
         self.log, self.log_sum = torch.zeros(len(self.loss_struct)), torch.zeros(len(self.loss_struct))
-
-        if torch.cuda.is_available():
-            self.loss_module = torch.nn.DataParallel(self.loss_module)
+        self.log_running, self.log_running_count = torch.zeros(len(self.loss_struct)), 0
+
+        if use_cuda is None:
+            use_cuda = torch.cuda.is_available()
+        if use_cuda:
+            # DistributedDataParallel训练时每个进程只使用torch.cuda.set_device指定的一块GPU
+            if not is_distributed():
+                self.loss_module = torch.nn.DataParallel(self.loss_module)
             self.loss_module.cuda()
 
     def forward(self, outputs, labels):
@@ -67,17 +76,21 @@ class Loss(nn.Module):
                 loss = l['function'](outputs, labels)
                 effective_loss = l['weight'] * loss
                 losses.append(effective_loss)
-                self.log[i] = effective_loss.item()
-                self.log_sum[i] += self.log[i]
 
             # 保留接口
             else:
                 pass
 
         loss_sum = sum(losses)
+        log = [each_loss.detach().float() for each_loss in losses]
         if len(self.loss_struct) > 1:
-            self.log[-1] = loss_sum.item()
-            self.log_sum[-1] += loss_sum.item()
+            log.append(loss_sum.detach().float())
+        self.log = torch.stack(log)
+        self.log_sum = self.log_sum.to(self.log.device)
+        self.log_running = self.log_running.to(self.log.device)
+        self.log_sum += self.log
+        self.log_running += self.log
+        self.log_running_count += 1
 
         return loss_sum
 
@@ -90,12 +103,21 @@ class Loss(nn.Module):
         :return: [损失名称: 损失值][损失名称: 损失值][损失名称: 损失值]；类型为str
         """
         descript = []
-        for l, each_loss in zip(self.loss_struct, self.log):
+        # 自上一次调用以来各次迭代的平均损失，每次迭代都调用时即为该次迭代的损失
+        log = (self.log_running / max(self.log_running_count, 1)).tolist()
+        self.reset_loss_iteration()
+        for l, each_loss in zip(self.loss_struct, log):
             if writer_function:
                 writer_function(l['type'] + type + 'Iteration', each_loss, global_step)
             descript.append('[{}: {:.4f}]'.format(l['type'], each_loss))
         return ''.join(descript)
 
+    def reset_loss_iteration(self):
+        """ 清空record_loss_iteration所使用的累积损失，例如在每个epoch开始训练之前丢弃验证时累积的损失
+        """
+        self.log_running = torch.zeros_like(self.log_running)
+        self.log_running_count = 0
+
     def record_loss_epoch(self, num_iterations, writer_function=None, global_step=None, type=''):
         """ 用于记录每一个epoch的结果
 
@@ -106,7 +128,7 @@ class Loss(nn.Module):
         :return: [Average 损失名称: 平均损失值][Average 损失名称: 平均损失值][Average 损失名称: 平均损失值]；类型为str
         """
         descript = []
-        for l, each_loss in zip(self.loss_struct, self.log_sum):
+        for l, each_loss in zip(self.loss_struct, self.log_sum.tolist()):
             if writer_function:
                 writer_function(l['type'] + type + 'Epoch', each_loss/num_iterations, global_step)
             descript.append('[Average {}: {:.4f}]'.format(l['type'], each_loss/num_iterations))
@@ -3,6 +3,7 @@ import torch.optim as optim
 from torch.optim import lr_scheduler
 from models.custom_model import CustomModel
 from models.custom_attention_model import CustomLocalAttentionModel
+from utils.checkpoint_store import load_checkpoint_file
 
 
 def convert_layers(model, layer_type_old, layer_type_new, convert_weights=False, num_groups=None):
@@ -66,32 +67,33 @@ class PrepareModel:
 
         Args:
             model_type: 模型类型
-            model: 待优化的模型
+            model: 待优化的模型，可以被DataParallel/DistributedDataParallel包装，--device cpu时没有包装
             config: 配置
         Return:
             optimizer: 优化器
         """
-        ignored_params = list(map(id, model.module.classifier.parameters()))
-        base_params = filter(lambda p: id(p) not in ignored_params and p.requires_grad, model.module.parameters())
+        module = getattr(model, 'module', model)
+        ignored_params = list(map(id, module.classifier.parameters()))
+        base_params = filter(lambda p: id(p) not in ignored_params and p.requires_grad, module.parameters())
         print('Creating optimizer: %s' % config.optimizer)
         if config.optimizer == 'Adam':
             optimizer = optim.Adam(
                 [
                     {'params': base_params, 'lr': 0.1 * config.lr},
-                    {'params': model.module.classifier.parameters(), 'lr': config.lr}
+                    {'params': module.classifier.parameters(), 'lr': config.lr}
                 ], weight_decay=config.weight_decay)
         elif config.optimizer == 'SGD':
             optimizer = optim.SGD(
                 [
                     {'params': base_params, 'lr': 0.1 * config.lr},
-                    {'params': model.module.classifier.parameters(), 'lr': config.lr}
+                    {'params': module.classifier.parameters(), 'lr': config.lr}
                 ], weight_decay=config.weight_decay, momentum=0.9)
         elif config.optimizer == 'RangerLars':
             from torchtools.optim import RangerLars
             optimizer = RangerLars(
                 [
                     {'params': base_params, 'lr': 0.1 * config.lr},
-                    {'params': model.module.classifier.parameters(), 'lr': config.lr}
+                    {'params': module.classifier.parameters(), 'lr': config.lr}
                 ], weight_decay=config.weight_decay)
 
         return optimizer
@@ -138,6 +140,6 @@ class PrepareModel:
 
     def load_chekpoint(self, model, weight_path):
         print('Loading weight from %s.' % weight_path)
-        weight = torch.load(weight_path)
+        weight = load_checkpoint_file(weight_path)
         model.load_state_dict(weight['state_dict'])
         return model
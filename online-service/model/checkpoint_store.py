@@ -0,0 +1,292 @@
+'''
+该文件的功能：按内容寻址、对tensor去重的权重存储
+
+每个权重不再是一个完整的.pth文件，而是一个很小的manifest（json）加上若干tensor blob：
+    blobs/<hash前两位>/<hash>.pt: 单个tensor，以其数据类型、形状与内容的sha1命名，相同的tensor（冻结的层、BN的计数等）在各个epoch、
+        各个快照之间只保存一次；
+    <name>.json: {"version": 1, "blob_root": blobs目录相对于manifest的路径,
+                  "tensors": {参数名: {"blob": hash, "dtype": 原始数据类型}}, "meta": {"epoch": ..., "max_score": ...}}
+归档的快照可以以float16/bfloat16保存浮点tensor，加载时转换回原始数据类型。
+每个epoch覆盖manifest之后，旧的manifest引用的tensor不再被使用：sweep读取所有引用该blob目录的manifest（标记），
+删除没有被任何manifest引用的blob（清除）。save时将manifest所在的目录登记在blob目录下的manifest_dirs.txt中，
+标记时只列出这些目录，并且只重新解析大小或修改时间发生变化的manifest，耗时不随train_url下历史训练的数量增长；
+没有该索引的旧blob目录在第一次使用时遍历一次其所在目录建立索引。多个进程（train_folds.py的各折）可能共享同一个blob目录，
+一个进程写入blob之后、发布manifest之前，该blob还没有被引用，因此只删除最近grace_seconds秒内没有被写入或复用的blob。
+load_checkpoint_file对.pth与manifest都适用。该文件为 utils/checkpoint_store.py 的拷贝，修改时需要同步
+'''
+import os
+import json
+import time
+import hashlib
+import collections
+import torch
+
+STORE_VERSION = 1
+ARCHIVE_DTYPES = {'none': None, 'fp16': torch.float16, 'bf16': getattr(torch, 'bfloat16', None)}
+# 最近该秒数内写入或复用的blob可能属于尚未发布的manifest，sweep时保留
+SWEEP_GRACE_SECONDS = 600
+# blob目录下记录manifest所在目录的索引文件，每行一个相对于blob目录的路径
+MANIFEST_INDEX_NAME = 'manifest_dirs.txt'
+
+
+class CheckpointStore(object):
+    def __init__(self, blob_root):
+        """
+        Args:
+            blob_root: str, 存放tensor blob的目录，同一个目录下的所有manifest共享其中的blob
+        """
+        self.blob_root = blob_root
+        # manifest的路径 -> ((inode, 文件大小, 修改时间), 引用的blob)，sweep时只重新解析发生变化的manifest
+        self._manifest_cache = {}
+
+    def save(self, state, manifest_path, dtype=None):
+        """ 保存一个权重：state_dict中的tensor写入blob（已经存在则跳过），其余的值写入manifest
+
+        Args:
+            state: dict, {'state_dict': 模型参数, 'epoch': ..., 'max_score': ...}，除state_dict外的值需要能够转换为json
+            manifest_path: str, manifest的保存路径（可以为临时文件，blob的相对路径按照其所在目录计算）
+            dtype: torch.dtype, 不为None时浮点tensor以该数据类型保存，用于归档的快照
+        Returns:
+            written_bytes: int, 本次新写入的blob的字节数
+        """
+        # 先登记manifest所在的目录再写入blob
+        self.register(os.path.dirname(os.path.abspath(manifest_path)))
+        tensors, written_bytes = collections.OrderedDict(), 0
+        for key, tensor in state['state_dict'].items():
+            stored = tensor.detach().cpu()
+            if dtype is not None and stored.is_floating_point():
+                stored = stored.to(dtype)
+            blob, size = self._put(stored)
+            written_bytes += size
+            tensors[key] = {'blob': blob, 'dtype': str(tensor.dtype).replace('torch.', '')}
+
+        manifest = {
+            'version': STORE_VERSION,
+            'blob_root': os.path.relpath(self.blob_root, os.path.dirname(os.path.abspath(manifest_path))),
+            'tensors': tensors,
+            'meta': {key: value for key, value in state.items() if key != 'state_dict'}
+        }
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            # meta中可能有numpy的标量（例如max_score）
+            json.dump(manifest, f, default=lambda value: value.item() if hasattr(value, 'item') else str(value))
+        return written_bytes
+
+    def _put(self, tensor):
+        tensor = tensor.contiguous()
+        digest = hashlib.sha1(('%s%s' % (tensor.dtype, list(tensor.shape))).encode('utf-8'))
+        # numpy不支持bfloat16，以相同字节数的int16读取其内容
+        raw = tensor.view(torch.int16) if tensor.dtype == ARCHIVE_DTYPES['bf16'] else tensor
+        digest.update(memoryview(raw.numpy()).cast('B'))
+        blob = digest.hexdigest()
+        blob_path = os.path.join(self.blob_root, blob[:2], blob + '.pt')
+        if os.path.exists(blob_path):
+            # 更新修改时间，sweep不会删除即将被新manifest引用的blob
+            try:
+                os.utime(blob_path)
+                return blob, 0
+            except FileNotFoundError:
+                # 恰好被另一个进程的sweep删除，重新写入
+                pass
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        # clone使得只序列化该tensor本身的数据，而不是其所在的整个storage；先写入临时文件再替换，被中断时不会留下不完整的blob
+        tmp_path = blob_path + '.%d.tmp' % os.getpid()
+        torch.save(tensor.clone(), tmp_path)
+        os.replace(tmp_path, blob_path)
+        return blob, os.path.getsize(blob_path)
+
+    def get_manifest_dirs(self):
+        """ 索引中登记的manifest所在的目录，没有索引时遍历一次blob目录所在的目录建立索引
+
+        Returns:
+            manifest_dirs: set, 绝对路径
+        """
+        index_path = os.path.join(self.blob_root, MANIFEST_INDEX_NAME)
+        if not os.path.exists(index_path):
+            self._build_index(index_path)
+        blob_root = os.path.abspath(self.blob_root)
+        with open(index_path, 'r', encoding='utf-8') as f:
+            return set(os.path.normpath(os.path.join(blob_root, line.strip())) for line in f if line.strip())
+
+    def register(self, manifest_dir):
+        """ 将manifest所在的目录登记到索引中，已经登记时跳过
+
+        Args:
+            manifest_dir: str, manifest所在的目录
+        """
+        manifest_dir = os.path.abspath(manifest_dir)
+        if manifest_dir in self.get_manifest_dirs():
+            return
+        # 以追加方式写入一行，多个进程同时登记时不会互相覆盖
+        with open(os.path.join(self.blob_root, MANIFEST_INDEX_NAME), 'a', encoding='utf-8') as f:
+            f.write(os.path.relpath(manifest_dir, os.path.abspath(self.blob_root)) + '\n')
+
+    def _build_index(self, index_path):
+        # 旧版本的blob目录没有索引：遍历一次其所在的目录，登记所有引用该blob目录的manifest所在的目录
+        blob_root = os.path.abspath(self.blob_root)
+        manifest_dirs = set()
+        for root, dirs, names in os.walk(os.path.dirname(blob_root)):
+            # 不遍历blob目录本身
+            dirs[:] = [name for name in dirs if os.path.abspath(os.path.join(root, name)) != blob_root]
+            if any(self._read_manifest_blobs(os.path.join(root, name)) for name in names if is_manifest_name(name)):
+                manifest_dirs.add(os.path.relpath(root, blob_root))
+        os.makedirs(blob_root, exist_ok=True)
+        tmp_path = index_path + '.%d.tmp' % os.getpid()
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.writelines(manifest_dir + '\n' for manifest_dir in sorted(manifest_dirs))
+        os.replace(tmp_path, index_path)
+
+    def _read_manifest_blobs(self, path):
+        # 解析manifest得到其引用的blob，不是引用该blob目录的manifest时为空集合；文件未变化时使用缓存
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return set()
+        # manifest总是先写入临时文件再替换，被覆盖后inode也会变化
+        key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        cached = self._manifest_cache.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        manifest = read_manifest(path)
+        blobs = set()
+        if manifest is not None and os.path.abspath(os.path.join(os.path.dirname(path), manifest['blob_root'])) == \
+                os.path.abspath(self.blob_root):
+            blobs = set(entry['blob'] for entry in manifest['tensors'].values())
+        self._manifest_cache[path] = (key, blobs)
+        return blobs
+
+    def get_live_blobs(self):
+        """ 标记：索引中的目录下所有引用该blob目录的manifest（包括正在写入的临时manifest）所引用的blob
+
+        Returns:
+            live_blobs: set, blob的hash
+        """
+        live_blobs, manifest_paths = set(), set()
+        for manifest_dir in self.get_manifest_dirs():
+            try:
+                names = os.listdir(manifest_dir)
+            except FileNotFoundError:
+                # 已经被删除的训练目录
+                continue
+            for name in names:
+                if is_manifest_name(name):
+                    path = os.path.join(manifest_dir, name)
+                    manifest_paths.add(path)
+                    live_blobs.update(self._read_manifest_blobs(path))
+        # 丢弃已经不存在的manifest的缓存
+        for path in set(self._manifest_cache) - manifest_paths:
+            del self._manifest_cache[path]
+        return live_blobs
+
+    def sweep(self, grace_seconds=SWEEP_GRACE_SECONDS):
+        """ 清除：删除没有被任何manifest引用的blob，以及写入时被中断而残留的临时文件
+
+        Args:
+            grace_seconds: float, 最近该秒数内写入或复用的blob不删除
+        Returns:
+            freed_bytes: int, 释放的字节数
+        """
+        live_blobs = self.get_live_blobs()
+        deadline = time.time() - grace_seconds
+        freed_bytes = 0
+        for root, _, names in os.walk(self.blob_root):
+            for name in names:
+                if (name.endswith('.pt') and name[:-len('.pt')] in live_blobs) or name == MANIFEST_INDEX_NAME:
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    size, mtime = os.path.getsize(path), os.path.getmtime(path)
+                    if mtime > deadline:
+                        continue
+                    os.remove(path)
+                    freed_bytes += size
+                except FileNotFoundError:
+                    # 另一个共享该blob目录的进程同时在清除
+                    continue
+        return freed_bytes
+
+    def get_size(self):
+        """ blob目录占用的字节数
+        """
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(self.blob_root) for name in names)
+
+
+def is_manifest_name(name):
+    """ 可能为manifest的文件名，包括正在写入的临时manifest
+    """
+    return name.endswith('.json') or name.endswith('.json.tmp')
+
+
+def read_manifest(path):
+    """ 读取manifest，不是manifest（param.json等）或者尚未写完时返回None
+
+    Args:
+        path: str, json文件的路径
+    Returns:
+        manifest: dict或None
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or 'blob_root' not in manifest or 'tensors' not in manifest:
+        return None
+    return manifest
+
+
+def get_manifest_blobs(manifest_path):
+    """ manifest引用的所有blob文件相对于blob目录的路径，用于只上传该manifest需要的blob
+
+    Args:
+        manifest_path: str, manifest的路径
+    Returns:
+        blob_paths: list, 例如['ab/abcdef....pt', ...]
+    """
+    manifest = read_manifest(manifest_path)
+    if manifest is None:
+        return []
+    blobs = sorted(set(entry['blob'] for entry in manifest['tensors'].values()))
+    return [blob[:2] + '/' + blob + '.pt' for blob in blobs]
+
+
+def load_manifest_checkpoint(manifest_path, map_location='cpu'):
+    """ 加载CheckpointStore保存的权重
+
+    Args:
+        manifest_path: str, manifest的路径
+        map_location: 与torch.load的map_location相同
+    Returns:
+        state: dict, 与torch.load(.pth)的结果相同，{'state_dict': OrderedDict, 'epoch': ..., 'max_score': ...}
+    """
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    blob_root = os.path.join(os.path.dirname(os.path.abspath(manifest_path)), manifest['blob_root'])
+    state_dict = collections.OrderedDict()
+    for key, entry in manifest['tensors'].items():
+        tensor = torch.load(os.path.join(blob_root, entry['blob'][:2], entry['blob'] + '.pt'), map_location=map_location)
+        state_dict[key] = tensor.to(getattr(torch, entry['dtype']))
+    state = dict(manifest['meta'])
+    state['state_dict'] = state_dict
+    return state
+
+
+def load_checkpoint_file(load_path, map_location=None):
+    """ 加载权重，兼容.pth文件与manifest；.pth文件不存在而同名的manifest存在时加载manifest
+
+    Args:
+        load_path: str, 权重的路径，例如model_best.pth或model_best.json
+        map_location: 与torch.load的map_location相同
+    Returns:
+        state: dict, {'state_dict': ..., ...}
+    """
+    manifest_path = os.path.splitext(load_path)[0] + '.json'
+    if load_path.endswith('.json') or (not os.path.exists(load_path) and os.path.exists(manifest_path)):
+        return load_manifest_checkpoint(manifest_path, map_location or 'cpu')
+    return torch.load(load_path, map_location=map_location)
+
+
+def checkpoint_exists(load_path):
+    """ 判断.pth文件或者同名的manifest是否存在
+    """
+    return os.path.isfile(load_path) or os.path.isfile(os.path.splitext(load_path)[0] + '.json')
@@ -1,5 +1,4 @@
 # -*- coding: utf-8 -*-
-from PIL import Image
 import torch
 import torch.nn.functional as F
 import torchvision.transforms as transforms
@@ -10,6 +9,8 @@ import log
 logger = log.getLogger(__name__)
 
 from model.deploy_models.build_model import PrepareModel
+from model.image_decode import decode_image
+from model.checkpoint_store import load_checkpoint_file
 
 
 class ImageClassificationService(PTServingBaseService):
@@ -89,8 +90,9 @@ class ImageClassificationService(PTServingBaseService):
             std=[0.229, 0.224, 0.225]
         )
 
+        self.image_size = [320, 320]
         self.transforms = transforms.Compose([
-            transforms.Resize([320, 320]),
+            transforms.Resize(self.image_size),
             transforms.ToTensor(),
             self.normalize
         ])
@@ -172,12 +174,13 @@ class ImageClassificationService(PTServingBaseService):
         if torch.cuda.is_available():
             logger.info('Using GPU for inference')
             self.use_cuda = True
-            checkpoint = torch.load(self.model_path)
+            # 兼容.pth文件与checkpoint_store保存的manifest（blobs目录与manifest位于同一个目录下）
+            checkpoint = load_checkpoint_file(self.model_path)
             model.load_state_dict(checkpoint['state_dict'])
             model = torch.nn.DataParallel(model).cuda()
         else:
             logger.info('Using CPU for inference')
-            checkpoint = torch.load(self.model_path, map_location='cpu')
+            checkpoint = load_checkpoint_file(self.model_path, map_location='cpu')
             model.load_state_dict(checkpoint['state_dict'])
 
         return model
@@ -188,7 +191,7 @@ class ImageClassificationService(PTServingBaseService):
         preprocessed_data = {}
         for k, v in data.items():
             for _, file_content in v.items():
-                img = Image.open(file_content)
+                img = decode_image(file_content, self.image_size)
                 img = self.transforms(img)
                 preprocessed_data[k] = img
         return preprocessed_data
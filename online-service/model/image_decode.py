@@ -0,0 +1,26 @@
+'''
+该文件的功能：统一的图片解码函数，为 datasets/image_decode.py 的拷贝，修改时需要同步
+
+对于JPEG图片，利用DCT缩放（PIL的draft模式）直接解码为1/2、1/4或1/8大小，得到仍不小于目标尺寸的最小图片；
+对于其它格式的图片，退化为完整解码
+'''
+import io
+from PIL import Image
+
+
+def decode_image(source, target_size=None):
+    """ 解码一张图片并转换为RGB格式
+
+    Args:
+        source: str/bytes/file-like, 图片路径、图片的原始字节或者文件对象
+        target_size: [height, width], 之后要缩放到的目标大小；为None时完整解码
+    Returns:
+        image: PIL.Image, RGB格式的图片，JPEG图片的宽高均不小于target_size
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    image = Image.open(source)
+    if target_size is not None and image.format == 'JPEG':
+        # draft只修改解码器的缩放系数，需要在图片真正被读取之前调用；draft的尺寸为(width, height)
+        image.draft('RGB', (int(target_size[1]), int(target_size[0])))
+    return image.convert('RGB')
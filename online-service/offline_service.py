@@ -1,5 +1,4 @@
 # -*- coding: utf-8 -*-
-from PIL import Image
 import torch
 import torch.nn.functional as F
 import torchvision.transforms as transforms
@@ -9,6 +8,7 @@ logger = logging.getLogger(__name__)
 logger.info('from model.deploy_models.build_model import PrepareModel')
 
 from model.deploy_models.build_model import PrepareModel
+from model.image_decode import decode_image
 
 
 class ImageClassificationService:
@@ -90,8 +90,9 @@ class ImageClassificationService:
             std=[0.229, 0.224, 0.225]
         )
 
+        self.image_size = [256, 256]
         self.transforms = transforms.Compose([
-            transforms.Resize([256, 256]),
+            transforms.Resize(self.image_size),
             transforms.ToTensor(),
             self.normalize
         ])
@@ -175,7 +176,7 @@ class ImageClassificationService:
         preprocessed_data = {}
         for k, v in data.items():
             for _, file_content in v.items():
-                img = Image.open(file_content)
+                img = decode_image(file_content, self.image_size)
                 img = self.transforms(img)
                 preprocessed_data[k] = img
         return preprocessed_data
@@ -2,41 +2,137 @@
 该文件的功能：实现模型的前向传播，反向传播，损失函数计算，保存模型，加载模型功能
 '''
 import torch
-import shutil
 import os
 import glob
+import inspect
+import contextlib
+import resource
+import functools
+from utils.async_checkpoint import AsyncCheckpointWriter
+from utils.checkpoint_store import CheckpointStore, load_checkpoint_file, checkpoint_exists, read_manifest, \
+    get_manifest_blobs, ARCHIVE_DTYPES
 
 try:
     import moxing as mox
 except:
     print('not use moxing')
 
+# torch>=2.6中torch.load默认weights_only=True，训练状态中的numpy随机数状态等无法加载；旧版本的torch没有该参数
+_TORCH_LOAD_FULL_KWARGS = {'weights_only': False} if 'weights_only' in inspect.signature(torch.load).parameters else {}
+
 
 class Solver:
-    def __init__(self, model, device):
+    def __init__(self, model, device, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225), amp='none',
+                 checkpoint_queue_size=0, checkpoint_store=None, archive_dtype='none', channels_last=False):
         ''' 完成solver类的初始化
         Args:
             model: 网络模型
             device: 设备
+            mean: tuple, 通道均值，用于归一化uint8的输入
+            std: tuple, 通道方差，用于归一化uint8的输入
+            amp: str, 混合精度训练，none: fp32; fp16: float16的autocast与梯度缩放; bf16: bfloat16的autocast（支持CPU）
+            checkpoint_queue_size: int, 后台最多有多少个尚未写完的权重，为0（默认）时同步保存
+            checkpoint_store: str, 不为None时权重以manifest（.json）的形式保存，tensor去重后存放在该blob目录中
+            archive_dtype: str, none/fp16/bf16, 使用checkpoint_store时归档的快照中浮点tensor的数据类型
+            channels_last: bool, 是否将输入转换为channels_last，需要模型同样为channels_last（--device cpu）
         '''
         self.model = model
         self.device = device
+        self.channels_last = channels_last
+        self.amp = amp
+        self.amp_dtype = None
+        if amp != 'none':
+            if device.type == 'cpu' and amp == 'fp16':
+                # CPU上的autocast只支持bfloat16
+                print('fp16 autocast is not supported on CPU, using bf16 instead.')
+                self.amp = amp = 'bf16'
+            if not hasattr(torch, 'autocast') and not (device.type == 'cuda' and hasattr(torch.cuda, 'amp')):
+                raise ValueError('--amp %s is not supported by torch %s.' % (amp, torch.__version__))
+            self.amp_dtype = torch.float16 if amp == 'fp16' else torch.bfloat16
+        # bfloat16与float32的指数范围相同，只有float16需要梯度缩放
+        self.scaler = torch.cuda.amp.GradScaler() if self.amp == 'fp16' else None
+        # 与ToTensor的/255合并后的均值与方差
+        self.mean = torch.tensor(mean, dtype=torch.float32, device=device).view(1, -1, 1, 1) * 255
+        self.std = torch.tensor(std, dtype=torch.float32, device=device).view(1, -1, 1, 1) * 255
+        # 权重在后台线程中保存
+        self.checkpoint_writer = AsyncCheckpointWriter(checkpoint_queue_size)
+        self.checkpoint_store = CheckpointStore(checkpoint_store) if checkpoint_store else None
+        self.archive_dtype = ARCHIVE_DTYPES[archive_dtype]
 
     def forward(self, images):
         ''' 实现网络的前向传播功能
         
         Args:
-            images: [batch_size, channel, height, width]
+            images: [batch_size, channel, height, width]，uint8的输入（--uint8_transport）在传输到设备后对整个batch归一化
             
         Return:
             output: 网络的输出，具体维度和含义与self.model有关，对我们任务而言：
                 若self.model为分割模型，则维度为[batch_size, class_num, height, width]，One-hot数据
                 若self.model为分类模型，则维度为[batch_size, class_num]，One-hot数据
         '''
-        images = images.to(self.device)
-        outputs = self.model(images)
+        images = self.normalize(images.to(self.device, non_blocking=True))
+        if self.channels_last:
+            images = images.contiguous(memory_format=torch.channels_last)
+        model = self.model
+        # 验证时各个进程的batch数可能不同，绕过DistributedDataParallel，避免其在前向传播时同步buffer而互相等待
+        if not model.training and isinstance(model, torch.nn.parallel.DistributedDataParallel):
+            model = model.module
+        with self.autocast():
+            outputs = model(images)
         return outputs
 
+    def no_sync(self, sync=True):
+        ''' DistributedDataParallel训练且累积梯度时，非参数更新的batch不需要在进程间同步梯度
+
+        Args:
+            sync: bool, 本次反向传播之后是否更新参数
+        Return:
+            上下文，sync为False时在其中进行前向与反向传播，梯度只累积在本进程中
+        '''
+        if not sync and isinstance(self.model, torch.nn.parallel.DistributedDataParallel):
+            return self.model.no_sync()
+        return contextlib.suppress()
+
+    def autocast(self):
+        ''' 混合精度训练时，返回对应设备与数据类型的autocast上下文，否则返回空的上下文
+        '''
+        if self.amp_dtype is None:
+            return contextlib.suppress()
+        if hasattr(torch, 'autocast'):
+            return torch.autocast(device_type=self.device.type, dtype=self.amp_dtype)
+        return torch.cuda.amp.autocast()
+
+    def reset_peak_memory(self):
+        ''' 重置峰值显存的统计，CPU上的峰值内存为进程启动以来的峰值，无法重置
+        '''
+        if self.device.type == 'cuda':
+            if hasattr(torch.cuda, 'reset_peak_memory_stats'):
+                torch.cuda.reset_peak_memory_stats(self.device)
+            else:
+                torch.cuda.reset_max_memory_allocated(self.device)
+
+    def get_peak_memory(self):
+        ''' 得到峰值显存（GPU）或者峰值常驻内存（CPU）
+
+        Return:
+            peak_memory: float, 单位为MB
+        '''
+        if self.device.type == 'cuda':
+            return torch.cuda.max_memory_allocated(self.device) / 1024 ** 2
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def normalize(self, images):
+        ''' 将uint8的图片归一化为float，float的输入认为已经归一化，直接返回
+
+        Args:
+            images: [batch_size, channel, height, width] tensor
+        Return:
+            images: [batch_size, channel, height, width] float tensor
+        '''
+        if images.dtype != torch.uint8:
+            return images
+        return images.float().sub_(self.mean).div_(self.std)
+
     def cal_loss(self, predicts, targets, criterion):
         ''' 根据真实类标和预测出的类标计算损失
         
@@ -51,7 +147,8 @@ class Solver:
             loss: 计算出的损失值
         '''
         targets = targets.to(self.device)
-        return criterion(predicts, targets)
+        # 网络输出为低精度时，在autocast之外以float32计算损失；autocast中binary_cross_entropy（CB_Softmax）等不允许使用
+        return criterion(predicts.float(), targets)
 
     def cal_loss_cutmix(self, predicts, targets_a, targets_b, lam, criterion):
         """计算使用cutmix时的损失
@@ -67,35 +164,103 @@ class Solver:
         """
         targets_a = targets_a.to(self.device)
         targets_b = targets_b.to(self.device)
+        # 与cal_loss相同，在autocast之外以float32计算损失
+        predicts = predicts.float()
         return criterion(predicts, targets_a) * lam + criterion(predicts, targets_b) * (1. - lam)
 
-    def backword(self, optimizer, loss):
+    def backword(self, optimizer, loss, accumulation_steps=1, step=True):
         ''' 实现网络的反向传播
         
         Args:
             optimizer: 模型使用的优化器
             loss: 模型计算出的loss值
+            accumulation_steps: int, 梯度累积时本次参数更新所累积的batch数，损失除以该值，使累积的梯度为这些batch的平均梯度
+            step: bool, 是否更新参数并清空梯度；梯度累积时只有每组的最后一个batch为True
         Return:
             None
         '''
-        loss.backward()
-        optimizer.step()
-        optimizer.zero_grad()
+        if accumulation_steps > 1:
+            loss = loss / accumulation_steps
+        if self.scaler is not None:
+            # float16的梯度可能下溢，先放大损失再反向传播，step时还原并跳过出现inf/nan的迭代
+            self.scaler.scale(loss).backward()
+            if step:
+                self.scaler.step(optimizer)
+                self.scaler.update()
+        else:
+            loss.backward()
+            if step:
+                optimizer.step()
+        if step:
+            optimizer.zero_grad()
 
-    def save_checkpoint(self, save_path, state, is_best):
+    def _checkpoint_target(self, save_path, archive=False):
+        ''' 使用checkpoint_store时，将.pth路径替换为manifest的路径，并得到对应的保存函数
+        '''
+        if self.checkpoint_store is None:
+            return save_path, None
+        dtype = self.archive_dtype if archive else None
+        return os.path.splitext(save_path)[0] + '.json', functools.partial(self.checkpoint_store.save, dtype=dtype)
+
+    def _after_save(self, callback=None):
+        ''' 使用checkpoint_store时，manifest被替换之后在后台线程中清除不再被引用的blob，再执行callback
+        '''
+        if self.checkpoint_store is None:
+            return callback
+
+        def sweep_and_callback():
+            self.checkpoint_store.sweep()
+            if callback is not None:
+                callback()
+        return sweep_and_callback
+
+    def _copy_store_to_obs(self, log_dir, manifest_path, remote_dir):
+        ''' 使用checkpoint_store时将最优模型复制到OBS：只上传model_best的manifest引用且远端还没有的blob，
+        删除远端不再被引用的blob，其余manifest（每个epoch覆盖的权重）不上传
+        Args:
+            log_dir: str, 本地的日志目录
+            manifest_path: str, model_best的manifest
+            remote_dir: str, OBS上的目录
+        '''
+        blob_root = os.path.abspath(self.checkpoint_store.blob_root)
+        for name in os.listdir(log_dir):
+            path = os.path.join(log_dir, name)
+            if os.path.abspath(path) == blob_root:
+                continue
+            if os.path.isdir(path):
+                mox.file.copy_parallel(path, os.path.join(remote_dir, name))
+            elif os.path.abspath(path) == os.path.abspath(manifest_path) or read_manifest(path) is None:
+                mox.file.copy(path, os.path.join(remote_dir, name))
+
+        remote_blob_root = os.path.join(remote_dir, os.path.relpath(blob_root, os.path.abspath(log_dir)))
+        blob_paths = get_manifest_blobs(manifest_path)
+        for blob_path in blob_paths:
+            if not mox.file.exists(remote_blob_root + '/' + blob_path):
+                mox.file.copy(os.path.join(blob_root, blob_path), remote_blob_root + '/' + blob_path)
+        if mox.file.exists(remote_blob_root):
+            live_blobs = set(blob_paths)
+            for blob_path in mox.file.list_directory(remote_blob_root, recursive=True):
+                if blob_path.endswith('.pt') and blob_path not in live_blobs:
+                    mox.file.remove(remote_blob_root + '/' + blob_path, recursive=False)
+
+    def save_checkpoint(self, save_path, state, is_best, archive=False):
         ''' 保存模型参数
         Args:
             save_path: 要保存的权重路径
             state: 存有模型参数、最大dice等信息的字典
             is_best: 是否为最优模型
+            archive: bool, 是否为归档的快照，使用checkpoint_store时以archive_dtype保存
         Return:
             None
         '''
-        torch.save(state, save_path)
+        save_path, save_function = self._checkpoint_target(save_path, archive)
+        save_best_path = None
         if is_best:
             print('Saving Best Model.')
-            save_best_path = '/'.join(save_path.split('/')[:-1] + ['model_best.pth'])
-            shutil.copyfile(save_path, save_best_path)
+            save_best_path = '/'.join(save_path.split('/')[:-1] + ['model_best' + os.path.splitext(save_path)[1]])
+        # model_best.pth为save_path的硬链接，不再复制一次
+        self.checkpoint_writer.submit(save_path, state, save_best_path, callback=self._after_save(),
+                                      save_function=save_function)
 
     def save_checkpoint_online(self, save_path, state, is_best, bucket_name, model_snapshots_name):
         ''' 保存模型参数
@@ -108,25 +273,75 @@ class Solver:
         Return:
             None
         '''
-        torch.save(state, save_path)
-        # mox.file可兼容处理本地路径和OBS路径
-        # see https://github.com/huaweicloud/ModelArts-Lab/blob/master/docs/moxing_api_doc/MoXing_API_File.md
-        if not mox.file.exists(os.path.join(bucket_name, model_snapshots_name, 'model')):
-            mox.file.make_dirs(os.path.join(bucket_name, model_snapshots_name, 'model'))
+        def copy_to_obs():
+            # mox.file可兼容处理本地路径和OBS路径
+            # see https://github.com/huaweicloud/ModelArts-Lab/blob/master/docs/moxing_api_doc/MoXing_API_File.md
+            if not mox.file.exists(os.path.join(bucket_name, model_snapshots_name, 'model')):
+                mox.file.make_dirs(os.path.join(bucket_name, model_snapshots_name, 'model'))
 
-        for file in glob.glob('/'.join(save_path.split('/')[:-1]) + '/events*'):
-            mox.file.copy(file, os.path.join(bucket_name, model_snapshots_name, 'model', os.path.basename(file)))
+            for file in glob.glob('/'.join(save_path.split('/')[:-1]) + '/events*'):
+                mox.file.copy(file, os.path.join(bucket_name, model_snapshots_name, 'model', os.path.basename(file)))
 
+            if is_best:
+                log_dir, remote_dir = '/'.join(save_path.split('/')[:-1]), os.path.join(bucket_name, model_snapshots_name, 'model')
+                if self.checkpoint_store is None:
+                    mox.file.copy_parallel(log_dir, remote_dir)
+                else:
+                    self._copy_store_to_obs(log_dir, save_best_path, remote_dir)
+                mox.file.copy_parallel('../online-service/model', os.path.join(bucket_name, model_snapshots_name, 'model'))
+
+        save_path, save_function = self._checkpoint_target(save_path)
+        save_best_path = None
         if is_best:
             print('Saving Best Model.')
-            save_best_path = '/'.join(save_path.split('/')[:-1] + ['model_best.pth'])
-            shutil.copyfile(save_path, save_best_path)
-            # 删除临时权重文件，加快拷贝到OBS的速度
-            os.remove(save_path)
+            save_best_path = '/'.join(save_path.split('/')[:-1] + ['model_best' + os.path.splitext(save_path)[1]])
+        # 最优模型直接重命名为model_best.pth，不保留临时权重文件，加快拷贝到OBS的速度；拷贝到OBS同样在后台完成
+        self.checkpoint_writer.submit(save_path, state, save_best_path, move=True, callback=self._after_save(copy_to_obs),
+                                      save_function=save_function)
+
+    def save_training_state(self, save_path, state, callback=None):
+        ''' 保存完整的训练状态，先写入临时文件再替换，保存过程中被中断时旧的状态仍然可用
+        Args:
+            save_path: str, 训练状态的保存路径
+            state: dict, 包含模型、优化器、学习率衰减策略、epoch、batch、随机数状态等
+            callback: callable, 保存完成后在后台线程中调用，例如复制到OBS
+        Return:
+            None
+        '''
+        # 后台保存时，先等待之前提交的权重写完（写入出错时在此处抛出），训练状态记录的进度对应的权重一定已经在磁盘上
+        self.checkpoint_writer.wait()
+        self.checkpoint_writer.submit(save_path, state, callback=callback)
+
+    def wait_checkpoints(self):
+        ''' 等待后台保存的权重全部写完，训练结束时调用，并打印写入的耗时与blob目录的大小
+        '''
+        self.checkpoint_writer.wait()
+        descript = self.checkpoint_writer.format_stats()
+        if self.checkpoint_store is not None:
+            descript += ', checkpoint store size: %.1fMB' % (self.checkpoint_store.get_size() / 1024 ** 2)
+        print(descript)
 
-            mox.file.copy_parallel('/'.join(save_path.split('/')[:-1]),
-                                   os.path.join(bucket_name, model_snapshots_name, 'model'))
-            mox.file.copy_parallel('../online-service/model', os.path.join(bucket_name, model_snapshots_name, 'model'))
+    def load_training_state(self, load_path, optimizer, lr_scheduler):
+        ''' 加载save_training_state保存的训练状态，恢复模型、优化器与学习率衰减策略
+        Args:
+            load_path: str, 训练状态的路径
+            optimizer: 优化器
+            lr_scheduler: 学习率衰减策略
+        Return:
+            state: dict, 训练状态，供调用者恢复epoch、batch、随机数状态等
+        '''
+        # 训练状态由save_training_state写入，是可信的文件
+        state = torch.load(load_path, map_location='cpu', **_TORCH_LOAD_FULL_KWARGS)
+        if hasattr(self.model, 'module'):
+            self.model.module.load_state_dict(state['state_dict'])
+        else:
+            self.model.load_state_dict(state['state_dict'])
+        optimizer.load_state_dict(state['optimizer'])
+        lr_scheduler.load_state_dict(state['lr_scheduler'])
+        if self.scaler is not None and state.get('grad_scaler'):
+            self.scaler.load_state_dict(state['grad_scaler'])
+        print('Resumed training state from %s: epoch %d, batch %d' % (load_path, state['epoch'], state['batch']))
+        return state
 
     def load_checkpoint(self, load_path):
         ''' 保存模型参数
@@ -136,9 +351,12 @@ class Solver:
         Return:
             加载过权重的模型
         '''
-        if os.path.isfile(load_path):
-            checkpoint = torch.load(load_path)
-            self.model.module.load_state_dict(checkpoint['state_dict'])
+        # 兼容.pth文件与checkpoint_store保存的manifest
+        if checkpoint_exists(load_path):
+            checkpoint = load_checkpoint_file(load_path, map_location=self.device)
+            # --device cpu时模型没有被DataParallel包装
+            model = self.model.module if hasattr(self.model, 'module') else self.model
+            model.load_state_dict(checkpoint['state_dict'])
             print('Successfully Loaded from %s' % (load_path))
             return self.model
         else:
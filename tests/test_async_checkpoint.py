@@ -0,0 +1,44 @@
+import os
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from solver import Solver
+from config import get_classify_config
+
+
+def make_solver(queue_size):
+    return Solver(torch.nn.Linear(2, 2), torch.device('cpu'), checkpoint_queue_size=queue_size)
+
+
+def test_checkpoints_are_synchronous_by_default(tmp_path):
+    assert get_classify_config([]).checkpoint_queue_size == 0
+    solver = make_solver(get_classify_config([]).checkpoint_queue_size)
+    save_path = str(tmp_path / 'model_fold0.pth')
+    solver.save_checkpoint(save_path, {'state_dict': solver.model.state_dict(), 'epoch': 1}, True)
+    # 同步保存，返回时权重与model_best都已经在磁盘上
+    assert os.path.isfile(save_path) and os.path.isfile(str(tmp_path / 'model_best.pth'))
+
+
+def test_training_state_waits_for_pending_checkpoints(tmp_path):
+    solver = make_solver(2)
+    save_path = str(tmp_path / 'model_fold0.pth')
+    solver.save_checkpoint(save_path, {'state_dict': solver.model.state_dict(), 'epoch': 1}, False)
+    state_path = str(tmp_path / 'training_state.pth')
+    solver.save_training_state(state_path, {'epoch': 1})
+    # 训练状态提交之前，之前的权重已经写完
+    assert os.path.isfile(save_path)
+    solver.wait_checkpoints()
+    assert os.path.isfile(state_path)
+
+
+def test_background_errors_surface_before_the_training_state(tmp_path):
+    solver = make_solver(2)
+
+    def fail():
+        raise IOError('disk full')
+    solver.checkpoint_writer.submit(str(tmp_path / 'model_fold0.pth'), {'epoch': 1}, callback=fail)
+    state_path = str(tmp_path / 'training_state.pth')
+    with pytest.raises(RuntimeError):
+        solver.save_training_state(state_path, {'epoch': 1})
+    assert not os.path.exists(state_path)
@@ -0,0 +1,135 @@
+import os
+import collections
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from utils import checkpoint_store
+from utils.checkpoint_store import CheckpointStore, load_checkpoint_file, checkpoint_exists, get_manifest_blobs, \
+    MANIFEST_INDEX_NAME
+
+
+def make_state(scale=1.0):
+    state_dict = collections.OrderedDict([
+        ('conv.weight', torch.arange(24, dtype=torch.float32).view(2, 3, 2, 2) * scale),
+        ('bn.num_batches_tracked', torch.tensor(7)),
+        ('fc.weight', torch.ones(4, 3)),
+    ])
+    return {'state_dict': state_dict, 'epoch': 3, 'max_score': 0.5}
+
+
+def blob_files(blob_root):
+    return sorted(name for _, _, names in os.walk(blob_root) for name in names if name.endswith('.pt'))
+
+
+def test_save_load_round_trip(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'blobs'))
+    manifest_path = str(tmp_path / 'run' / 'model_fold0.json')
+    os.makedirs(os.path.dirname(manifest_path))
+    state = make_state()
+    store.save(state, manifest_path)
+
+    # 通过.pth路径加载时自动使用同名的manifest
+    assert checkpoint_exists(str(tmp_path / 'run' / 'model_fold0.pth'))
+    loaded = load_checkpoint_file(str(tmp_path / 'run' / 'model_fold0.pth'))
+    assert loaded['epoch'] == 3 and loaded['max_score'] == 0.5
+    assert list(loaded['state_dict'].keys()) == list(state['state_dict'].keys())
+    for key, tensor in state['state_dict'].items():
+        assert loaded['state_dict'][key].dtype == tensor.dtype
+        assert torch.equal(loaded['state_dict'][key], tensor)
+
+
+def test_identical_tensors_are_stored_once(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'blobs'))
+    first = store.save(make_state(), str(tmp_path / 'a.json'))
+    assert first > 0
+    # 只有conv.weight变化，其余tensor复用已有的blob
+    second = store.save(make_state(scale=2.0), str(tmp_path / 'b.json'))
+    assert 0 < second < first
+    assert store.save(make_state(), str(tmp_path / 'c.json')) == 0
+    assert len(blob_files(str(tmp_path / 'blobs'))) == 4
+
+
+def test_archive_dtype_is_restored_on_load(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'blobs'))
+    store.save(make_state(), str(tmp_path / 'archive.json'), dtype=torch.float16)
+    loaded = load_checkpoint_file(str(tmp_path / 'archive.json'))
+    assert loaded['state_dict']['conv.weight'].dtype == torch.float32
+    assert torch.equal(loaded['state_dict']['conv.weight'], make_state()['state_dict']['conv.weight'])
+    assert loaded['state_dict']['bn.num_batches_tracked'].dtype == torch.int64
+
+
+def test_sweep_removes_blobs_of_replaced_manifests(tmp_path):
+    blob_root = str(tmp_path / 'blobs')
+    store = CheckpointStore(blob_root)
+    manifest_path = str(tmp_path / 'run' / 'model_fold0.json')
+    os.makedirs(os.path.dirname(manifest_path))
+    store.save(make_state(), manifest_path)
+    # 覆盖同一个manifest，scale=1的conv.weight不再被引用
+    store.save(make_state(scale=2.0), manifest_path)
+    assert len(blob_files(blob_root)) == 4
+
+    # 未过保护期的blob不删除
+    assert store.sweep() == 0
+    assert store.sweep(grace_seconds=0) > 0
+    assert blob_files(blob_root) == sorted(os.path.basename(path) for path in get_manifest_blobs(manifest_path))
+    assert torch.equal(load_checkpoint_file(manifest_path)['state_dict']['conv.weight'],
+                       make_state(scale=2.0)['state_dict']['conv.weight'])
+
+
+def test_sweep_keeps_blobs_referenced_by_other_runs(tmp_path):
+    blob_root = str(tmp_path / 'blobs')
+    store = CheckpointStore(blob_root)
+    for run in ('run0', 'run1'):
+        os.makedirs(str(tmp_path / run))
+    store.save(make_state(), str(tmp_path / 'run0' / 'model_best.json'))
+    store.save(make_state(scale=3.0), str(tmp_path / 'run1' / 'model_best.json'))
+    # 其它json文件（param.json等）不是manifest
+    with open(str(tmp_path / 'run0' / 'param.json'), 'w') as f:
+        f.write('{"lr": 0.001}')
+    assert store.sweep(grace_seconds=0) == 0
+    for run, scale in (('run0', 1.0), ('run1', 3.0)):
+        loaded = load_checkpoint_file(str(tmp_path / run / 'model_best.json'))
+        assert torch.equal(loaded['state_dict']['conv.weight'], make_state(scale)['state_dict']['conv.weight'])
+
+
+def test_sweep_only_parses_registered_and_changed_manifests(tmp_path, monkeypatch):
+    blob_root = str(tmp_path / 'blobs')
+    store = CheckpointStore(blob_root)
+    os.makedirs(str(tmp_path / 'tiny' / 'log-new'))
+    # 历史训练留下的大量json（tensorboard等之外的其它文件）不属于该blob目录
+    old_run = tmp_path / 'tiny' / 'log-old'
+    os.makedirs(str(old_run))
+    for index in range(5):
+        with open(str(old_run / ('param%d.json' % index)), 'w') as f:
+            f.write('{"lr": 0.001}')
+    manifest_path = str(tmp_path / 'tiny' / 'log-new' / 'model_fold0.json')
+    store.save(make_state(), manifest_path)
+    with open(os.path.join(blob_root, MANIFEST_INDEX_NAME), 'r', encoding='utf-8') as f:
+        assert [line.strip() for line in f] == [os.path.join('..', 'tiny', 'log-new')]
+
+    parsed = []
+    read_manifest = checkpoint_store.read_manifest
+    monkeypatch.setattr(checkpoint_store, 'read_manifest', lambda path: parsed.append(path) or read_manifest(path))
+    store.sweep(grace_seconds=0)
+    assert parsed == [manifest_path]
+    # manifest未变化时不再解析
+    store.sweep(grace_seconds=0)
+    assert parsed == [manifest_path]
+    store.save(make_state(scale=2.0), manifest_path)
+    store.sweep(grace_seconds=0)
+    assert parsed == [manifest_path] * 2
+    assert blob_files(blob_root) == sorted(os.path.basename(path) for path in get_manifest_blobs(manifest_path))
+
+
+def test_index_is_built_for_stores_without_one(tmp_path):
+    blob_root = str(tmp_path / 'blobs')
+    os.makedirs(str(tmp_path / 'run0'))
+    manifest_path = str(tmp_path / 'run0' / 'model_best.json')
+    CheckpointStore(blob_root).save(make_state(), manifest_path)
+    # 模拟没有索引的旧blob目录，清除时不能删除旧训练引用的blob
+    os.remove(os.path.join(blob_root, MANIFEST_INDEX_NAME))
+    store = CheckpointStore(blob_root)
+    assert store.sweep(grace_seconds=0) == 0
+    assert store.get_manifest_dirs() == {str(tmp_path / 'run0')}
+    assert len(blob_files(blob_root)) == 3
@@ -0,0 +1,57 @@
+import collections
+import argparse
+import pytest
+
+pytest.importorskip('torch')
+np = pytest.importorskip('numpy')
+
+from datasets.class_aware_sampler import ClassAwareBatchSampler, get_sampler_params
+
+# 类别2只有2个样本，少于K
+LABELS = np.array([0] * 20 + [1] * 12 + [2] * 2 + [3] * 9 + [4] * 7)
+
+
+def test_every_batch_holds_p_classes_with_k_samples():
+    np.random.seed(0)
+    sampler = ClassAwareBatchSampler(LABELS, classes_per_batch=3, samples_per_class=4, num_batches=50)
+    batches = list(sampler)
+    assert len(batches) == len(sampler) == 50
+    for batch in batches:
+        counts = collections.Counter(LABELS[batch].tolist())
+        # P个互不相同的类别，每个类别K个样本
+        assert len(batch) == sampler.batch_size == 12
+        assert len(counts) == 3 and set(counts.values()) == {4}
+        # 同一个类别的K个样本相邻
+        assert [LABELS[batch[start]] for start in range(0, 12, 4)] == list(counts.keys())
+
+
+def test_samples_are_drawn_without_replacement_when_possible():
+    np.random.seed(0)
+    batches = list(ClassAwareBatchSampler(LABELS, classes_per_batch=5, samples_per_class=4, num_batches=3))
+    for class_id, size in ((0, 20), (1, 12)):
+        sampled = np.concatenate([np.asarray(batch)[LABELS[batch] == class_id] for batch in batches])
+        # 3个batch共12个样本，不超过该类别的样本数时不重复
+        assert len(sampled) == 12 and len(set(sampled.tolist())) == min(12, size)
+    # 样本数不足K的类别有放回地采样
+    sampled = np.concatenate([np.asarray(batch)[LABELS[batch] == 2] for batch in batches])
+    assert set(sampled.tolist()) <= {32, 33}
+
+
+def test_defaults_and_clamping():
+    sampler = ClassAwareBatchSampler(LABELS, classes_per_batch=10, samples_per_class=2)
+    # P大于类别总数时取类别总数，默认每个epoch的样本数与数据集大小大致相同
+    assert sampler.classes_per_batch == 5
+    assert len(sampler) == len(LABELS) // 10
+
+
+def test_same_seed_gives_same_batches():
+    sampler = ClassAwareBatchSampler(LABELS, classes_per_batch=2, samples_per_class=3, num_batches=20)
+    np.random.seed(7)
+    first = list(sampler)
+    np.random.seed(7)
+    assert list(sampler) == first
+
+
+def test_get_sampler_params():
+    config = argparse.Namespace(classes_per_batch=8, samples_per_class=4, sampler_batches=0)
+    assert get_sampler_params(config) == {'classes_per_batch': 8, 'samples_per_class': 4, 'num_batches': None}
@@ -0,0 +1,72 @@
+import collections
+import pytest
+
+torch = pytest.importorskip('torch')
+np = pytest.importorskip('numpy')
+
+from datasets.class_aware_sampler import ClassAwareBatchSampler
+from datasets.distributed_sampler import ShardedBatchSampler, SplitBatchSampler
+from utils import distributed
+
+LABELS = np.repeat(np.arange(10), 6)
+
+
+def seeded_batches(batch_sampler, seed=0):
+    # 各个进程的随机种子相同，生成相同的全局batch序列
+    np.random.seed(seed)
+    return list(batch_sampler)
+
+
+def test_class_aware_batches_are_split_by_class():
+    world_size = 2
+    global_batches = seeded_batches(ClassAwareBatchSampler(LABELS, 4, 3, num_batches=5, num_replicas=world_size))
+    rank_batches = [
+        seeded_batches(SplitBatchSampler(ClassAwareBatchSampler(LABELS, 4, 3, num_batches=5, num_replicas=world_size),
+                                         rank, world_size))
+        for rank in range(world_size)
+    ]
+    for index, global_batch in enumerate(global_batches):
+        # 全局batch仍为P×K，每个进程分到P / world_size个完整的类别
+        assert rank_batches[0][index] + rank_batches[1][index] == global_batch
+        for rank in range(world_size):
+            labels = LABELS[rank_batches[rank][index]]
+            assert sorted(collections.Counter(labels.tolist()).values()) == [3, 3]
+        assert len(set(LABELS[rank_batches[0][index]]) & set(LABELS[rank_batches[1][index]])) == 0
+
+
+def test_classes_per_batch_is_rounded_to_world_size():
+    assert ClassAwareBatchSampler(LABELS, 5, 2, num_replicas=2).classes_per_batch == 4
+    with pytest.raises(ValueError):
+        ClassAwareBatchSampler(LABELS, 3, 2, num_replicas=4)
+
+
+def test_sharded_batch_sampler_gives_equal_batches_per_rank():
+    batches = [[index] for index in range(7)]
+    shards = [list(ShardedBatchSampler(batches, rank, 3)) for rank in range(3)]
+    assert shards == [[[0], [3]], [[1], [4]], [[2], [5]]]
+    assert all(len(ShardedBatchSampler(batches, rank, 3)) == 2 for rank in range(3))
+
+
+@pytest.mark.parametrize('backend', ['gloo', 'nccl', ''])
+def test_init_distributed_sets_device_for_any_backend(monkeypatch, backend):
+    calls = {}
+    monkeypatch.setenv('WORLD_SIZE', '2')
+    monkeypatch.setenv('LOCAL_RANK', '1')
+    monkeypatch.setattr(distributed, 'is_distributed', lambda: False)
+    monkeypatch.setattr(torch.cuda, 'set_device', lambda device: calls.setdefault('device', device))
+    monkeypatch.setattr(distributed.dist, 'init_process_group',
+                        lambda backend, init_method: calls.setdefault('backend', backend))
+    distributed.init_distributed(backend, use_cuda=True)
+    assert calls == {'device': 1, 'backend': backend or 'nccl'}
+
+
+def test_init_distributed_on_cpu_uses_gloo(monkeypatch):
+    calls = {}
+    monkeypatch.setenv('WORLD_SIZE', '2')
+    monkeypatch.setenv('LOCAL_RANK', '0')
+    monkeypatch.setattr(distributed, 'is_distributed', lambda: False)
+    monkeypatch.setattr(torch.cuda, 'set_device', lambda device: calls.setdefault('device', device))
+    monkeypatch.setattr(distributed.dist, 'init_process_group',
+                        lambda backend, init_method: calls.setdefault('backend', backend))
+    distributed.init_distributed('', use_cuda=False)
+    assert calls == {'backend': 'gloo'}
@@ -0,0 +1,91 @@
+import os
+import socket
+import pytest
+
+torch = pytest.importorskip('torch')
+nn = torch.nn
+dist = torch.distributed
+if not dist.is_available():
+    pytest.skip('torch.distributed is not available', allow_module_level=True)
+
+import torch.multiprocessing as mp
+from solver import Solver
+from losses.get_loss import Loss
+from utils.distributed import init_distributed, all_reduce_sum, get_world_size
+
+NUM_CLASSES = 4
+WORLD_SIZE = 2
+STEPS = 3
+
+
+def make_model():
+    # 各个进程以相同的种子初始化，DistributedDataParallel同样会从rank 0广播参数
+    torch.manual_seed(0)
+    return nn.Sequential(nn.Conv2d(3, 8, 3, padding=1), nn.ReLU(), nn.AdaptiveAvgPool2d(1), nn.Flatten(),
+                         nn.Linear(8, NUM_CLASSES))
+
+
+def make_data():
+    generator = torch.Generator().manual_seed(1)
+    images = torch.randint(0, 256, (8, 3, 16, 16), dtype=torch.uint8, generator=generator)
+    labels = torch.arange(8) % NUM_CLASSES
+    return images, labels
+
+
+def train_steps(model, solver, images, labels):
+    criterion = Loss('tiny', '1.0*SmoothCrossEntropy', NUM_CLASSES, [1] * NUM_CLASSES, 0.9999, 2, use_cuda=False)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.5)
+    for _ in range(STEPS):
+        predicts = solver.forward(images)
+        loss = solver.cal_loss(predicts, labels, criterion)
+        solver.backword(optimizer, loss)
+    return predicts, loss
+
+
+def train_worker(rank, port, result_dir):
+    os.environ.update({'MASTER_ADDR': '127.0.0.1', 'MASTER_PORT': str(port), 'RANK': str(rank),
+                       'WORLD_SIZE': str(WORLD_SIZE), 'LOCAL_RANK': str(rank)})
+    init_distributed('', use_cuda=False)
+    try:
+        model = make_model()
+        ddp_model = nn.parallel.DistributedDataParallel(model)
+        solver = Solver(ddp_model, torch.device('cpu'), checkpoint_queue_size=0)
+        images, labels = make_data()
+        # 每个进程取全局batch中的一半
+        images, labels = images[rank::WORLD_SIZE], labels[rank::WORLD_SIZE]
+        predicts, loss = train_steps(ddp_model, solver, images, labels)
+        corrects = (predicts.argmax(dim=1) == labels).sum().item()
+        result = {
+            'world_size': get_world_size(),
+            'corrects': all_reduce_sum(corrects),
+            'loss': all_reduce_sum(loss.item()) / WORLD_SIZE,
+            'state_dict': model.state_dict()
+        }
+        torch.save(result, os.path.join(result_dir, 'rank%d.pt' % rank))
+    finally:
+        dist.destroy_process_group()
+
+
+def get_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_gloo_training_matches_single_process(tmp_path):
+    mp.spawn(train_worker, args=(get_free_port(), str(tmp_path)), nprocs=WORLD_SIZE, join=True)
+    results = [torch.load(str(tmp_path / ('rank%d.pt' % rank))) for rank in range(WORLD_SIZE)]
+
+    # 汇总后的指标在各个进程上相同，各个进程的参数在每一步之后保持一致
+    assert all(result['world_size'] == WORLD_SIZE for result in results)
+    assert results[0]['corrects'] == results[1]['corrects']
+    assert results[0]['loss'] == results[1]['loss']
+    for key, value in results[0]['state_dict'].items():
+        assert torch.equal(value, results[1]['state_dict'][key])
+
+    # 梯度在进程间平均，与单进程在整个batch上训练的结果相同
+    model = make_model()
+    images, labels = make_data()
+    train_steps(model, Solver(model, torch.device('cpu'), checkpoint_queue_size=0), images, labels)
+    for key, value in model.state_dict().items():
+        assert torch.allclose(value, results[0]['state_dict'][key], atol=1e-5)
@@ -0,0 +1,48 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+np = pytest.importorskip('numpy')
+pytest.importorskip('torchvision')
+
+from torch.utils.data import BatchSampler
+from datasets.imbalanced_sampler import ImbalancedDatasetSampler
+
+
+class LabelDataset(object):
+    """ 与TrainDataset一样通过label_list提供类标
+    """
+    def __init__(self, label_list):
+        self.label_list = label_list
+
+    def __len__(self):
+        return len(self.label_list)
+
+
+def test_weights_are_inverse_class_frequency():
+    dataset = LabelDataset([0] * 6 + [1] * 3 + [2])
+    sampler = ImbalancedDatasetSampler(dataset)
+    assert len(sampler) == 10
+    assert np.allclose(sampler.weights.numpy(), [1 / 6.] * 6 + [1 / 3.] * 3 + [1.])
+    # 每个类别的权重之和相同
+    assert np.allclose([sampler.weights[:6].sum(), sampler.weights[6:9].sum(), sampler.weights[9:].sum()], 1.0)
+
+
+def test_batches_are_class_balanced():
+    labels = np.array([0] * 900 + [1] * 90 + [2] * 10)
+    torch.manual_seed(0)
+    batches = list(BatchSampler(ImbalancedDatasetSampler(LabelDataset(labels.tolist()), num_samples=30000), 30, False))
+    assert len(batches) == 1000 and all(len(batch) == 30 for batch in batches)
+    # 有放回采样，各类别被采样的比例大致相同，少数类别中的每个样本都会被采到
+    sampled = labels[np.concatenate(batches)]
+    assert np.allclose(np.bincount(sampled) / len(sampled), 1 / 3., atol=0.02)
+    assert set(np.concatenate(batches)[sampled == 2].tolist()) == set(range(990, 1000))
+
+
+def test_indices_restrict_the_sampled_subset():
+    labels = [0] * 8 + [1] * 2 + [2] * 5
+    indices = list(range(10))
+    torch.manual_seed(0)
+    sampled = list(ImbalancedDatasetSampler(LabelDataset(labels), indices=indices, num_samples=2000))
+    assert set(sampled) <= set(indices)
+    # 只在indices内统计类别频率：类别0与类别1各占一半
+    assert abs(sum(labels[index] == 1 for index in sampled) / 2000. - 0.5) < 0.05
@@ -0,0 +1,23 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from losses.get_loss import Loss
+
+NUM_CLASSES = 4
+SAMPLES_PER_CLASS = [40, 20, 10, 5]
+
+
+@pytest.mark.parametrize('loss_name', [
+    '1.0*CrossEntropy', '1.0*SmoothCrossEntropy', '1.0*FocalLoss', '1.0*CB_Focal', '1.0*CB_Sigmoid',
+    '1.0*CB_Softmax', '1.0*CB_Smooth_Softmax', '1.0*SmoothCrossEntropy+0.5*CB_Smooth_Softmax'
+])
+def test_losses_run_on_cpu(loss_name):
+    criterion = Loss('tiny', loss_name, NUM_CLASSES, SAMPLES_PER_CLASS, 0.9999, 2, use_cuda=False)
+    outputs = torch.randn(6, NUM_CLASSES, requires_grad=True)
+    labels = torch.tensor([0, 1, 2, 3, 0, 1])
+    loss = criterion(outputs, labels)
+    loss.backward()
+    assert loss.device.type == 'cpu' and torch.isfinite(loss)
+    assert outputs.grad is not None and torch.isfinite(outputs.grad).all()
+    assert criterion.log.shape == (len(criterion.loss_struct),)
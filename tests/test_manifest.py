@@ -0,0 +1,85 @@
+import os
+import pytest
+
+pytest.importorskip('numpy')
+
+from datasets import manifest
+from datasets.manifest import load_manifest, get_manifest_path
+
+
+@pytest.fixture
+def read_counter(monkeypatch):
+    read_files = []
+    read_annotation_file = manifest.read_annotation_file
+
+    def counting_read(annotation_file_path):
+        read_files.append(os.path.basename(annotation_file_path))
+        return read_annotation_file(annotation_file_path)
+    monkeypatch.setattr(manifest, 'read_annotation_file', counting_read)
+    return read_files
+
+
+def write_annotation(data_root, index, label, mtime):
+    path = os.path.join(data_root, 'img_%d.txt' % index)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('img_%d.jpg, %d\n' % (index, label))
+    os.utime(path, ns=(mtime, mtime))
+
+
+def set_dir_mtime(data_root, mtime):
+    # 文件系统的时间精度可能较粗，显式设置目录的修改时间，保证每次变化都能被检测到
+    os.utime(data_root, ns=(mtime, mtime))
+
+
+def test_incremental_rescan(tmp_path, read_counter):
+    data_root = str(tmp_path / 'combine')
+    os.makedirs(data_root)
+    for index in range(3):
+        write_annotation(data_root, index, index, 10 ** 18)
+    set_dir_mtime(data_root, 10 ** 18)
+
+    samples, labels = load_manifest(data_root)
+    assert samples.tolist() == ['img_0.jpg', 'img_1.jpg', 'img_2.jpg'] and labels.tolist() == [0, 1, 2]
+    assert sorted(read_counter) == ['img_0.txt', 'img_1.txt', 'img_2.txt']
+    assert os.path.exists(get_manifest_path(data_root))
+
+    # 数据集目录未变化时直接使用清单
+    del read_counter[:]
+    assert load_manifest(data_root)[0].tolist() == samples.tolist()
+    assert read_counter == []
+
+    # 新增与删除标注文件时只读取新增的文件
+    write_annotation(data_root, 3, 1, 10 ** 18)
+    os.remove(os.path.join(data_root, 'img_0.txt'))
+    set_dir_mtime(data_root, 10 ** 18 + 1)
+    samples, labels = load_manifest(data_root)
+    assert samples.tolist() == ['img_1.jpg', 'img_2.jpg', 'img_3.jpg'] and labels.tolist() == [1, 2, 1]
+    assert read_counter == ['img_3.txt']
+
+
+def test_verify_detects_files_modified_in_place(tmp_path, read_counter):
+    data_root = str(tmp_path / 'combine')
+    os.makedirs(data_root)
+    for index in range(2):
+        write_annotation(data_root, index, 0, 10 ** 18)
+    set_dir_mtime(data_root, 10 ** 18)
+    load_manifest(data_root)
+
+    # 原地修改标注文件不会改变数据集目录的修改时间
+    del read_counter[:]
+    write_annotation(data_root, 1, 42, 10 ** 18 + 5)
+    set_dir_mtime(data_root, 10 ** 18)
+    assert load_manifest(data_root)[1].tolist() == [0, 0]
+    assert read_counter == []
+    assert load_manifest(data_root, verify=True)[1].tolist() == [0, 42]
+    assert read_counter == ['img_1.txt']
+
+
+def test_manifest_path_can_be_overridden(tmp_path):
+    data_root = str(tmp_path / 'combine')
+    os.makedirs(data_root)
+    write_annotation(data_root, 0, 5, 10 ** 18)
+    manifest_path = str(tmp_path / 'cache' / 'combine.json')
+    os.makedirs(os.path.dirname(manifest_path))
+    assert load_manifest(data_root, manifest_path)[1].tolist() == [5]
+    assert os.path.exists(manifest_path) and not os.path.exists(get_manifest_path(data_root))
@@ -0,0 +1,44 @@
+import pytest
+
+pytest.importorskip('torch')
+np = pytest.importorskip('numpy')
+Image = pytest.importorskip('PIL.Image')
+
+from datasets.memory_cache import SharedImageCache, get_max_aspect_ratio
+
+
+def make_image(width, height):
+    return Image.fromarray(np.random.randint(0, 256, (height, width, 3), dtype=np.uint8))
+
+
+def test_non_square_images_are_cached_with_their_aspect_ratio():
+    cache = SharedImageCache(['wide', 'tall', 'square'], 64 * 1024 ** 2, [320, 320], max_aspect_ratio=2.0)
+    # DCT缩放解码只保证宽高均不小于目标大小，宽图的长边可能是目标大小的数倍
+    stored = cache.put('wide', make_image(1280, 640))
+    assert stored.shape == (320, 640, 3)
+    assert cache.put('tall', make_image(400, 800)).shape == (640, 320, 3)
+    assert cache.put('square', make_image(700, 700)).shape == (320, 320, 3)
+    assert np.array_equal(cache.get('wide'), stored)
+    stats = cache.get_stats()
+    assert stats['oversize'] == 0 and stats['cached'] == 3
+
+
+def test_extreme_aspect_ratio_is_shrunk_into_the_slot():
+    cache = SharedImageCache(['panorama'], 64 * 1024 ** 2, [320, 320], max_aspect_ratio=2.0)
+    stored = cache.put('panorama', make_image(4000, 500))
+    assert stored.nbytes <= cache.slot_bytes
+    assert abs(stored.shape[1] / stored.shape[0] - 8) < 0.1
+    assert cache.get_stats()['oversize'] == 0
+
+
+def test_small_images_are_not_upscaled_and_resize_mode_uses_exact_slots():
+    cache = SharedImageCache(['small'], 64 * 1024 ** 2, [320, 320])
+    assert cache.put('small', make_image(200, 100)).shape == (100, 200, 3)
+    resized = SharedImageCache(['a'], 64 * 1024 ** 2, [320, 320], resize=True)
+    assert resized.slot_bytes == 320 * 320 * 3
+    assert resized.put('a', make_image(900, 300)).shape == (320, 320, 3)
+
+
+def test_max_aspect_ratio_of_buckets():
+    assert get_max_aspect_ratio() == 2.0
+    assert get_max_aspect_ratio([0.25, 1.0, 1.5]) == 4.0
@@ -0,0 +1,66 @@
+import random
+import pytest
+
+torch = pytest.importorskip('torch')
+np = pytest.importorskip('numpy')
+
+from torch.utils.data import BatchSampler, RandomSampler
+from torch.utils.data.distributed import DistributedSampler
+from datasets.resumable_sampler import ResumableBatchSampler
+from datasets.class_aware_sampler import ClassAwareBatchSampler
+
+DATASET = list(range(50))
+
+
+def make_samplers():
+    labels = np.arange(60) % 6
+    return [
+        lambda: BatchSampler(RandomSampler(DATASET), 8, drop_last=False),
+        lambda: BatchSampler(DistributedSampler(DATASET, num_replicas=2, rank=1, shuffle=True), 8, drop_last=False),
+        lambda: ClassAwareBatchSampler(labels, classes_per_batch=3, samples_per_class=2, num_batches=10),
+    ]
+
+
+def epoch_batches(batch_sampler, seed, epoch, start_batch=0):
+    sampler = ResumableBatchSampler(batch_sampler, seed=seed)
+    sampler.set_epoch(epoch, start_batch)
+    return list(sampler)
+
+
+@pytest.mark.parametrize('make_sampler', make_samplers())
+def test_same_seed_and_epoch_give_same_batches(make_sampler):
+    # 每次使用新的采样器，模拟重新启动的进程；中间打乱全局随机数状态
+    first = epoch_batches(make_sampler(), seed=3, epoch=2)
+    random.seed(123)
+    np.random.seed(123)
+    torch.manual_seed(123)
+    assert epoch_batches(make_sampler(), seed=3, epoch=2) == first
+    assert epoch_batches(make_sampler(), seed=3, epoch=3) != first
+    assert epoch_batches(make_sampler(), seed=4, epoch=2) != first
+
+
+@pytest.mark.parametrize('make_sampler', make_samplers())
+def test_resume_skips_trained_batches(make_sampler):
+    full = epoch_batches(make_sampler(), seed=5, epoch=1)
+    assert epoch_batches(make_sampler(), seed=5, epoch=1, start_batch=3) == full[3:]
+
+
+def test_start_batch_only_applies_to_the_next_iteration():
+    sampler = ResumableBatchSampler(BatchSampler(RandomSampler(DATASET), 8, drop_last=False), seed=0)
+    sampler.set_epoch(0, start_batch=2)
+    assert len(list(sampler)) == len(sampler) - 2
+    # 同一个epoch再次迭代时从头开始
+    assert len(list(sampler)) == len(sampler)
+
+
+def test_global_random_state_is_restored():
+    sampler = ResumableBatchSampler(BatchSampler(RandomSampler(DATASET), 8, drop_last=False), seed=0)
+    random.seed(1)
+    np.random.seed(1)
+    torch.manual_seed(1)
+    expected = (random.random(), np.random.rand(), torch.rand(1).item())
+    random.seed(1)
+    np.random.seed(1)
+    torch.manual_seed(1)
+    list(sampler)
+    assert (random.random(), np.random.rand(), torch.rand(1).item()) == expected
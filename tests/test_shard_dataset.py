@@ -0,0 +1,57 @@
+import os
+import json
+import pickle
+import pytest
+
+pytest.importorskip('tqdm')
+Image = pytest.importorskip('PIL.Image')
+
+from datasets.shard_dataset import pack_dataset, ShardReader, SHARD_INDEX_NAME
+
+
+def make_images(data_root, num_images=5):
+    os.makedirs(os.path.join(data_root, 'train'))
+    sample_list, label_list = [], []
+    for index in range(num_images):
+        name = 'train/img_%d.png' % index
+        Image.new('RGB', (16 + index, 8), color=(index * 40, 0, 0)).save(os.path.join(data_root, name))
+        sample_list.append(name)
+        label_list.append(index % 3)
+    return sample_list, label_list
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_pack_and_read_round_trip(tmp_path):
+    data_root, shard_root = str(tmp_path / 'data'), str(tmp_path / 'shards')
+    sample_list, label_list = make_images(data_root)
+    # 分片很小，每个分片只能放下一到两张图片
+    shard_size = 2 * max(os.path.getsize(os.path.join(data_root, name)) for name in sample_list) - 1
+    index = pack_dataset(data_root, sample_list, label_list, shard_root, shard_size=shard_size)
+    assert len(index['shards']) > 1
+    with open(os.path.join(shard_root, SHARD_INDEX_NAME), 'r', encoding='utf-8') as f:
+        assert json.load(f) == index
+
+    reader = ShardReader(shard_root)
+    assert reader.get_samples_labels() == (sample_list, label_list)
+    for index, name in enumerate(sample_list):
+        assert reader.read_bytes(name) == read_file(os.path.join(data_root, name))
+        image = reader.open_image(name)
+        assert image.size == (16 + index, 8)
+        assert image.convert('RGB').getpixel((0, 0)) == (index * 40, 0, 0)
+
+
+def test_reader_is_picklable_for_workers(tmp_path):
+    data_root, shard_root = str(tmp_path / 'data'), str(tmp_path / 'shards')
+    sample_list, label_list = make_images(data_root)
+    pack_dataset(data_root, sample_list, label_list, shard_root)
+    reader = ShardReader(shard_root)
+    reader.read_bytes(sample_list[0])
+
+    # 已经打开的mmap不随pickle传递，在新的进程中重新建立映射
+    clone = pickle.loads(pickle.dumps(reader))
+    assert clone._mmaps == {}
+    assert clone.read_bytes(sample_list[-1]) == read_file(os.path.join(data_root, sample_list[-1]))
@@ -0,0 +1,64 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+np = pytest.importorskip('numpy')
+nn = torch.nn
+if not hasattr(torch, 'autocast'):
+    pytest.skip('torch.autocast is required for bf16 on CPU', allow_module_level=True)
+
+from solver import Solver
+from losses.get_loss import Loss
+from utils.cutmix import generate_mixed_sample
+
+NUM_CLASSES = 4
+LOSS_NAMES = ['1.0*SmoothCrossEntropy', '1.0*CB_Softmax', '1.0*SmoothCrossEntropy+1.0*CB_Smooth_Softmax', '1.0*CB_Focal']
+
+
+def make_solver():
+    torch.manual_seed(0)
+    model = nn.Sequential(nn.Conv2d(3, 8, 3, padding=1), nn.ReLU(), nn.AdaptiveAvgPool2d(1), nn.Flatten(),
+                          nn.Linear(8, NUM_CLASSES))
+    solver = Solver(model, torch.device('cpu'), amp='bf16', checkpoint_queue_size=0)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    return model, solver, optimizer
+
+
+def make_criterion(loss_name):
+    return Loss('tiny', loss_name, NUM_CLASSES, [40, 20, 10, 5], 0.9999, 2, use_cuda=False)
+
+
+@pytest.mark.parametrize('loss_name', LOSS_NAMES)
+def test_bf16_training_step_on_cpu(loss_name):
+    model, solver, optimizer = make_solver()
+    criterion = make_criterion(loss_name)
+    images = torch.randint(0, 256, (4, 3, 16, 16), dtype=torch.uint8)
+    labels = torch.tensor([0, 1, 2, 3])
+    weight_before = model[-1].weight.detach().clone()
+
+    predicts = solver.forward(images)
+    # 网络在bfloat16的autocast中前向传播，损失以float32计算
+    assert predicts.dtype == torch.bfloat16
+    loss = solver.cal_loss(predicts, labels, criterion)
+    assert loss.dtype == torch.float32 and torch.isfinite(loss)
+    solver.backword(optimizer, loss)
+    assert model[-1].weight.dtype == torch.float32
+    assert not torch.equal(weight_before, model[-1].weight)
+
+
+@pytest.mark.parametrize('loss_name', LOSS_NAMES)
+def test_bf16_cutmix_step_on_cpu(loss_name):
+    model, solver, optimizer = make_solver()
+    criterion = make_criterion(loss_name)
+    np.random.seed(0)
+    images = torch.randint(0, 256, (4, 3, 16, 16), dtype=torch.uint8)
+    labels = torch.tensor([0, 1, 2, 3])
+    images, labels_a, labels_b, lam = generate_mixed_sample(1.0, images, labels)
+
+    predicts = solver.forward(images)
+    loss = solver.cal_loss_cutmix(predicts, labels_a, labels_b, lam, criterion)
+    expected = criterion(predicts.float(), labels_a) * lam + criterion(predicts.float(), labels_b) * (1. - lam)
+    assert loss.dtype == torch.float32 and torch.allclose(loss, expected)
+    solver.backword(optimizer, loss)
+    assert all(torch.isfinite(parameter).all() for parameter in model.parameters())
+    # 记录的损失与损失函数的个数一致
+    assert len(criterion.record_loss_iteration().split('][')) == len(criterion.loss_struct)
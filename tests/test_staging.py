@@ -0,0 +1,133 @@
+import os
+import pytest
+
+pytest.importorskip('torch')
+np = pytest.importorskip('numpy')
+Image = pytest.importorskip('PIL.Image')
+
+from datasets import staging
+from datasets.staging import DataStager, LocalDirStore, MoxStore, StagingBatchSampler, create_store
+from datasets.aspect_ratio_sampler import AspectRatioBucketBatchSampler, StagedAspectRatios
+
+
+def make_remote(root, num_images=6):
+    os.makedirs(os.path.join(root, 'train'))
+    names = []
+    for index in range(num_images):
+        name = 'train/img_%d.jpg' % index
+        # 偶数为横图，奇数为竖图
+        size = (64, 32) if index % 2 == 0 else (32, 64)
+        Image.new('RGB', size).save(os.path.join(root, name))
+        with open(os.path.join(root, 'train/img_%d.txt' % index), 'w') as f:
+            f.write('img_%d.jpg, %d' % (index, index % 2))
+        names.append(name)
+    return names
+
+
+class FlakyStore(LocalDirStore):
+    def __init__(self, root, failures):
+        super(FlakyStore, self).__init__(root)
+        # 每个文件在成功之前失败的次数
+        self.failures = failures
+
+    def copy_file(self, file_name, local_path):
+        if self.failures.get(file_name, 0) > 0:
+            self.failures[file_name] -= 1
+            raise IOError('connection reset')
+        super(FlakyStore, self).copy_file(file_name, local_path)
+
+
+class RecordingStager(object):
+    finished = False
+
+    def __init__(self):
+        self.calls = []
+
+    def prioritize(self, file_names):
+        self.calls.append(list(file_names))
+
+
+def test_create_store_selects_by_path():
+    assert isinstance(create_store('s3://bucket/data/combine'), MoxStore)
+    assert isinstance(create_store('obs://bucket/data/combine'), MoxStore)
+    assert isinstance(create_store('/mnt/data/combine'), LocalDirStore)
+
+
+def test_stager_copies_all_files(tmp_path):
+    names = make_remote(str(tmp_path / 'remote'))
+    stager = DataStager(LocalDirStore(str(tmp_path / 'remote')), str(tmp_path / 'local'), num_threads=2)
+    stager.start()
+    # 标注文件同步拷贝
+    assert os.path.exists(str(tmp_path / 'local' / 'train' / 'img_0.txt'))
+    stager.wait()
+    assert stager.finished
+    assert all(os.path.exists(stager.local_path(name)) for name in names)
+
+
+def test_stager_retries_failed_copies(tmp_path):
+    names = make_remote(str(tmp_path / 'remote'))
+    store = FlakyStore(str(tmp_path / 'remote'), {names[0]: staging.MAX_COPY_ATTEMPTS - 1})
+    stager = DataStager(store, str(tmp_path / 'local'), num_threads=1)
+    stager.start()
+    stager.wait()
+    assert os.path.exists(stager.local_path(names[0]))
+
+
+def test_stager_wait_raises_when_files_are_missing(tmp_path):
+    names = make_remote(str(tmp_path / 'remote'))
+    store = FlakyStore(str(tmp_path / 'remote'), {names[1]: staging.MAX_COPY_ATTEMPTS})
+    stager = DataStager(store, str(tmp_path / 'local'), num_threads=1)
+    stager.start()
+    with pytest.raises(RuntimeError, match='img_1.jpg'):
+        stager.wait()
+
+
+def test_staging_batch_sampler_prefetches_a_bounded_window():
+    sample_list = ['img_%d.jpg' % index for index in range(20)]
+    batches = [list(range(start, start + 2)) for start in range(0, 20, 2)]
+    stager = RecordingStager()
+    iterator = iter(StagingBatchSampler(batches, sample_list, stager, prefetch_batches=3))
+
+    assert next(iterator) == [0, 1]
+    # 读取第一个batch时只推入了窗口内的batch以及窗口向后移动的一个batch
+    assert stager.calls == [sample_list[0:2], sample_list[2:4], sample_list[4:6], sample_list[6:8]]
+    assert list(iterator) == batches[1:]
+    assert [name for call in stager.calls for name in call] == sample_list
+
+
+def test_staged_aspect_ratios_are_read_lazily(tmp_path):
+    names = make_remote(str(tmp_path / 'remote'))
+    stager = DataStager(LocalDirStore(str(tmp_path / 'remote')), str(tmp_path / 'local'))
+    # 只拷贝一张横图，其余图片尚未暂存
+    stager.ensure(names[0])
+    aspect_ratios = StagedAspectRatios(names, stager)
+    assert aspect_ratios.values[0] == 2.0 and np.isnan(aspect_ratios.values[1:]).all()
+
+    sampler = AspectRatioBucketBatchSampler(aspect_ratios, 2, [64, 64], bucket_ratios=[0.5, 1.0, 2.0], shuffle=False)
+    # 长宽比未知的样本分到1:1的桶中
+    assert [bucket.tolist() for bucket in sampler.buckets] == [[], [1, 2, 3, 4, 5], [0]]
+
+    for name in names[1:]:
+        stager.ensure(name)
+    list(sampler)
+    assert aspect_ratios.complete
+    assert [bucket.tolist() for bucket in sampler.buckets] == [[1, 3, 5], [], [0, 2, 4]]
+
+
+def test_staging_batch_sampler_forwards_seed_and_epoch():
+    from torch.utils.data import BatchSampler, RandomSampler
+    from datasets.resumable_sampler import ResumableBatchSampler
+
+    sample_list = ['img_%d.jpg' % index for index in range(40)]
+
+    def epoch_batches(seed, wrap):
+        sampler = ResumableBatchSampler(BatchSampler(RandomSampler(sample_list), 4, drop_last=False))
+        if wrap:
+            sampler = StagingBatchSampler(sampler, sample_list, RecordingStager(), prefetch_batches=2)
+        # 与训练循环相同，通过DataLoader.batch_sampler设置种子与epoch
+        sampler.seed = seed
+        sampler.set_epoch(3, start_batch=1)
+        return list(sampler)
+
+    assert epoch_batches(5, wrap=True) == epoch_batches(5, wrap=False)
+    assert epoch_batches(5, wrap=True) != epoch_batches(6, wrap=True)
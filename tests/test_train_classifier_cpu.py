@@ -0,0 +1,96 @@
+import os
+import random
+import pytest
+
+torch = pytest.importorskip('torch')
+nn = torch.nn
+
+import train_classifier
+from config import get_classify_config
+from models.build_model import PrepareModel
+from models.custom_model import CustomModel
+from utils.set_seed import set_rng_state
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+NUM_CLASSES = 4
+
+
+class TinyModel(nn.Module):
+    """ 与CustomModel结构相同（feature_layer + pool + classifier）的小模型，不下载预训练权重
+    """
+    def __init__(self):
+        super(TinyModel, self).__init__()
+        self.feature_layer = nn.Sequential(nn.Conv2d(3, 8, 3, padding=1), nn.BatchNorm2d(8), nn.ReLU())
+        self.pool = nn.AdaptiveAvgPool2d(output_size=(1, 1))
+        self.classifier = nn.Linear(8, NUM_CLASSES)
+
+    def forward(self, x):
+        features = self.pool(self.feature_layer(x))
+        return self.classifier(features.view(features.shape[0], -1))
+
+    get_classify_result = CustomModel.get_classify_result
+
+
+def build_train_val(tmp_path, monkeypatch):
+    monkeypatch.chdir(REPO_ROOT)
+    monkeypatch.setattr(PrepareModel, 'create_model', lambda self, *args, **kwargs: TinyModel())
+    config = get_classify_config([
+        '--device', 'cpu', '--train_url', str(tmp_path), '--model_type', 'tiny',
+        '--num_classes', str(NUM_CLASSES), '--checkpoint_queue_size', '0'
+    ])
+    return train_classifier.TrainVal(config, 0, [10] * NUM_CLASSES)
+
+
+def train_one_step(train_val):
+    images = torch.randint(0, 256, (4, 3, 32, 32), dtype=torch.uint8)
+    labels = torch.tensor([0, 1, 2, 3])
+    train_val.model.train()
+    predicts = train_val.solver.forward(images)
+    loss = train_val.solver.cal_loss(predicts, labels, train_val.criterion)
+    train_val.solver.backword(train_val.optimizer, loss)
+    return predicts, labels, loss
+
+
+def test_train_val_starts_on_cpu(tmp_path, monkeypatch):
+    train_val = build_train_val(tmp_path, monkeypatch)
+
+    assert train_val.device.type == 'cpu'
+    assert train_val.raw_model is train_val.model
+    assert train_val.model.feature_layer[0].weight.is_contiguous(memory_format=torch.channels_last)
+    # 优化器的两个参数组：特征层与分类层
+    assert len(train_val.optimizer.param_groups) == 2
+
+    # 一次完整的训练迭代：uint8输入在Solver.forward中归一化并转换为channels_last
+    weight_before = train_val.model.classifier.weight.detach().clone()
+    predicts, labels, loss = train_one_step(train_val)
+    assert predicts.shape == (4, NUM_CLASSES)
+    assert torch.isfinite(loss)
+    assert not torch.equal(weight_before, train_val.model.classifier.weight)
+    assert train_val.raw_model.get_classify_result(predicts, labels, train_val.device).shape == (4,)
+
+    # 单进程训练时rank为0，保存训练状态
+    train_val.save_training_state(0, 1, 0, (4, 1))
+    train_val.solver.wait_checkpoints()
+    assert os.path.isfile(os.path.join(train_val.model_path, train_val.state_name))
+
+
+def test_training_state_round_trip(tmp_path, monkeypatch):
+    train_val = build_train_val(tmp_path, monkeypatch)
+    train_one_step(train_val)
+    random.seed(11)
+    train_val.save_training_state(2, 5, 40, (20, 7))
+    train_val.solver.wait_checkpoints()
+    expected_random = random.random()
+
+    # 新的TrainVal从保存的训练状态恢复，训练状态中包含numpy的随机数状态等非tensor对象
+    resumed = build_train_val(tmp_path, monkeypatch)
+    state = resumed.solver.load_training_state(
+        os.path.join(train_val.model_path, train_val.state_name), resumed.optimizer, resumed.exp_lr_scheduler
+    )
+    assert (state['epoch'], state['batch'], state['global_step'], tuple(state['epoch_stats'])) == (2, 5, 40, (20, 7))
+    for key, value in train_val.model.state_dict().items():
+        assert torch.equal(value, resumed.model.state_dict()[key])
+    assert resumed.optimizer.state_dict()['state'].keys() == train_val.optimizer.state_dict()['state'].keys()
+    set_rng_state(state['rng_state'])
+    assert random.random() == expected_random
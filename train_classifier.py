@@ -13,30 +13,44 @@ import codecs
 
 from config import get_classify_config
 from solver import Solver
-from utils.set_seed import seed_torch
+from utils.set_seed import seed_torch, get_rng_state, set_rng_state
 from models.build_model import PrepareModel
 from datasets.create_dataset import GetDataloader, get_dataloader_from_folder
 from losses.get_loss import Loss
 from utils.classification_metric import ClassificationMetric
 from datasets.data_augmentation import DataAugmentation
+from datasets.batch_augmentation import BatchAugmentation
 from utils.cutmix import generate_mixed_sample
 from datasets.create_dataset import multi_scale_transforms
+from datasets.multi_scale import resize_batch
+from datasets.loader_tuning import get_loader_params, autotune_loader, rebuild_dataloader, save_loader_params
+from datasets.class_aware_sampler import get_sampler_params
+from utils.cpu_profile import setup_cpu_threads, enable_onednn_fusion
+from utils.distributed import init_distributed, is_distributed, is_main_process, get_rank, get_world_size, \
+    broadcast_object, all_gather_array, all_reduce_sum, NullWriter
 
 
 class TrainVal:
-    def __init__(self, config, fold, train_labels_number):
+    def __init__(self, config, fold, train_labels_number, loader_params=None, batch_augmentation=None):
         """
         Args:
             config: 配置参数
             fold: int, 当前为第几折
             train_labels_number: list, 某一折的[number_class0, number__class1, ...]
+            loader_params: dict, 本次训练使用的DataLoader参数，保存在param.json旁，供之后的训练通过--loader_params复用
+            batch_augmentation: BatchAugmentation, 不为None时在训练设备上对整个batch进行数据增强
         """
         self.config = config
         self.fold = fold
+        self.loader_params = loader_params
+        self.batch_augmentation = batch_augmentation
         self.epoch = config.epoch
         self.num_classes = config.num_classes
         self.lr_scheduler = config.lr_scheduler
         self.save_interval = 100
+        self.snapshot_interval = config.snapshot_interval
+        self.accumulation_steps = config.accumulation_steps
+        self.log_interval = config.log_interval
         self.cut_mix = config.cut_mix
         self.beta = config.beta
         self.cutmix_prob = config.cutmix_prob
@@ -45,10 +59,17 @@ class TrainVal:
         self.multi_scale = config.multi_scale
         self.multi_scale_size = config.multi_scale_size
         self.multi_scale_interval = config.multi_scale_interval
+        self.multi_scale_backend = config.multi_scale_backend
+        self.uint8_transport = config.uint8_transport
         if self.cut_mix:
             print('Using cut mix.')
         if self.multi_scale:
             print('Using multi scale training.')
+        # --device cpu时即使有GPU也在CPU上训练
+        self.use_cuda = torch.cuda.is_available() and config.device != 'cpu'
+        if self.accumulation_steps > 1:
+            print('Accumulating gradients over {} batches, effective batch size: {}.'.format(
+                self.accumulation_steps, self.accumulation_steps * config.batch_size))
         print('USE LOSS: {}'.format(config.loss_name))
 
         # 加载模型
@@ -60,9 +81,19 @@ class TrainVal:
             pretrained=True,
             bn_to_gn=config.bn_to_gn
         )
-        if torch.cuda.is_available():
+        if config.device == 'cpu':
+            # oneDNN的卷积在NHWC上不需要逐层转换格式，输入由Solver.forward同样转换为channels_last
+            self.model = self.model.to(memory_format=torch.channels_last)
+        if is_distributed():
+            # 每个进程一个模型副本，梯度在反向传播时跨进程平均；使用GPU时每个进程对应local_rank指定的一块GPU
+            device_ids = [torch.cuda.current_device()] if self.use_cuda else None
+            self.model = self.model.cuda() if self.use_cuda else self.model
+            self.model = torch.nn.parallel.DistributedDataParallel(self.model, device_ids=device_ids)
+        elif self.use_cuda:
             self.model = torch.nn.DataParallel(self.model)
             self.model = self.model.cuda()
+        # 去掉DataParallel/DistributedDataParallel包装的模型，用于计算准确率与保存参数
+        self.raw_model = self.model.module if hasattr(self.model, 'module') else self.model
 
         # 加载优化器
         self.optimizer = prepare_model.create_optimizer(config.model_type, self.model, config)
@@ -77,23 +108,43 @@ class TrainVal:
         )
 
         # 加载损失函数
-        self.criterion = Loss(config.model_type, config.loss_name, self.num_classes, train_labels_number, config.beta_CB, config.gamma)
+        self.criterion = Loss(config.model_type, config.loss_name, self.num_classes, train_labels_number, config.beta_CB, config.gamma,
+                              use_cuda=self.use_cuda)
 
         # 实例化实现各种子函数的 solver 类
-        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        self.solver = Solver(self.model, self.device)
+        self.device = torch.device('cuda', torch.cuda.current_device()) if self.use_cuda and is_distributed() \
+            else torch.device('cuda' if self.use_cuda else 'cpu')
+        # 使用checkpoint_store时，所有训练的权重共享同一个blob目录，放在model_type目录之外，不影响按修改时间查找最近的训练
+        checkpoint_store = os.path.join(config.train_url, 'blobs') if config.checkpoint_store else None
+        self.solver = Solver(self.model, self.device, amp=config.amp, checkpoint_queue_size=config.checkpoint_queue_size,
+                             checkpoint_store=checkpoint_store, archive_dtype=config.archive_dtype,
+                             channels_last=config.device == 'cpu')
+        if config.amp != 'none':
+            print('Using {} mixed precision training.'.format(self.solver.amp))
         if config.restore:
             weight_path = os.path.join('checkpoints', config.model_type)
             if config.restore == 'last':
                 lists = os.listdir(weight_path)  # 获得文件夹内所有文件
                 lists.sort(key=lambda fn: os.path.getmtime(weight_path + '/' + fn))  # 按照最近修改时间排序
-                weight_path = os.path.join(weight_path, lists[-1], 'model_best.pth')
+                weight_path = os.path.join(self.get_fold_dir(os.path.join(weight_path, lists[-1])), 'model_best.pth')
             else:
-                weight_path = os.path.join(weight_path, config.restore, 'model_best.pth')
-            self.solver.load_checkpoint(weight_path)
+                weight_path = os.path.join(self.get_fold_dir(os.path.join(weight_path, config.restore)), 'model_best.pth')
+            # 各个进程加载rank 0找到的同一个权重
+            self.solver.load_checkpoint(broadcast_object(weight_path))
+
+        # 恢复完整的训练状态（模型、优化器、学习率衰减策略、epoch与batch、随机数状态）
+        self.state_name = '%s_fold%d_state.pth' % (config.model_type, fold)
+        resume_state = None
+        if config.resume:
+            # rank 0创建新的日志目录之前确定路径，各个进程恢复同一个训练状态
+            resume_path = broadcast_object(self.get_resume_path(config.resume))
+            if os.path.isfile(resume_path):
+                resume_state = self.solver.load_training_state(resume_path, self.optimizer, self.exp_lr_scheduler)
+            else:
+                print('Can not find training state in {}, train fold {} from scratch.'.format(resume_path, fold))
 
-        # log初始化
-        self.writer, self.time_stamp = self.init_log()
+        # log初始化，恢复训练时沿用原先的目录与随机种子
+        self.writer, self.time_stamp, self.seed = self.init_log(resume_state)
         self.model_path = os.path.join(self.config.train_url, self.config.model_type, self.time_stamp)
 
         # 初始化分类度量准则类
@@ -102,6 +153,16 @@ class TrainVal:
         self.classification_metric = ClassificationMetric(self.class_names, self.model_path, text_flag=0)
 
         self.max_accuracy_valid = 0
+        self.start_epoch, self.start_batch, self.global_step = 0, 0, 0
+        self.epoch_stats = (0, 0)
+        if resume_state is not None:
+            self.max_accuracy_valid = resume_state['max_score']
+            self.start_epoch, self.start_batch = resume_state['epoch'], resume_state['batch']
+            self.global_step, self.epoch_stats = resume_state['global_step'], resume_state['epoch_stats']
+            self.criterion.log_sum = resume_state['loss_log_sum']
+            # 训练状态中只有rank 0的随机数状态，其余进程沿用init_log中以各自rank偏移的种子
+            if is_main_process():
+                set_rng_state(resume_state['rng_state'])
 
     def train(self, train_loader, valid_loader):
         """ 完成模型的训练，保存模型与日志
@@ -109,100 +170,162 @@ class TrainVal:
             train_loader: 训练数据的DataLoader
             valid_loader: 验证数据的Dataloader
         """
-        global_step = 0
-        for epoch in range(self.epoch):
+        global_step = self.global_step
+        # ResumableBatchSampler（使用stager时为包装它的StagingBatchSampler，转发seed与set_epoch），
+        # 每个epoch的batch顺序只由随机种子与epoch决定
+        train_sampler = train_loader.batch_sampler
+        train_sampler.seed = self.seed
+        last_snapshot_time = time.time()
+        for epoch in range(self.start_epoch, self.epoch):
             self.model.train()
+            start_batch = self.start_batch if epoch == self.start_epoch else 0
+            train_sampler.set_epoch(epoch, start_batch)
             epoch += 1
-            images_number, epoch_corrects = 0, 0
-
-            tbar = tqdm.tqdm(train_loader)
+            images_number, epoch_corrects = self.epoch_stats if start_batch else (0, 0)
+
+            tbar = tqdm.tqdm(train_loader, initial=start_batch, disable=not is_main_process())
+            # 统计吞吐量与峰值显存/内存
+            self.solver.reset_peak_memory()
+            epoch_start_time, start_images_number = time.time(), images_number
+            # 两次日志之间的正确数与样本数，正确数保留在设备上
+            interval_corrects, interval_images = 0, 0
+            interval_start_time = time.time()
+            self.criterion.reset_loss_iteration()
             image_size = self.image_size
-            for i, (_, images, labels) in enumerate(tbar):
-                if self.multi_scale:
+            for i, (_, images, labels) in enumerate(tbar, start_batch):
+                if self.multi_scale and self.multi_scale_backend == 'main':
                     if i % self.multi_scale_interval == 0:
                         image_size = random.choice(self.multi_scale_size)
-                    images = multi_scale_transforms(image_size, images)
-                if self.cut_mix:
-                    # 使用cut_mix
-                    r = np.random.rand(1)
-                    if self.beta > 0 and r < self.cutmix_prob:
-                        images, labels_a, labels_b, lam = generate_mixed_sample(self.beta, images, labels)
-                        labels_predict = self.solver.forward(images)
-                        loss = self.solver.cal_loss_cutmix(labels_predict, labels_a, labels_b, lam, self.criterion)
+                    if self.uint8_transport:
+                        # uint8的batch，整体插值后仍为uint8，由Solver.forward归一化
+                        images = resize_batch(images, image_size)
+                    else:
+                        images = multi_scale_transforms(image_size, images)
+                else:
+                    # 尺度已由MultiScaleBatchSampler或AspectRatioBucketBatchSampler选择，并在DataLoader的worker中完成缩放
+                    image_size = list(images.shape[-2:])
+                if self.batch_augmentation is not None:
+                    images = self.batch_augmentation(images.to(self.device))
+                # 梯度累积：每accumulation_steps个batch更新一次参数，epoch的最后一组不足accumulation_steps个batch时同样更新
+                group_start = i - i % self.accumulation_steps
+                group_size = min(self.accumulation_steps, len(train_loader) - group_start)
+                optimizer_step = i + 1 == group_start + group_size
+                # DistributedDataParallel训练时只在参数更新的batch上同步梯度
+                with self.solver.no_sync(optimizer_step):
+                    if self.cut_mix:
+                        # 使用cut_mix
+                        r = np.random.rand(1)
+                        if self.beta > 0 and r < self.cutmix_prob:
+                            images, labels_a, labels_b, lam = generate_mixed_sample(self.beta, images, labels)
+                            labels_predict = self.solver.forward(images)
+                            loss = self.solver.cal_loss_cutmix(labels_predict, labels_a, labels_b, lam, self.criterion)
+                        else:
+                            # 网络的前向传播
+                            labels_predict = self.solver.forward(images)
+                            loss = self.solver.cal_loss(labels_predict, labels, self.criterion)
                     else:
                         # 网络的前向传播
                         labels_predict = self.solver.forward(images)
                         loss = self.solver.cal_loss(labels_predict, labels, self.criterion)
-                else:
-                    # 网络的前向传播
-                    labels_predict = self.solver.forward(images)
-                    loss = self.solver.cal_loss(labels_predict, labels, self.criterion)
-                self.solver.backword(self.optimizer, loss)
+                    self.solver.backword(self.optimizer, loss, group_size, optimizer_step)
 
+                corrects = self.raw_model.get_classify_result(labels_predict, labels, self.device).sum()
                 images_number += images.size(0)
-                epoch_corrects += self.model.module.get_classify_result(labels_predict, labels, self.device).sum()
-                train_acc_iteration = self.model.module.get_classify_result(labels_predict, labels, self.device).mean()
-
-                # 保存到tensorboard，每一步存储一个
-                descript = self.criterion.record_loss_iteration(self.writer.add_scalar, global_step + i)
-                self.writer.add_scalar('TrainAccIteration', train_acc_iteration, global_step + i)
-
-                params_groups_lr = str()
-                for group_ind, param_group in enumerate(self.optimizer.param_groups):
-                    params_groups_lr = params_groups_lr + 'pg_%d' % group_ind + ': %.8f, ' % param_group['lr']
-
-                descript = '[Train Fold {}][epoch: {}/{}][image_size: {}][Lr :{}][Acc: {:.4f}]'.format(
-                    self.fold,
-                    epoch,
-                    self.epoch,
-                    image_size,
-                    params_groups_lr,
-                    train_acc_iteration
-                ) + descript
-
-                # 对于 CyclicLR，要每一步均执行依次学习率衰减
-                if self.lr_scheduler == 'CyclicLR':
-                    self.exp_lr_scheduler.step()
-                    self.writer.add_scalar('Lr', self.optimizer.param_groups[1]['lr'], global_step + i)
+                epoch_corrects += corrects
+                interval_corrects += corrects
+                interval_images += images.size(0)
 
-                tbar.set_description(desc=descript)
+                # 对于 CyclicLR，要每一次参数更新均执行依次学习率衰减
+                if self.lr_scheduler == 'CyclicLR' and optimizer_step:
+                    self.exp_lr_scheduler.step()
 
-            # 写到tensorboard中
-            epoch_acc = epoch_corrects / images_number
+                # 每log_interval个batch（以及每个epoch的最后一个batch）读取一次设备上的统计量并保存到tensorboard，
+                # 记录的是这些batch的平均准确率与平均损失，log_interval为1时与逐步记录相同
+                if (i + 1) % self.log_interval == 0 or i + 1 == len(train_loader):
+                    train_acc_iteration = (interval_corrects / interval_images).item()
+                    # 读取准确率时已与设备同步，此时的吞吐量为这些batch实际的处理速度
+                    interval_throughput = interval_images / (time.time() - interval_start_time)
+                    interval_corrects, interval_images = 0, 0
+                    interval_start_time = time.time()
+                    descript = self.criterion.record_loss_iteration(self.writer.add_scalar, global_step + i)
+                    self.writer.add_scalar('TrainAccIteration', train_acc_iteration, global_step + i)
+                    self.writer.add_scalar('TrainImagesPerSecondIteration', interval_throughput, global_step + i)
+                    if self.lr_scheduler == 'CyclicLR':
+                        self.writer.add_scalar('Lr', self.optimizer.param_groups[1]['lr'], global_step + i)
+
+                    params_groups_lr = str()
+                    for group_ind, param_group in enumerate(self.optimizer.param_groups):
+                        params_groups_lr = params_groups_lr + 'pg_%d' % group_ind + ': %.8f, ' % param_group['lr']
+
+                    descript = '[Train Fold {}][epoch: {}/{}][image_size: {}][Lr :{}][Acc: {:.4f}][{:.1f} images/s]'.format(
+                        self.fold,
+                        epoch,
+                        self.epoch,
+                        image_size,
+                        params_groups_lr,
+                        train_acc_iteration,
+                        interval_throughput
+                    ) + descript
+                    tbar.set_description(desc=descript)
+
+                # 定期保存训练状态，被中断后从下一个未训练的batch恢复
+                # 累积中的梯度不在训练状态中，只在参数更新之后保存
+                if optimizer_step and self.snapshot_interval > 0 and \
+                        time.time() - last_snapshot_time > self.snapshot_interval * 60:
+                    self.save_training_state(epoch - 1, i + 1, global_step, (images_number, int(epoch_corrects)))
+                    last_snapshot_time = time.time()
+
+            # 写到tensorboard中，多进程训练时准确率与吞吐量为所有进程的总和
+            epoch_time = time.time() - epoch_start_time
+            images_per_second = all_reduce_sum(images_number - start_images_number) / epoch_time
+            epoch_acc = all_reduce_sum(epoch_corrects) / all_reduce_sum(images_number)
+            step_time = epoch_time / max(len(train_loader) - start_batch, 1) * 1000
+            peak_memory = self.solver.get_peak_memory()
+            self.writer.add_scalar('TrainImagesPerSecond', images_per_second, epoch)
+            self.writer.add_scalar('PeakMemoryMB', peak_memory, epoch)
             self.writer.add_scalar('TrainAccEpoch', epoch_acc, epoch)
             if self.lr_scheduler != 'CyclicLR':
                 self.writer.add_scalar('Lr', self.optimizer.param_groups[1]['lr'], epoch)
             descript = self.criterion.record_loss_epoch(len(train_loader), self.writer.add_scalar, epoch)
 
             # Print the log info
-            print('[Finish epoch: {}/{}][Average Acc: {:.4}]'.format(epoch, self.epoch, epoch_acc) + descript)
+            if is_main_process():
+                print('[Finish epoch: {}/{}][Average Acc: {:.4}]'.format(epoch, self.epoch, epoch_acc) + descript)
+                print('[Precision: {}][Throughput: {:.1f} images/s][Step time: {:.1f}ms][Peak memory: {:.0f}MB]'.format(
+                    self.solver.amp, images_per_second, step_time, peak_memory))
+            memory_cache = getattr(train_loader.dataset, 'memory_cache', None)
+            if memory_cache is not None and is_main_process():
+                print(memory_cache.format_stats())
+                self.writer.add_scalar('MemoryCacheHitRate', memory_cache.get_stats()['hit_rate'], epoch)
 
             # 验证模型
             val_accuracy, val_loss, is_best = self.validation(valid_loader)
 
-            # 保存参数
+            # 保存参数，多进程训练时各个进程的参数相同，只由rank 0保存
             state = {
                 'epoch': epoch,
-                'state_dict': self.model.module.state_dict(),
+                'state_dict': self.raw_model.state_dict(),
                 'max_score': self.max_accuracy_valid
             }
-            self.solver.save_checkpoint(
-                os.path.join(
-                    self.model_path,
-                    '%s_fold%d.pth' % (self.config.model_type, self.fold)
-                ),
-                state,
-                is_best
-            )
+            if is_main_process():
+                self.solver.save_checkpoint(
+                    os.path.join(
+                        self.model_path,
+                        '%s_fold%d.pth' % (self.config.model_type, self.fold)
+                    ),
+                    state,
+                    is_best
+                )
 
-            if epoch % self.save_interval == 0:
+            if epoch % self.save_interval == 0 and is_main_process():
                 self.solver.save_checkpoint(
                     os.path.join(
                         self.model_path,
                         '%s_epoch%d_fold%d.pth' % (self.config.model_type, epoch, self.fold)
                     ),
                     state,
-                    False
+                    False,
+                    archive=True
                 )
 
             # 写到tensorboard中
@@ -215,10 +338,73 @@ class TrainVal:
             elif self.lr_scheduler != 'CyclicLR':
                 self.exp_lr_scheduler.step()
             global_step += len(train_loader)
-        print('BEST ACC:{}'.format(self.max_accuracy_valid))
+
+            # 每一个epoch完毕之后保存训练状态，恢复时从下一个epoch开始
+            self.save_training_state(epoch, 0, global_step, (0, 0))
+            last_snapshot_time = time.time()
+        # 等待后台保存的权重全部写完
+        if is_main_process():
+            self.solver.wait_checkpoints()
+            print('BEST ACC:{}'.format(self.max_accuracy_valid))
+
+    def save_training_state(self, epoch, batch, global_step, epoch_stats):
+        """ 保存完整的训练状态
+        Args:
+            epoch: int, 从0开始计数，恢复时从该epoch继续
+            batch: int, 恢复时从该epoch的第几个batch继续
+            global_step: int, 该epoch开始时的全局step
+            epoch_stats: tuple, (images_number, epoch_corrects), 该epoch已经统计的样本数与正确数
+        """
+        if not is_main_process():
+            return
+        state = {
+            'epoch': epoch,
+            'batch': batch,
+            'global_step': global_step,
+            'epoch_stats': epoch_stats,
+            'state_dict': self.raw_model.state_dict(),
+            'optimizer': self.optimizer.state_dict(),
+            'lr_scheduler': self.exp_lr_scheduler.state_dict(),
+            'max_score': self.max_accuracy_valid,
+            'loss_log_sum': self.criterion.log_sum,
+            'time_stamp': self.time_stamp,
+            'seed': self.seed,
+            'rng_state': get_rng_state(),
+            'grad_scaler': self.solver.scaler.state_dict() if self.solver.scaler is not None else None
+        }
+        self.solver.save_training_state(os.path.join(self.model_path, self.state_name), state)
+
+    def get_resume_path(self, resume):
+        """ 得到训练状态文件的路径
+        Args:
+            resume: str, 训练状态文件的路径、其所在的目录、train_url/model_type下的目录名，或者last（最近修改的目录）
+        Returns:
+            resume_path: str, 训练状态文件的路径
+        """
+        if os.path.isfile(resume):
+            return resume
+        if not os.path.isdir(resume):
+            weight_path = os.path.join(self.config.train_url, self.config.model_type)
+            if resume == 'last':
+                lists = os.listdir(weight_path)  # 获得文件夹内所有文件
+                lists.sort(key=lambda fn: os.path.getmtime(weight_path + '/' + fn))  # 按照最近修改时间排序
+                resume = os.path.join(weight_path, lists[-1])
+            else:
+                resume = os.path.join(weight_path, resume)
+        return os.path.join(self.get_fold_dir(resume), self.state_name)
+
+    def get_fold_dir(self, log_dir):
+        """ train_folds.py并行训练时每一折位于<run>/fold<k>子目录中，存在时返回当前折的子目录
+        Args:
+            log_dir: str, 日志目录
+        Returns:
+            log_dir: str, 当前折的日志目录
+        """
+        fold_dir = os.path.join(log_dir, 'fold%d' % self.fold)
+        return fold_dir if os.path.isdir(fold_dir) else log_dir
 
     def validation(self, valid_loader):
-        tbar = tqdm.tqdm(valid_loader)
+        tbar = tqdm.tqdm(valid_loader, disable=not is_main_process())
         self.model.eval()
         labels_predict_all, labels_all = np.empty(shape=(0,)), np.empty(shape=(0,))
         epoch_loss = 0
@@ -240,6 +426,14 @@ class TrainVal:
                 descript = '[Valid][Loss: {:.4f}]'.format(loss)
                 tbar.set_description(desc=descript)
 
+            # 多进程训练时每个进程只验证了一部分样本，收集所有进程的预测与类标后计算指标，各个进程得到相同的结果
+            if is_distributed():
+                labels_predict_all = all_gather_array(labels_predict_all).numpy()
+                labels_all = all_gather_array(labels_all).numpy()
+                epoch_loss, batch_number = all_reduce_sum(epoch_loss), all_reduce_sum(len(tbar))
+            else:
+                batch_number = len(tbar)
+
             classify_report, my_confusion_matrix, acc_for_each_class, oa, average_accuracy, kappa = \
                 self.classification_metric.get_metric(
                     labels_all,
@@ -249,39 +443,62 @@ class TrainVal:
             if oa > self.max_accuracy_valid:
                 is_best = True
                 self.max_accuracy_valid = oa
-                self.classification_metric.draw_cm_and_save_result(
-                    classify_report,
-                    my_confusion_matrix,
-                    acc_for_each_class,
-                    oa,
-                    average_accuracy,
-                    kappa
-                )
+                if is_main_process():
+                    self.classification_metric.draw_cm_and_save_result(
+                        classify_report,
+                        my_confusion_matrix,
+                        acc_for_each_class,
+                        oa,
+                        average_accuracy,
+                        kappa
+                    )
             else:
                 is_best = False
 
-            print('OA:{}, AA:{}, Kappa:{}'.format(oa, average_accuracy, kappa))
-
-            return oa, epoch_loss / len(tbar), is_best
-
-    def init_log(self):
-        # 保存配置信息和初始化tensorboard
-        TIMESTAMP = "log-{0:%Y-%m-%dT%H-%M-%S}".format(datetime.datetime.now())
+            if is_main_process():
+                print('OA:{}, AA:{}, Kappa:{}'.format(oa, average_accuracy, kappa))
+
+            return oa, epoch_loss / batch_number, is_best
+
+    def init_log(self, resume_state=None):
+        # 保存配置信息和初始化tensorboard，恢复训练时沿用原先的目录
+        # 多进程训练时目录名与随机种子以rank 0为准，只有rank 0写日志
+        TIMESTAMP = self.config.log_name or "log-{0:%Y-%m-%dT%H-%M-%S}".format(datetime.datetime.now())
+        if resume_state is not None:
+            TIMESTAMP = resume_state['time_stamp']
+        seed = int(time.time()) if resume_state is None else resume_state['seed']
+        TIMESTAMP, seed = broadcast_object((TIMESTAMP, seed))
+        # 各个进程的batch顺序由ResumableBatchSampler以seed决定，其余的随机数（数据增强、dropout）以rank偏移
+        seed_torch(seed + get_rank())
         log_dir = os.path.join(self.config.train_url, self.config.model_type, TIMESTAMP)
+        if not is_main_process():
+            return NullWriter(), TIMESTAMP, seed
+
         writer = SummaryWriter(log_dir=log_dir)
         with codecs.open(os.path.join(log_dir, 'param.json'), 'w', "utf-8") as json_file:
-            json.dump({k: v for k, v in config._get_kwargs()}, json_file, ensure_ascii=False)
+            json.dump({k: v for k, v in self.config._get_kwargs()}, json_file, ensure_ascii=False)
+        if self.loader_params:
+            save_loader_params(log_dir, self.loader_params)
 
-        seed = int(time.time())
-        seed_torch(seed)
         with open(os.path.join(log_dir, 'seed.pkl'), 'wb') as f:
             pickle.dump({'seed': seed}, f, -1)
 
-        return writer, TIMESTAMP
+        return writer, TIMESTAMP, seed
 
 
 if __name__ == "__main__":
     config = get_classify_config()
+    # 使用torchrun启动时初始化进程组，batch_size为所有进程的总批量大小
+    if config.device == 'cuda' and not torch.cuda.is_available():
+        raise ValueError('--device cuda is specified but no GPU is available.')
+    # CPU上的多进程训练只能使用gloo后端
+    rank, world_size, local_rank = init_distributed(
+        config.dist_backend, use_cuda=config.device != 'cpu' and torch.cuda.is_available()
+    )
+    distributed = world_size > 1
+    batch_size = config.batch_size // world_size
+    if distributed and is_main_process():
+        print('Distributed training with {} processes, batch size per process: {}.'.format(world_size, batch_size))
     data_root = config.data_url
     folds_split = config.n_splits
     test_size = config.val_size
@@ -289,11 +506,25 @@ if __name__ == "__main__":
     mean = (0.485, 0.456, 0.406)
     std = (0.229, 0.224, 0.225)
     
-    if config.augmentation_flag:
+    transforms, batch_augmentation = None, None
+    if config.augmentation_flag and config.augmentation_backend == 'batch':
+        # 使用uint8传输时，batch尚未归一化
+        batch_augmentation = BatchAugmentation(
+            config.erase_prob, full_aug=True, gray_prob=config.gray_prob,
+            mean=None if config.uint8_transport else mean, std=None if config.uint8_transport else std
+        )
+    elif config.augmentation_flag:
         transforms = DataAugmentation(config.erase_prob, full_aug=True, gray_prob=config.gray_prob)
-    else:
-        transforms = None
 
+    loader_params = get_loader_params(config)
+    workers_candidates = None
+    if config.device == 'cpu':
+        # worker与模型计算共用CPU，worker数不超过计算线程之外剩余的核数；没有GPU时锁页内存没有意义
+        compute_threads, loader_params['num_workers'] = setup_cpu_threads(loader_params['num_workers'], config.cpu_threads)
+        loader_params['pin_memory'] = False
+        workers_candidates = sorted(set([0, 1, 2, 4, 8, loader_params['num_workers']]) & set(range(loader_params['num_workers'] + 1)))
+        print('CPU profile: {} compute threads, {} DataLoader workers, channels_last, oneDNN fusion: {}.'.format(
+            compute_threads, loader_params['num_workers'], 'on' if enable_onednn_fusion() else 'not supported'))
     if config.dataset_from_folder:
         train_dataloaders, val_dataloaders, train_labels_number, _ = get_dataloader_from_folder(
             data_root, 
@@ -301,8 +532,25 @@ if __name__ == "__main__":
             transforms, 
             mean, 
             std, 
-            config.batch_size, 
+            batch_size, 
             multi_scale, 
+            config.data_format,
+            multi_scale_size=config.multi_scale_size,
+            multi_scale_interval=config.multi_scale_interval,
+            multi_scale_backend=config.multi_scale_backend,
+            aspect_ratio_bucket=config.aspect_ratio_bucket,
+            bucket_ratios=config.bucket_ratios,
+            loader_params=loader_params,
+            sampler=config.sampler,
+            sampler_params=get_sampler_params(config),
+            uint8_transport=config.uint8_transport,
+            val_cache=config.val_cache,
+            val_cache_root=config.val_cache_root,
+            memory_cache_bytes=int(config.memory_cache_gb * 1024 ** 3),
+            memory_cache_size=max([config.image_size] + (config.multi_scale_size if multi_scale else []),
+                                  key=lambda size: size[0] * size[1]),
+            memory_cache_resize=config.memory_cache_resize,
+            distributed=distributed
             )
         train_dataloaders, val_dataloaders, train_labels_number_folds = [train_dataloaders], [val_dataloaders], [train_labels_number]
 
@@ -312,18 +560,58 @@ if __name__ == "__main__":
             folds_split=folds_split, 
             test_size=test_size, 
             choose_dataset=config.choose_dataset,
-            load_split_from_file=config.load_split_from_file
+            load_split_from_file=config.load_split_from_file,
+            data_format=config.data_format
+            )
+
+        image_cache = None
+        if config.image_cache:
+            cache_sizes = [config.image_size] + (config.multi_scale_size if multi_scale else [])
+            image_cache = get_dataloader.build_image_cache(config.image_cache, cache_sizes, config.image_cache_mode)
+
+        memory_cache = None
+        if config.memory_cache_gb > 0:
+            decode_size = max([config.image_size] + (config.multi_scale_size if multi_scale else []),
+                              key=lambda size: size[0] * size[1])
+            memory_cache = get_dataloader.build_memory_cache(
+                int(config.memory_cache_gb * 1024 ** 3), decode_size, config.memory_cache_resize, config.bucket_ratios
             )
 
         train_dataloaders, val_dataloaders, train_labels_number_folds, _ = get_dataloader.get_dataloader(
-            config.batch_size,
+            batch_size,
             config.image_size,
             mean, std,
             transforms=transforms,
-            multi_scale=multi_scale
+            multi_scale=multi_scale,
+            image_cache=image_cache,
+            multi_scale_size=config.multi_scale_size,
+            multi_scale_interval=config.multi_scale_interval,
+            multi_scale_backend=config.multi_scale_backend,
+            aspect_ratio_bucket=config.aspect_ratio_bucket,
+            bucket_ratios=config.bucket_ratios,
+            loader_params=loader_params,
+            sampler=config.sampler,
+            sampler_params=get_sampler_params(config),
+            memory_cache=memory_cache,
+            uint8_transport=config.uint8_transport,
+            val_cache=config.val_cache,
+            val_cache_root=config.val_cache_root,
+            distributed=distributed
+        )
+
+    if config.loader_autotune:
+        # 在第一折的训练集上调优，调优结果用于所有折的训练集与验证集
+        loader_params = autotune_loader(
+            lambda params: rebuild_dataloader(train_dataloaders[0], dict(params, pin_memory=loader_params['pin_memory'])),
+            num_batches=config.loader_autotune_batches,
+            workers_candidates=workers_candidates
         )
+        if config.device == 'cpu':
+            loader_params['pin_memory'] = False
+        train_dataloaders = [rebuild_dataloader(dataloader, loader_params) for dataloader in train_dataloaders]
+        val_dataloaders = [rebuild_dataloader(dataloader, loader_params) for dataloader in val_dataloaders]
 
     for fold_index, [train_loader, valid_loader, train_labels_number] in enumerate(zip(train_dataloaders, val_dataloaders, train_labels_number_folds)):
         if fold_index in config.selected_fold:
-            train_val = TrainVal(config, fold_index, train_labels_number)
+            train_val = TrainVal(config, fold_index, train_labels_number, loader_params, batch_augmentation)
             train_val.train(train_loader, valid_loader)
@@ -17,14 +17,20 @@ except:
 
 from config import get_classify_config
 from solver import Solver
-from utils.set_seed import seed_torch
+from utils.set_seed import seed_torch, get_rng_state, set_rng_state
+from utils.checkpoint_store import CheckpointStore
 from models.build_model import PrepareModel
 from datasets.create_dataset import GetDataloader, get_dataloader_from_folder
 from losses.get_loss import Loss
 from utils.classification_metric import ClassificationMetric
 from datasets.data_augmentation import DataAugmentation
+from datasets.batch_augmentation import BatchAugmentation
 from utils.cutmix import generate_mixed_sample
 from datasets.create_dataset import multi_scale_transforms
+from datasets.multi_scale import resize_batch
+from datasets.loader_tuning import get_loader_params, autotune_loader, rebuild_dataloader, save_loader_params
+from datasets.class_aware_sampler import get_sampler_params
+from datasets.staging import DataStager, create_store
 
 
 def prepare_data_on_modelarts(args):
@@ -34,11 +40,19 @@ def prepare_data_on_modelarts(args):
         args: 配置参数
     
     args.bucket下面有这几个文件夹：data（存放数据，包含label_id_name.json以及其他数据文件夹），project用于存放工程代码
+    Returns:
+        args: 配置参数
+        stager: DataStager, 使用args.data_staging时返回，图片在后台拷贝；否则为None
     """
     # 将数据从OBS args.data_url拷贝到args.data_local
     args.local_data_root = '/cache/'  # a directory used for transfer data between local path and OBS path
     args.data_local = os.path.join(args.local_data_root, 'combine')
-    if not os.path.exists(args.data_local):
+    stager = None
+    if args.data_staging:
+        # 只同步拷贝标注文件，已经存在于本地的文件不会重复拷贝
+        stager = DataStager(create_store(args.data_url), args.data_local, args.staging_threads)
+        stager.start()
+    elif not os.path.exists(args.data_local):
         mox.file.copy_parallel(args.data_url, args.data_local)
     else:
         print('args.data_local: %s is already exist, skip copy' % args.data_local)
@@ -69,19 +83,26 @@ def prepare_data_on_modelarts(args):
     if not os.path.exists(args.tmp):
         os.mkdir(args.tmp)
 
-    return args
+    # 验证集缓存放在本地磁盘上
+    args.val_cache_root = os.path.join(args.local_data_root, 'val_cache')
+
+    return args, stager
 
 
 class TrainVal:
-    def __init__(self, config, fold, train_labels_number):
+    def __init__(self, config, fold, train_labels_number, loader_params=None, batch_augmentation=None):
         """
         Args:
             config: 配置参数
             fold: int, 当前为第几折
             train_labels_number: list, 某一折的[number_class0, number__class1, ...]
+            loader_params: dict, 本次训练使用的DataLoader参数，保存在param.json旁，供之后的训练通过--loader_params复用
+            batch_augmentation: BatchAugmentation, 不为None时在训练设备上对整个batch进行数据增强
         """
         self.config = config
         self.fold = fold
+        self.loader_params = loader_params
+        self.batch_augmentation = batch_augmentation
         self.epoch = config.epoch
         self.num_classes = config.num_classes
         self.lr_scheduler = config.lr_scheduler
@@ -90,15 +111,23 @@ class TrainVal:
         self.cutmix_prob = config.cutmix_prob
         self.train_url = config.train_url
         self.bucket_name = config.bucket_name
+        self.snapshot_interval = config.snapshot_interval
+        self.accumulation_steps = config.accumulation_steps
+        self.log_interval = config.log_interval
 
         self.image_size = config.image_size
         self.multi_scale = config.multi_scale
         self.multi_scale_size = config.multi_scale_size
         self.multi_scale_interval = config.multi_scale_interval
+        self.multi_scale_backend = config.multi_scale_backend
+        self.uint8_transport = config.uint8_transport
         if self.cut_mix:
             print('Using cut mix.')
         if self.multi_scale:
             print('Using multi scale training.')
+        if self.accumulation_steps > 1:
+            print('Accumulating gradients over {} batches, effective batch size: {}.'.format(
+                self.accumulation_steps, self.accumulation_steps * config.batch_size))
         print('USE LOSS: {}'.format(config.loss_name))
 
         # 拷贝预训练权重
@@ -151,7 +180,10 @@ class TrainVal:
 
         # 实例化实现各种子函数的 solver 类
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        self.solver = Solver(self.model, self.device)
+        self.solver = Solver(self.model, self.device, amp=config.amp, checkpoint_queue_size=config.checkpoint_queue_size,
+                             archive_dtype=config.archive_dtype)
+        if config.amp != 'none':
+            print('Using {} mixed precision training.'.format(self.solver.amp))
         if config.restore:
             weight_path = os.path.join('checkpoints', config.model_type)
             if config.restore == 'last':
@@ -162,9 +194,24 @@ class TrainVal:
                 weight_path = os.path.join(weight_path, config.restore, 'model_best.pth')
             self.solver.load_checkpoint(weight_path)
 
-        # log初始化
-        self.writer, self.time_stamp = self.init_log()
+        # 恢复完整的训练状态（模型、优化器、学习率衰减策略、epoch与batch、随机数状态），训练状态保存在OBS上
+        self.state_name = '%s_fold%d_state.pth' % (config.model_type, fold)
+        resume_state = None
+        if config.resume:
+            resume_path = self.get_resume_path(config.resume)
+            if mox.file.exists(resume_path):
+                local_resume_path = os.path.join(config.train_local, self.state_name)
+                mox.file.copy(resume_path, local_resume_path)
+                resume_state = self.solver.load_training_state(local_resume_path, self.optimizer, self.exp_lr_scheduler)
+            else:
+                print('Can not find training state in {}, train fold {} from scratch.'.format(resume_path, fold))
+
+        # log初始化，恢复训练时沿用原先的目录名与随机种子
+        self.writer, self.time_stamp, self.seed = self.init_log(resume_state)
         self.model_path = os.path.join(self.config.train_local, self.config.model_type, self.time_stamp)
+        if config.checkpoint_store:
+            # blob目录位于本次训练的目录中，随model_best一起复制到OBS，部署时与manifest位于同一个目录下
+            self.solver.checkpoint_store = CheckpointStore(os.path.join(self.model_path, 'blobs'))
 
         # 初始化分类度量准则类
         with open(config.local_data_root+'label_id_name.json', 'r', encoding='utf-8') as json_file:
@@ -172,6 +219,14 @@ class TrainVal:
         self.classification_metric = ClassificationMetric(self.class_names, self.model_path, text_flag=0)
 
         self.max_accuracy_valid = 0
+        self.start_epoch, self.start_batch, self.global_step = 0, 0, 0
+        self.epoch_stats = (0, 0)
+        if resume_state is not None:
+            self.max_accuracy_valid = resume_state['max_score']
+            self.start_epoch, self.start_batch = resume_state['epoch'], resume_state['batch']
+            self.global_step, self.epoch_stats = resume_state['global_step'], resume_state['epoch_stats']
+            self.criterion.log_sum = resume_state['loss_log_sum']
+            set_rng_state(resume_state['rng_state'])
 
     def train(self, train_loader, valid_loader):
         """ 完成模型的训练，保存模型与日志
@@ -179,19 +234,41 @@ class TrainVal:
             train_loader: 训练数据的DataLoader
             valid_loader: 验证数据的Dataloader
         """
-        global_step = 0
-        for epoch in range(self.epoch):
+        global_step = self.global_step
+        # ResumableBatchSampler（使用stager时为包装它的StagingBatchSampler，转发seed与set_epoch），
+        # 每个epoch的batch顺序只由随机种子与epoch决定
+        train_sampler = train_loader.batch_sampler
+        train_sampler.seed = self.seed
+        last_snapshot_time = time.time()
+        for epoch in range(self.start_epoch, self.epoch):
             self.model.train()
+            start_batch = self.start_batch if epoch == self.start_epoch else 0
+            train_sampler.set_epoch(epoch, start_batch)
             epoch += 1
-            images_number, epoch_corrects = 0, 0
-
-            tbar = tqdm.tqdm(train_loader)
+            images_number, epoch_corrects = self.epoch_stats if start_batch else (0, 0)
+
+            tbar = tqdm.tqdm(train_loader, initial=start_batch)
+            # 统计吞吐量与峰值显存/内存
+            self.solver.reset_peak_memory()
+            epoch_start_time, start_images_number = time.time(), images_number
+            # 两次日志之间的正确数与样本数，正确数保留在设备上
+            interval_corrects, interval_images = 0, 0
+            self.criterion.reset_loss_iteration()
             image_size = self.image_size
-            for i, (_, images, labels) in enumerate(tbar):
-                if self.multi_scale:
+            for i, (_, images, labels) in enumerate(tbar, start_batch):
+                if self.multi_scale and self.multi_scale_backend == 'main':
                     if i % self.multi_scale_interval == 0:
                         image_size = random.choice(self.multi_scale_size)
-                    images = multi_scale_transforms(image_size, images)
+                    if self.uint8_transport:
+                        # uint8的batch，整体插值后仍为uint8，由Solver.forward归一化
+                        images = resize_batch(images, image_size)
+                    else:
+                        images = multi_scale_transforms(image_size, images)
+                else:
+                    # 尺度已由MultiScaleBatchSampler或AspectRatioBucketBatchSampler选择，并在DataLoader的worker中完成缩放
+                    image_size = list(images.shape[-2:])
+                if self.batch_augmentation is not None:
+                    images = self.batch_augmentation(images.to(self.device))
                 if self.cut_mix:
                     # 使用cut_mix
                     r = np.random.rand(1)
@@ -207,38 +284,61 @@ class TrainVal:
                     # 网络的前向传播
                     labels_predict = self.solver.forward(images)
                     loss = self.solver.cal_loss(labels_predict, labels, self.criterion)
-                self.solver.backword(self.optimizer, loss)
+                # 梯度累积：每accumulation_steps个batch更新一次参数，epoch的最后一组不足accumulation_steps个batch时同样更新
+                group_start = i - i % self.accumulation_steps
+                group_size = min(self.accumulation_steps, len(train_loader) - group_start)
+                optimizer_step = i + 1 == group_start + group_size
+                self.solver.backword(self.optimizer, loss, group_size, optimizer_step)
 
+                corrects = self.model.module.get_classify_result(labels_predict, labels, self.device).sum()
                 images_number += images.size(0)
-                epoch_corrects += self.model.module.get_classify_result(labels_predict, labels, self.device).sum()
-                train_acc_iteration = self.model.module.get_classify_result(labels_predict, labels, self.device).mean()
-
-                # 保存到tensorboard，每一步存储一个
-                descript = self.criterion.record_loss_iteration(self.writer.add_scalar, global_step + i)
-                self.writer.add_scalar('TrainAccIteration', train_acc_iteration, global_step + i)
-
-                params_groups_lr = str()
-                for group_ind, param_group in enumerate(self.optimizer.param_groups):
-                    params_groups_lr = params_groups_lr + 'pg_%d' % group_ind + ': %.8f, ' % param_group['lr']
-
-                descript = '[Train Fold {}][epoch: {}/{}][image_size: {}][Lr :{}][Acc: {:.4f}]'.format(
-                    self.fold,
-                    epoch,
-                    self.epoch,
-                    image_size,
-                    params_groups_lr,
-                    train_acc_iteration
-                ) + descript
-
-                # 对于 CyclicLR，要每一步均执行依次学习率衰减
-                if self.lr_scheduler == 'CyclicLR':
+                epoch_corrects += corrects
+                interval_corrects += corrects
+                interval_images += images.size(0)
+
+                # 对于 CyclicLR，要每一次参数更新均执行依次学习率衰减
+                if self.lr_scheduler == 'CyclicLR' and optimizer_step:
                     self.exp_lr_scheduler.step()
-                    self.writer.add_scalar('Lr', self.optimizer.param_groups[1]['lr'], global_step + i)
 
-                tbar.set_description(desc=descript)
+                # 每log_interval个batch（以及每个epoch的最后一个batch）读取一次设备上的统计量并保存到tensorboard，
+                # 记录的是这些batch的平均准确率与平均损失，log_interval为1时与逐步记录相同
+                if (i + 1) % self.log_interval == 0 or i + 1 == len(train_loader):
+                    train_acc_iteration = (interval_corrects / interval_images).item()
+                    interval_corrects, interval_images = 0, 0
+                    descript = self.criterion.record_loss_iteration(self.writer.add_scalar, global_step + i)
+                    self.writer.add_scalar('TrainAccIteration', train_acc_iteration, global_step + i)
+                    if self.lr_scheduler == 'CyclicLR':
+                        self.writer.add_scalar('Lr', self.optimizer.param_groups[1]['lr'], global_step + i)
+
+                    params_groups_lr = str()
+                    for group_ind, param_group in enumerate(self.optimizer.param_groups):
+                        params_groups_lr = params_groups_lr + 'pg_%d' % group_ind + ': %.8f, ' % param_group['lr']
+
+                    descript = '[Train Fold {}][epoch: {}/{}][image_size: {}][Lr :{}][Acc: {:.4f}]'.format(
+                        self.fold,
+                        epoch,
+                        self.epoch,
+                        image_size,
+                        params_groups_lr,
+                        train_acc_iteration
+                    ) + descript
+                    tbar.set_description(desc=descript)
+
+                # 定期保存训练状态，训练作业被中断后从下一个未训练的batch恢复
+                # 累积中的梯度不在训练状态中，只在参数更新之后保存
+                if optimizer_step and self.snapshot_interval > 0 and \
+                        time.time() - last_snapshot_time > self.snapshot_interval * 60:
+                    self.save_training_state(epoch - 1, i + 1, global_step, (images_number, int(epoch_corrects)))
+                    last_snapshot_time = time.time()
 
             # 写到tensorboard中
             epoch_acc = epoch_corrects / images_number
+            epoch_time = time.time() - epoch_start_time
+            images_per_second = (images_number - start_images_number) / epoch_time
+            step_time = epoch_time / max(len(train_loader) - start_batch, 1) * 1000
+            peak_memory = self.solver.get_peak_memory()
+            self.writer.add_scalar('TrainImagesPerSecond', images_per_second, epoch)
+            self.writer.add_scalar('PeakMemoryMB', peak_memory, epoch)
             self.writer.add_scalar('TrainAccEpoch', epoch_acc, epoch)
             if self.lr_scheduler != 'CyclicLR':
                 self.writer.add_scalar('Lr', self.optimizer.param_groups[1]['lr'], epoch)
@@ -246,6 +346,12 @@ class TrainVal:
 
             # Print the log info
             print('[Finish epoch: {}/{}][Average Acc: {:.4}]'.format(epoch, self.epoch, epoch_acc) + descript)
+            print('[Precision: {}][Throughput: {:.1f} images/s][Step time: {:.1f}ms][Peak memory: {:.0f}MB]'.format(
+                self.solver.amp, images_per_second, step_time, peak_memory))
+            memory_cache = getattr(train_loader.dataset, 'memory_cache', None)
+            if memory_cache is not None:
+                print(memory_cache.format_stats())
+                self.writer.add_scalar('MemoryCacheHitRate', memory_cache.get_stats()['hit_rate'], epoch)
 
             # 验证模型
             val_accuracy, val_loss, is_best = self.validation(valid_loader)
@@ -277,8 +383,52 @@ class TrainVal:
             elif self.lr_scheduler != 'CyclicLR':
                 self.exp_lr_scheduler.step()
             global_step += len(train_loader)
+
+            # 每一个epoch完毕之后保存训练状态，恢复时从下一个epoch开始
+            self.save_training_state(epoch, 0, global_step, (0, 0))
+            last_snapshot_time = time.time()
+        # 等待后台保存的权重全部写完
+        self.solver.wait_checkpoints()
         print('BEST ACC:{}'.format(self.max_accuracy_valid))
 
+    def save_training_state(self, epoch, batch, global_step, epoch_stats):
+        """ 保存完整的训练状态，并复制到OBS
+        Args:
+            epoch: int, 从0开始计数，恢复时从该epoch继续
+            batch: int, 恢复时从该epoch的第几个batch继续
+            global_step: int, 该epoch开始时的全局step
+            epoch_stats: tuple, (images_number, epoch_corrects), 该epoch已经统计的样本数与正确数
+        """
+        state = {
+            'epoch': epoch,
+            'batch': batch,
+            'global_step': global_step,
+            'epoch_stats': epoch_stats,
+            'state_dict': self.model.module.state_dict(),
+            'optimizer': self.optimizer.state_dict(),
+            'lr_scheduler': self.exp_lr_scheduler.state_dict(),
+            'max_score': self.max_accuracy_valid,
+            'loss_log_sum': self.criterion.log_sum,
+            'time_stamp': self.time_stamp,
+            'seed': self.seed,
+            'rng_state': get_rng_state(),
+            'grad_scaler': self.solver.scaler.state_dict() if self.solver.scaler is not None else None
+        }
+        save_path = os.path.join(self.model_path, self.state_name)
+        obs_path = os.path.join(self.bucket_name, self.config.model_snapshots_name, 'model', self.state_name)
+        self.solver.save_training_state(save_path, state, callback=lambda: mox.file.copy(save_path, obs_path))
+
+    def get_resume_path(self, resume):
+        """ 得到OBS上训练状态文件的路径
+        Args:
+            resume: str, 训练状态文件的路径，或者last（上一次训练复制到model_snapshots_name/model下的训练状态）
+        Returns:
+            resume_path: str, 训练状态文件的路径
+        """
+        if resume == 'last':
+            return os.path.join(self.bucket_name, self.config.model_snapshots_name, 'model', self.state_name)
+        return resume
+
     def validation(self, valid_loader):
         tbar = tqdm.tqdm(valid_loader)
         self.model.eval()
@@ -327,20 +477,24 @@ class TrainVal:
 
             return oa, epoch_loss / len(tbar), is_best
 
-    def init_log(self):
-        # 保存配置信息和初始化tensorboard
+    def init_log(self, resume_state=None):
+        # 保存配置信息和初始化tensorboard，恢复训练时沿用原先的目录名
         TIMESTAMP = "log-{0:%Y-%m-%dT%H-%M-%S}".format(datetime.datetime.now())
+        if resume_state is not None:
+            TIMESTAMP = resume_state['time_stamp']
         log_dir = os.path.join(self.config.train_local, self.config.model_type, TIMESTAMP)
         writer = SummaryWriter(log_dir=log_dir)
         with codecs.open(os.path.join(log_dir, 'param.json'), 'w', "utf-8") as json_file:
-            json.dump({k: v for k, v in config._get_kwargs()}, json_file, ensure_ascii=False)
+            json.dump({k: v for k, v in self.config._get_kwargs()}, json_file, ensure_ascii=False)
+        if self.loader_params:
+            save_loader_params(log_dir, self.loader_params)
 
-        seed = int(time.time())
+        seed = int(time.time()) if resume_state is None else resume_state['seed']
         seed_torch(seed)
         with open(os.path.join(log_dir, 'seed.pkl'), 'wb') as f:
             pickle.dump({'seed': seed}, f, -1)
 
-        return writer, TIMESTAMP
+        return writer, TIMESTAMP, seed
 
 
 if __name__ == "__main__":
@@ -352,13 +506,23 @@ if __name__ == "__main__":
     mean = (0.485, 0.456, 0.406)
     std = (0.229, 0.224, 0.225)
 
-    config = prepare_data_on_modelarts(config)
-
-    if config.augmentation_flag:
+    config, stager = prepare_data_on_modelarts(config)
+    if stager is not None and (config.data_format == 'shard' or config.image_cache):
+        # 分片文件与图片缓存的构建需要完整的数据集
+        print('Waiting for data staging to finish...')
+        stager.wait()
+
+    transforms, batch_augmentation = None, None
+    if config.augmentation_flag and config.augmentation_backend == 'batch':
+        # 使用uint8传输时，batch尚未归一化
+        batch_augmentation = BatchAugmentation(
+            config.erase_prob, full_aug=True, gray_prob=config.gray_prob,
+            mean=None if config.uint8_transport else mean, std=None if config.uint8_transport else std
+        )
+    elif config.augmentation_flag:
         transforms = DataAugmentation(config.erase_prob, full_aug=True, gray_prob=config.gray_prob)
-    else:
-        transforms = None
 
+    loader_params = get_loader_params(config)
     if config.dataset_from_folder:
         train_dataloaders, val_dataloaders, train_labels_number, _ = get_dataloader_from_folder(
             config.data_local, 
@@ -368,6 +532,23 @@ if __name__ == "__main__":
             std, 
             config.batch_size, 
             multi_scale, 
+            config.data_format,
+            multi_scale_size=config.multi_scale_size,
+            multi_scale_interval=config.multi_scale_interval,
+            multi_scale_backend=config.multi_scale_backend,
+            aspect_ratio_bucket=config.aspect_ratio_bucket,
+            bucket_ratios=config.bucket_ratios,
+            loader_params=loader_params,
+            sampler=config.sampler,
+            sampler_params=get_sampler_params(config),
+            uint8_transport=config.uint8_transport,
+            val_cache=config.val_cache,
+            val_cache_root=config.val_cache_root,
+            memory_cache_bytes=int(config.memory_cache_gb * 1024 ** 3),
+            memory_cache_size=max([config.image_size] + (config.multi_scale_size if multi_scale else []),
+                                  key=lambda size: size[0] * size[1]),
+            memory_cache_resize=config.memory_cache_resize,
+            stager=stager
             )
         train_dataloaders, val_dataloaders, train_labels_number_folds = [train_dataloaders], [val_dataloaders], [train_labels_number]
     else:
@@ -377,19 +558,56 @@ if __name__ == "__main__":
             test_size=test_size,
             label_names_path=config.local_data_root+'label_id_name.json',
             choose_dataset=config.choose_dataset,
-            load_split_from_file=config.load_split_from_file
+            load_split_from_file=config.load_split_from_file,
+            data_format=config.data_format,
+            stager=stager
         )
 
+        image_cache = None
+        if config.image_cache:
+            cache_sizes = [config.image_size] + (config.multi_scale_size if multi_scale else [])
+            image_cache = get_dataloader.build_image_cache(config.image_cache, cache_sizes, config.image_cache_mode)
+
+        memory_cache = None
+        if config.memory_cache_gb > 0:
+            decode_size = max([config.image_size] + (config.multi_scale_size if multi_scale else []),
+                              key=lambda size: size[0] * size[1])
+            memory_cache = get_dataloader.build_memory_cache(
+                int(config.memory_cache_gb * 1024 ** 3), decode_size, config.memory_cache_resize, config.bucket_ratios
+            )
+
         train_dataloaders, val_dataloaders, train_labels_number_folds, _ = get_dataloader.get_dataloader(
             config.batch_size,
             config.image_size,
             mean, std,
             transforms=transforms,
             multi_scale=multi_scale,
-            draw_distribution=False
+            image_cache=image_cache,
+            multi_scale_size=config.multi_scale_size,
+            multi_scale_interval=config.multi_scale_interval,
+            multi_scale_backend=config.multi_scale_backend,
+            aspect_ratio_bucket=config.aspect_ratio_bucket,
+            bucket_ratios=config.bucket_ratios,
+            draw_distribution=False,
+            loader_params=loader_params,
+            memory_cache=memory_cache,
+            sampler=config.sampler,
+            sampler_params=get_sampler_params(config),
+            uint8_transport=config.uint8_transport,
+            val_cache=config.val_cache,
+            val_cache_root=config.val_cache_root
+        )
+
+    if config.loader_autotune:
+        # 在第一折的训练集上调优，调优结果用于所有折的训练集与验证集
+        loader_params = autotune_loader(
+            lambda params: rebuild_dataloader(train_dataloaders[0], params),
+            num_batches=config.loader_autotune_batches
         )
+        train_dataloaders = [rebuild_dataloader(dataloader, loader_params) for dataloader in train_dataloaders]
+        val_dataloaders = [rebuild_dataloader(dataloader, loader_params) for dataloader in val_dataloaders]
 
     for fold_index, [train_loader, valid_loader, train_labels_number] in enumerate(zip(train_dataloaders, val_dataloaders, train_labels_number_folds)):
         if fold_index in config.selected_fold:
-            train_val = TrainVal(config, fold_index, train_labels_number)
+            train_val = TrainVal(config, fold_index, train_labels_number, loader_params, batch_augmentation)
             train_val.train(train_loader, valid_loader)
@@ -0,0 +1,299 @@
+'''
+该文件的功能：在多个进程中并行训练k折交叉验证的各个折
+
+train_classifier.py在一个进程中依次训练config.selected_fold中的各个折；本脚本为每一折启动一个train_classifier.py进程，
+同时最多运行--parallel个，每个进程占用一个资源槽：
+    1. 可用的CPU按顺序平均划分到各个槽，进程（及其DataLoader的worker）绑定到所在槽的CPU上，
+       OMP_NUM_THREADS/MKL_NUM_THREADS为--threads_per_fold（默认为槽内的CPU数），避免各折的计算线程互相争抢；
+    2. 指定--gpus时，各个槽轮流使用其中的一块GPU（CUDA_VISIBLE_DEVICES）；
+    3. 所有折写入同一个目录<train_url>/<model_type>/<run>/fold<k>，tensorboard --logdir <run>可以同时查看所有折；
+    4. 各折的输出加上[fold k]前缀汇总到同一个终端，tqdm的进度条每--progress_interval秒输出一次，完整的输出保存在<run>/fold<k>.log；
+    5. 全部结束后收集各折的model_best与classes_acc.json，写入<run>/summary.json，各类别在所有折上的平均准确率写入<run>/classes_acc.json。
+除本脚本自己的参数外，其余参数原样传给train_classifier.py，例如：
+    python train_folds.py --parallel 5 --selected_fold [0,1,2,3,4] --image_size 224 224 --batch_size 24
+--restore last与--resume last在启动前解析为具体的目录，恢复训练时沿用该目录
+'''
+import os
+import sys
+import json
+import time
+import codecs
+import datetime
+import argparse
+import threading
+import subprocess
+
+from config import get_classify_config
+
+
+def get_scheduler_config():
+    parser = argparse.ArgumentParser(description='Train the selected folds in parallel processes, '
+                                                 'the other arguments are passed to train_classifier.py.')
+    parser.add_argument('--parallel', type=int, default=0,
+                        help='number of folds trained at the same time, 0 means all selected folds.')
+    parser.add_argument('--cpus', type=str, default='',
+                        help='comma separated cpu ids shared by the folds, e.g. 0-31,64-95. Empty means the cpus of this process.')
+    parser.add_argument('--threads_per_fold', type=int, default=0,
+                        help='OMP/MKL threads of each fold, 0 means the number of cpus in its slot.')
+    parser.add_argument('--num_workers_per_fold', type=int, default=0,
+                        help='overrides --num_workers of each fold when greater than 0.')
+    parser.add_argument('--gpus', type=str, default='',
+                        help='comma separated gpu ids assigned to the slots in turn. Empty leaves CUDA_VISIBLE_DEVICES unchanged.')
+    parser.add_argument('--progress_interval', type=float, default=30,
+                        help='seconds between two progress bar lines printed for each fold.')
+    return parser.parse_known_args()
+
+
+def parse_id_list(ids):
+    """ 解析形如0-3,8,10-11的序号列表
+
+    Args:
+        ids: str
+    Returns:
+        id_list: list, [0, 1, 2, 3, 8, 10, 11]
+    """
+    id_list = []
+    for part in filter(None, ids.split(',')):
+        start, _, end = part.partition('-')
+        id_list.extend(range(int(start), int(end or start) + 1))
+    return id_list
+
+
+def split_slots(cpus, slot_number):
+    """ 将CPU按顺序平均划分为slot_number个槽，相邻的CPU（一般位于同一个物理CPU上）划分到同一个槽
+
+    Args:
+        cpus: list, CPU序号
+        slot_number: int, 槽的个数
+    Returns:
+        slots: list, 每一个数据均为一个槽的CPU序号列表
+    """
+    if len(cpus) < slot_number:
+        # CPU少于槽数时各个槽共享所有CPU
+        return [cpus] * slot_number
+    size, remainder = divmod(len(cpus), slot_number)
+    slots, start = [], 0
+    for index in range(slot_number):
+        end = start + size + (1 if index < remainder else 0)
+        slots.append(cpus[start:end])
+        start = end
+    return slots
+
+
+def replace_argument(args, name, value=None):
+    """ 从命令行参数中删除name（--name value与--name=value两种形式），value不为None时以新的值追加在末尾
+
+    Args:
+        args: list, 命令行参数
+        name: str, 例如--selected_fold
+        value: str, 新的值
+    Returns:
+        args: list, 新的命令行参数
+    """
+    new_args, skip = [], False
+    for arg in args:
+        if skip:
+            skip = False
+            continue
+        if arg == name:
+            skip = True
+            continue
+        if arg.startswith(name + '='):
+            continue
+        new_args.append(arg)
+    if value is not None:
+        new_args += [name, value]
+    return new_args
+
+
+def get_last_dir(weight_path):
+    """ 与TrainVal中--restore last、--resume last相同，得到最近修改的目录名
+    """
+    lists = os.listdir(weight_path)  # 获得文件夹内所有文件
+    lists.sort(key=lambda fn: os.path.getmtime(weight_path + '/' + fn))  # 按照最近修改时间排序
+    return lists[-1]
+
+
+class FoldProcess:
+    def __init__(self, fold, command, env, cpus, log_path, progress_interval, print_lock):
+        """
+        Args:
+            fold: int, 训练的折
+            command: list, train_classifier.py的命令
+            env: dict, 环境变量
+            cpus: list, 绑定的CPU序号
+            log_path: str, 保存完整输出的文件
+            progress_interval: float, 两次输出该折进度条的最小间隔（秒）
+            print_lock: threading.Lock, 各折共用的输出锁
+        """
+        self.fold = fold
+        self.progress_interval = progress_interval
+        self.print_lock = print_lock
+        self.start_time = time.time()
+        self.log_file = open(log_path, 'wb')
+        preexec_fn = (lambda: os.sched_setaffinity(0, cpus)) if cpus and hasattr(os, 'sched_setaffinity') else None
+        self.process = subprocess.Popen(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                        preexec_fn=preexec_fn)
+        self.thread = threading.Thread(target=self._stream, daemon=True)
+        self.thread.start()
+
+    def _stream(self):
+        # tqdm以\r刷新进度条，按\r与\n切分输出；\n结尾的行全部输出，\r结尾的进度条按照progress_interval限制输出频率
+        buffer, last_progress_time = b'', 0
+        for chunk in iter(lambda: self.process.stdout.read1(65536), b''):
+            self.log_file.write(chunk)
+            buffer += chunk
+            while True:
+                positions = [position for position in (buffer.find(b'\n'), buffer.find(b'\r')) if position >= 0]
+                if not positions:
+                    break
+                position = min(positions)
+                line, separator, buffer = buffer[:position], buffer[position:position + 1], buffer[position + 1:]
+                line = line.decode('utf-8', 'replace').strip()
+                if not line:
+                    continue
+                if separator == b'\r':
+                    if time.time() - last_progress_time < self.progress_interval:
+                        continue
+                    last_progress_time = time.time()
+                self.print(line)
+        if buffer.strip():
+            self.print(buffer.decode('utf-8', 'replace').strip())
+        self.log_file.close()
+
+    def print(self, line):
+        with self.print_lock:
+            print('[fold %d] %s' % (self.fold, line), flush=True)
+
+    def poll(self):
+        return self.process.poll()
+
+    def wait(self):
+        returncode = self.process.wait()
+        self.thread.join()
+        return returncode
+
+    def terminate(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+
+
+def collect_summary(run_dir, folds, returncodes, elapsed):
+    """ 收集各折的最优权重与各类别的准确率
+
+    Args:
+        run_dir: str, 本次并行训练的目录
+        folds: list, 训练的折
+        returncodes: dict, {fold: 进程的返回值}
+        elapsed: dict, {fold: 训练用时（秒）}
+    Returns:
+        summary: dict, 同时保存为<run_dir>/summary.json
+    """
+    summary, classes_acc_folds = {'folds': {}}, []
+    for fold in folds:
+        fold_dir = os.path.join(run_dir, 'fold%d' % fold)
+        fold_summary = {'returncode': returncodes.get(fold), 'seconds': round(elapsed.get(fold, 0), 1),
+                        'log_dir': fold_dir, 'checkpoint': None, 'OA': None, 'AA': None, 'kappa': None, 'classes_acc': None}
+        for name in ('model_best.pth', 'model_best.json'):
+            if os.path.isfile(os.path.join(fold_dir, name)):
+                fold_summary['checkpoint'] = os.path.join(fold_dir, name)
+        result_path = os.path.join(fold_dir, 'result.json')
+        if os.path.isfile(result_path):
+            with codecs.open(result_path, 'r', 'utf-8') as json_file:
+                result = json.load(json_file)
+            fold_summary.update({key: result[key] for key in ('OA', 'AA', 'kappa')})
+        classes_acc_path = os.path.join(fold_dir, 'classes_acc.json')
+        if os.path.isfile(classes_acc_path):
+            with codecs.open(classes_acc_path, 'r', 'utf-8') as json_file:
+                fold_summary['classes_acc'] = json.load(json_file)
+            classes_acc_folds.append(fold_summary['classes_acc'])
+        summary['folds'][fold] = fold_summary
+
+    scores = [fold_summary['OA'] for fold_summary in summary['folds'].values() if fold_summary['OA'] is not None]
+    summary['mean_OA'] = sum(scores) / len(scores) if scores else None
+    if classes_acc_folds:
+        classes_acc = {name: sum(each[name] for each in classes_acc_folds) / len(classes_acc_folds)
+                       for name in classes_acc_folds[0]}
+        with codecs.open(os.path.join(run_dir, 'classes_acc.json'), 'w', 'utf-8') as json_file:
+            json.dump(classes_acc, json_file, ensure_ascii=False)
+    with codecs.open(os.path.join(run_dir, 'summary.json'), 'w', 'utf-8') as json_file:
+        json.dump(summary, json_file, ensure_ascii=False, indent=2)
+    return summary
+
+
+def main():
+    scheduler_config, train_args = get_scheduler_config()
+    config = get_classify_config(train_args)
+    folds = list(config.selected_fold)
+    slot_number = min(scheduler_config.parallel or len(folds), len(folds))
+
+    # 在启动任何一折之前解析last，避免与新创建的目录混淆；恢复训练时沿用原先的目录
+    run_name = 'log-{0:%Y-%m-%dT%H-%M-%S}'.format(datetime.datetime.now())
+    if config.restore == 'last':
+        train_args = replace_argument(train_args, '--restore', get_last_dir(os.path.join('checkpoints', config.model_type)))
+    if config.resume:
+        resume = config.resume
+        if resume == 'last':
+            resume = get_last_dir(os.path.join(config.train_url, config.model_type))
+            train_args = replace_argument(train_args, '--resume', resume)
+        if os.path.isdir(resume):
+            run_name = os.path.basename(os.path.normpath(resume))
+        elif not os.path.isfile(resume):
+            run_name = resume
+    run_dir = os.path.join(config.train_url, config.model_type, run_name)
+    os.makedirs(run_dir, exist_ok=True)
+
+    cpus = parse_id_list(scheduler_config.cpus) if scheduler_config.cpus else \
+        sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    slots = split_slots(cpus, slot_number)
+    gpus = parse_id_list(scheduler_config.gpus)
+    print('Training folds {} in {}, {} at a time.'.format(folds, run_dir, slot_number))
+
+    print_lock = threading.Lock()
+    pending, running, returncodes, elapsed = list(folds), {}, {}, {}
+    free_slots = list(range(slot_number))
+    try:
+        while pending or running:
+            while pending and free_slots:
+                fold, slot = pending.pop(0), free_slots.pop(0)
+                threads = scheduler_config.threads_per_fold or len(slots[slot])
+                env = dict(os.environ, PYTHONUNBUFFERED='1', OMP_NUM_THREADS=str(threads), MKL_NUM_THREADS=str(threads))
+                if gpus:
+                    env['CUDA_VISIBLE_DEVICES'] = str(gpus[slot % len(gpus)])
+                args = replace_argument(train_args, '--selected_fold', '[%d]' % fold)
+                args = replace_argument(args, '--log_name', os.path.join(run_name, 'fold%d' % fold))
+                if scheduler_config.num_workers_per_fold > 0:
+                    args = replace_argument(args, '--num_workers', str(scheduler_config.num_workers_per_fold))
+                command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'train_classifier.py')] + args
+                with print_lock:
+                    print('[fold {}] start on cpus {}-{} ({} threads){}'.format(
+                        fold, slots[slot][0], slots[slot][-1], threads,
+                        ', gpu %s' % env['CUDA_VISIBLE_DEVICES'] if gpus else ''), flush=True)
+                running[fold] = (FoldProcess(fold, command, env, slots[slot], os.path.join(run_dir, 'fold%d.log' % fold),
+                                             scheduler_config.progress_interval, print_lock), slot)
+            time.sleep(1)
+            for fold, (fold_process, slot) in list(running.items()):
+                if fold_process.poll() is not None:
+                    returncodes[fold] = fold_process.wait()
+                    elapsed[fold] = time.time() - fold_process.start_time
+                    fold_process.print('finished with return code {} in {:.1f} minutes'.format(
+                        returncodes[fold], elapsed[fold] / 60))
+                    del running[fold]
+                    free_slots.append(slot)
+    except KeyboardInterrupt:
+        for fold_process, _ in running.values():
+            fold_process.terminate()
+        for fold, (fold_process, _) in running.items():
+            returncodes[fold] = fold_process.wait()
+        raise
+
+    summary = collect_summary(run_dir, folds, returncodes, elapsed)
+    for fold, fold_summary in summary['folds'].items():
+        print('[fold {}] return code: {}, OA: {}, checkpoint: {}'.format(
+            fold, fold_summary['returncode'], fold_summary['OA'], fold_summary['checkpoint']))
+    print('Mean OA: {}, summary saved to {}'.format(summary['mean_OA'], os.path.join(run_dir, 'summary.json')))
+    return 0 if all(returncode == 0 for returncode in returncodes.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+'''
+该文件的功能：在后台线程中保存权重，训练循环不再等待torch.save写完几百MB的文件
+
+提交时先将state中的所有tensor复制到CPU（之后训练继续修改参数也不会影响已提交的快照），再由后台线程按照提交顺序依次序列化：
+    1. 写入临时文件，完成后通过os.replace原子地替换目标文件，任何时刻目标文件要么是旧的、要么是完整的新文件；
+    2. 需要保存model_best时，以硬链接（或者重命名）代替再写一次文件；
+    3. 队列有上限，后台线程来不及写入时submit阻塞，避免CPU上堆积过多的快照
+'''
+import os
+import time
+import queue
+import threading
+import numpy as np
+import torch
+
+
+def snapshot_to_cpu(obj):
+    """ 将state中的tensor复制到CPU，dict/list/tuple递归处理
+
+    Args:
+        obj: state，例如{'state_dict': ..., 'optimizer': ...}
+    Returns:
+        snapshot: 与obj结构相同，其中的tensor均为CPU上的拷贝
+    """
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, np.ndarray):
+        return obj.copy()
+    if isinstance(obj, dict):
+        return type(obj)((key, snapshot_to_cpu(value)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot_to_cpu(value) for value in obj)
+    return obj
+
+
+def publish(save_path, state, best_path=None, move=False, save_function=None):
+    """ 原子地保存state，并发布model_best
+
+    Args:
+        save_path: str, 保存路径
+        state: dict, 要保存的内容
+        best_path: str, 不为None时同时发布为该路径（model_best.pth）
+        move: bool, 为True时将save_path重命名为best_path（之后save_path不存在），否则创建硬链接
+        save_function: callable, save_function(state, path)，为None时使用torch.save，例如CheckpointStore.save
+    """
+    save_function = save_function or torch.save
+    save_function(state, save_path + '.tmp')
+    os.replace(save_path + '.tmp', save_path)
+    if best_path is None:
+        return
+    if move:
+        os.replace(save_path, best_path)
+        return
+    # 硬链接到临时文件再替换，保证model_best.pth始终是完整的文件；文件系统不支持硬链接时退化为再写一次
+    try:
+        if os.path.exists(best_path + '.tmp'):
+            os.remove(best_path + '.tmp')
+        os.link(save_path, best_path + '.tmp')
+    except OSError:
+        save_function(state, best_path + '.tmp')
+    os.replace(best_path + '.tmp', best_path)
+
+
+class AsyncCheckpointWriter(object):
+    def __init__(self, max_pending=2):
+        """
+        Args:
+            max_pending: int, 最多有多少个尚未写完的快照；为0时在调用线程中同步保存
+        """
+        self.max_pending = max_pending
+        self.error = None
+        self.write_number, self.write_seconds = 0, 0.0
+        if max_pending > 0:
+            self.queue = queue.Queue(maxsize=max_pending)
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def submit(self, save_path, state, best_path=None, move=False, callback=None, save_function=None):
+        """ 提交一个保存任务，队列已满时阻塞直到后台线程写完较早的快照
+
+        Args:
+            save_path: str, 保存路径
+            state: dict, 要保存的内容，其中的tensor会立即复制到CPU
+            best_path: str, 不为None时同时发布为model_best
+            move: bool, 发布model_best时是否重命名而不是硬链接
+            callback: callable, 写完之后在后台线程中调用，例如将文件复制到OBS
+            save_function: callable, 见publish
+        """
+        self._raise_error()
+        task = (save_path, snapshot_to_cpu(state), best_path, move, callback, save_function)
+        if self.max_pending > 0:
+            self.queue.put(task)
+        else:
+            self._write(*task)
+
+    def wait(self):
+        """ 等待所有已提交的快照写完，后台线程出错时在此处抛出
+        """
+        if self.max_pending > 0:
+            self.queue.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError('Failed to save checkpoint in background.') from error
+
+    def format_stats(self):
+        """ 得到写入次数与平均写入时间的描述
+        """
+        return 'Checkpoint writes: %d, %.2fs per write' % (self.write_number, self.write_seconds / max(self.write_number, 1))
+
+    def _write(self, save_path, state, best_path, move, callback, save_function):
+        start_time = time.time()
+        publish(save_path, state, best_path, move, save_function)
+        self.write_number += 1
+        self.write_seconds += time.time() - start_time
+        if callback is not None:
+            callback()
+
+    def _run(self):
+        while True:
+            task = self.queue.get()
+            try:
+                self._write(*task)
+            except Exception as error:
+                self.error = error
+            finally:
+                self.queue.task_done()
@@ -0,0 +1,50 @@
+'''
+该文件的功能：--device cpu时的CPU训练设置
+
+只有CPU的节点上，模型计算的intra-op线程与DataLoader的worker进程共用同一组核，默认的设置（torch使用所有核、8个worker）会超额订阅。
+setup_cpu_threads在两者之间划分可用的核；模型与输入转换为channels_last，卷积直接使用oneDNN的NHWC实现，省去每一层的格式转换；
+enable_onednn_fusion在当前版本的pytorch支持时打开oneDNN的算子融合（对TorchScript的图生效），不支持时跳过
+'''
+import os
+import torch
+
+
+def get_available_cpus():
+    """ 当前进程允许使用的核数，考虑taskset/train_folds.py设置的CPU亲和性
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def setup_cpu_threads(num_workers, compute_threads=0):
+    """ 在模型计算线程与DataLoader的worker之间划分可用的核，并设置torch的线程数
+
+    Args:
+        num_workers: int, 期望的worker数
+        compute_threads: int, 模型计算的线程数，为0时保留至多四分之一的核给worker，其余用于计算
+    Returns:
+        compute_threads: int, 模型计算的线程数
+        num_workers: int, 调整后的worker数，不超过计算线程之外剩余的核数
+    """
+    cpus = get_available_cpus()
+    if compute_threads <= 0:
+        compute_threads = max(1, cpus - min(num_workers, cpus // 4))
+    num_workers = min(num_workers, max(cpus - compute_threads, 0))
+    torch.set_num_threads(compute_threads)
+    # worker进程中DataLoader已将torch的线程数设置为1
+    return compute_threads, num_workers
+
+
+def enable_onednn_fusion():
+    """ 打开oneDNN（mkldnn）及其算子融合
+
+    Returns:
+        enabled: bool, 当前版本的pytorch是否支持oneDNN的算子融合
+    """
+    if hasattr(torch.backends, 'mkldnn'):
+        torch.backends.mkldnn.enabled = True
+    if hasattr(torch.jit, 'enable_onednn_fusion'):
+        torch.jit.enable_onednn_fusion(True)
+        return True
+    return False
@@ -16,9 +16,9 @@ def generate_mixed_sample(beta, sample, target):
     """
     # generate mixed sample
     lam = np.random.beta(beta, beta)
-    rand_index = torch.randperm(sample.size()[0]).cuda()
+    rand_index = torch.randperm(sample.size()[0], device=sample.device)
     target_a = target
-    target_b = target[rand_index]
+    target_b = target[rand_index.to(target.device)]
     bbx1, bby1, bbx2, bby2 = rand_bbox(sample.size(), lam)
     sample[:, :, bbx1:bbx2, bby1:bby2] = sample[rand_index, :, bbx1:bbx2, bby1:bby2]
     # adjust lambda to exactly match pixel ratio
@@ -31,8 +31,8 @@ def rand_bbox(size, lam):
     W = size[2]
     H = size[3]
     cut_rat = np.sqrt(1. - lam)
-    cut_w = np.int(W * cut_rat)
-    cut_h = np.int(H * cut_rat)
+    cut_w = int(W * cut_rat)
+    cut_h = int(H * cut_rat)
 
     # uniform
     cx = np.random.randint(W)
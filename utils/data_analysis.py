@@ -5,6 +5,7 @@ plt.switch_backend('agg')
 import random
 import imagesize
 from matplotlib.font_manager import FontProperties
+from datasets.manifest import load_manifest
 
 
 class DatasetStatistic:
@@ -62,10 +63,9 @@ class DatasetStatistic:
         Returns:
             labels_number: dir {1: 256, 2:125, ...}
         """
-        image_names = self.get_image_names()
-        labels = [self.get_label(os.path.join(self.data_root, image_name)) for image_name in image_names]
+        _, labels = load_manifest(self.data_root)
         labels_number = {}
-        for label in labels:
+        for label in labels.tolist():
             if label in labels_number.keys():
                 labels_number[label] += 1
             else:
@@ -0,0 +1,129 @@
+'''
+该文件的功能：DistributedDataParallel训练所需的进程组初始化与跨进程通信
+
+使用torchrun启动时（环境变量中有WORLD_SIZE、RANK、LOCAL_RANK、MASTER_ADDR、MASTER_PORT）自动初始化进程组，
+每个进程使用一块GPU（nccl），没有GPU时使用gloo后端在CPU上运行，例如：
+    torchrun --nproc_per_node=4 train_classifier.py ...
+    torchrun --nnodes=2 --node_rank=0 --master_addr=<ip> --master_port=29500 --nproc_per_node=8 train_classifier.py ...
+直接使用python启动时world_size为1，所有函数退化为单进程的行为
+'''
+import os
+import pickle
+import torch
+import torch.distributed as dist
+
+
+def init_distributed(backend='', use_cuda=None):
+    """ 根据torchrun设置的环境变量初始化进程组
+
+    Args:
+        backend: str, 进程组的后端，为空时使用GPU训练则为nccl，否则为gloo
+        use_cuda: bool, 是否使用GPU训练，为None时根据是否有GPU判断；使用GPU时无论哪种后端，每个进程都使用local_rank对应的GPU
+    Returns:
+        rank: int, 当前进程的全局序号
+        world_size: int, 进程总数
+        local_rank: int, 当前进程在本节点上的序号，对应使用的GPU
+    """
+    world_size = int(os.environ.get('WORLD_SIZE', 1))
+    if world_size <= 1 or is_distributed():
+        return get_rank(), get_world_size(), int(os.environ.get('LOCAL_RANK', 0))
+    local_rank = int(os.environ.get('LOCAL_RANK', 0))
+    use_cuda = torch.cuda.is_available() if use_cuda is None else use_cuda
+    backend = backend or ('nccl' if use_cuda else 'gloo')
+    if use_cuda:
+        # gloo后端在GPU上训练时同样需要设置，否则所有进程都使用第0块GPU
+        torch.cuda.set_device(local_rank)
+    dist.init_process_group(backend=backend, init_method='env://')
+    print('Initialized process group: rank %d/%d, local rank %d, backend %s' % (get_rank(), world_size, local_rank, backend))
+    return get_rank(), world_size, local_rank
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    """ 只有rank 0负责日志、tensorboard与保存权重
+    """
+    return get_rank() == 0
+
+
+def _communication_device():
+    # nccl只支持GPU上的tensor
+    return torch.device('cuda', torch.cuda.current_device()) if dist.get_backend() == 'nccl' else torch.device('cpu')
+
+
+def broadcast_object(obj, src=0):
+    """ 将src进程上的可pickle对象广播到所有进程，例如随机种子与日志目录名
+
+    Args:
+        obj: 任意可pickle的对象，非src进程上的值被忽略
+        src: int, 源进程
+    Returns:
+        obj: src进程上的对象
+    """
+    if not is_distributed():
+        return obj
+    device = _communication_device()
+    data = torch.ByteTensor(list(pickle.dumps(obj))).to(device) if get_rank() == src else None
+    length = torch.LongTensor([data.numel() if data is not None else 0]).to(device)
+    dist.broadcast(length, src)
+    if data is None:
+        data = torch.empty(int(length.item()), dtype=torch.uint8, device=device)
+    dist.broadcast(data, src)
+    return pickle.loads(bytes(data.cpu().tolist()))
+
+
+def all_gather_array(array):
+    """ 收集所有进程上长度可能不同的一维数组，按照rank的顺序拼接
+
+    Args:
+        array: np.ndarray/tensor, 一维
+    Returns:
+        gathered: tensor, 位于CPU上
+    """
+    tensor = torch.as_tensor(array)
+    if not is_distributed():
+        return tensor
+    device = _communication_device()
+    tensor = tensor.to(device)
+    length = torch.LongTensor([tensor.numel()]).to(device)
+    lengths = [torch.zeros_like(length) for _ in range(get_world_size())]
+    dist.all_gather(lengths, length)
+    lengths = [int(each.item()) for each in lengths]
+    # all_gather要求各个进程的tensor形状相同，先补齐到最大长度
+    padded = torch.zeros(max(lengths), dtype=tensor.dtype, device=device)
+    padded[:tensor.numel()] = tensor
+    gathered = [torch.zeros_like(padded) for _ in lengths]
+    dist.all_gather(gathered, padded)
+    return torch.cat([each[:each_length].cpu() for each, each_length in zip(gathered, lengths)])
+
+
+def all_reduce_sum(value):
+    """ 对所有进程上的标量求和
+
+    Args:
+        value: float/tensor
+    Returns:
+        value: float
+    """
+    if not is_distributed():
+        return float(value)
+    tensor = torch.tensor([float(value)], dtype=torch.float64, device=_communication_device())
+    dist.all_reduce(tensor)
+    return tensor.item()
+
+
+class NullWriter(object):
+    """ 非rank 0进程上代替SummaryWriter，忽略所有写入
+    """
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
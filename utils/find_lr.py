@@ -10,6 +10,8 @@ from losses.get_loss import Loss
 from models.build_model import PrepareModel
 from config import get_classify_config
 from datasets.create_dataset import GetDataloader
+from datasets.loader_tuning import get_loader_params
+from datasets.class_aware_sampler import get_sampler_params
 from datasets.data_augmentation import DataAugmentation
 
 
@@ -145,7 +147,8 @@ if __name__ == "__main__":
         folds_split=folds_split, 
         test_size=test_size,
         choose_dataset=config.choose_dataset,
-        load_split_from_file=config.load_split_from_file
+        load_split_from_file=config.load_split_from_file,
+        data_format=config.data_format
         )
 
     train_dataloaders, val_dataloaders, train_labels_number_folds, _ = get_dataloader.get_dataloader(
@@ -153,7 +156,10 @@ if __name__ == "__main__":
         config.image_size,
         mean, std,
         transforms=transforms,
-        multi_scale=config.multi_scale
+        multi_scale=config.multi_scale,
+        loader_params=get_loader_params(config),
+        sampler=config.sampler,
+        sampler_params=get_sampler_params(config)
     )
 
     for fold_index, [train_loader, _, train_labels_number] in enumerate(
@@ -17,4 +17,30 @@ def seed_torch(seed):
     torch.cuda.manual_seed(seed)
     torch.cuda.manual_seed_all(seed) # if you are using multi-GPU.
     torch.backends.cudnn.benchmark = False
-    torch.backends.cudnn.deterministic = True
\ No newline at end of file
+    torch.backends.cudnn.deterministic = True
+
+def get_rng_state():
+    ''' 得到所有随机数生成器的状态，用于保存训练状态
+    return: dict
+    '''
+    state = {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state()
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    ''' 恢复get_rng_state保存的随机数生成器状态
+    Args:
+        state: dict, get_rng_state的返回值
+    return: None
+    '''
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])